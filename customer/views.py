@@ -2,10 +2,11 @@ from django.views.generic import ListView, CreateView, UpdateView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.shortcuts import reverse
 from .models import Customer
+from main.pagination import KeysetPaginationMixin
 
 # Create your views here.
 
-class CustomerListView(LoginRequiredMixin, ListView):
+class CustomerListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Customer
 
 
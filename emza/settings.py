@@ -41,6 +41,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'main',
     'stock',
     'product',
@@ -48,6 +49,8 @@ INSTALLED_APPS = [
     'customer',
     'pwa',
     'purchase',
+    'reports',
+    'jobs',
 ]
 
 MIDDLEWARE = [
@@ -136,6 +139,9 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# Files written by background jobs (e.g. exports); served only through the job download view
+MEDIA_ROOT = Path(os.environ.get('MEDIA_ROOT', BASE_DIR / 'media'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -162,9 +168,25 @@ PWA_APP_ICONS_APPLE = [
     }
 ]
 
-# use this if you want to use a custom serviceworker.js file
-#PWA_SERVICE_WORKER_PATH = 'serviceworker.js' 
+# Caches pages for offline use and queues sale bills made offline (see main/static/main/js/serviceworker.js)
+PWA_SERVICE_WORKER_PATH = BASE_DIR / 'main' / 'static' / 'main' / 'js' / 'serviceworker.js'
+
+
+
+# Bill numbering: '<prefix>-0001', or '<prefix>-2025-26-0001' with one series per financial year
+SALE_BILL_PREFIX = 'EMZA'
+PURCHASE_BILL_PREFIX = 'PUR'
+BILL_NUMBERS_PER_FINANCIAL_YEAR = os.environ.get('BILL_NUMBERS_PER_FINANCIAL_YEAR', 'False') == 'True'
+BILL_FINANCIAL_YEAR_START_MONTH = 4
+
+# Reorder levels: sales velocity over the window, supplier lead time, safety margin and days of stock to buy
+REORDER_WINDOW_DAYS = int(os.environ.get('REORDER_WINDOW_DAYS', 30))
+REORDER_LEAD_TIME_DAYS = int(os.environ.get('REORDER_LEAD_TIME_DAYS', 7))
+REORDER_SAFETY_DAYS = int(os.environ.get('REORDER_SAFETY_DAYS', 3))
+REORDER_COVER_DAYS = int(os.environ.get('REORDER_COVER_DAYS', 30))
 
+# Seconds a bill form's idempotency key is remembered; `manage.py sweep_idempotency_keys` deletes older ones
+IDEMPOTENCY_KEY_MAX_AGE = int(os.environ.get('IDEMPOTENCY_KEY_MAX_AGE', 60 * 60 * 24))
 
 
 LOGIN_URL = '/login'
@@ -9,6 +9,8 @@ urlpatterns = [
     path('sales/', include('sale.urls')),
     path('customers/', include('customer.urls')),
     path('purchases/', include('purchase.urls')),
+    path('reports/', include('reports.urls')),
+    path('jobs/', include('jobs.urls')),
     path('', include('main.urls')),
 ]
 
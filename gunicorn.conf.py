@@ -0,0 +1,30 @@
+"""
+Gunicorn configuration for serving emza over ASGI:
+
+    gunicorn -c gunicorn.conf.py
+
+Each worker is a Uvicorn event loop, so the async search and lookup views
+serve many POS terminals concurrently without a thread per request; sync
+views still run in Django's thread pool. Exports and the bulk API hand
+their lines over as async generators (main/streaming.py), since Django
+would read a sync iterator whole before sending any of it. Settings can be overridden from
+the environment (WEB_CONCURRENCY, PORT, GUNICORN_TIMEOUT).
+"""
+import multiprocessing
+import os
+
+wsgi_app = 'emza.asgi:application'
+worker_class = 'uvicorn_worker.UvicornWorker'
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+# An event loop per core; concurrency within a worker comes from async, not more processes
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then so a slow leak can't grow without bound
+max_requests = 2000
+max_requests_jitter = 200
+
+accesslog = '-'
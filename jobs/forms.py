@@ -0,0 +1,42 @@
+from django import forms
+
+from main.export import EXPORTS, FORMATS
+from reports.queries import PERIODS
+from .tasks import TASKS
+
+
+class JobForm(forms.Form):
+    task = forms.ChoiceField(choices=[(name, task.label) for name, task in TASKS.items()])
+    kind = forms.ChoiceField(choices=[(name, name.capitalize()) for name in EXPORTS], required=False, help_text="Exports only.")
+    start = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    end = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    format = forms.ChoiceField(choices=[(name, name.upper()) for name in FORMATS], required=False)
+    period = forms.ChoiceField(choices=[(name, name.capitalize()) for name in PERIODS], required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        input_classes = 'form-input flex w-full min-w-0 flex-1 resize-none overflow-hidden rounded-lg text-slate-900 dark:text-white placeholder:text-slate-400 dark:placeholder:text-neutral-500 focus:outline-0 focus:ring-1 focus:ring-primary border border-slate-300 dark:border-neutral-700 bg-slate-100/50 dark:bg-neutral-900/50 h-14 p-4 text-base font-normal leading-normal'
+        select_classes = 'form-select appearance-none flex w-full min-w-0 flex-1 resize-none overflow-hidden rounded-lg text-slate-900 dark:text-white placeholder:text-slate-400 dark:placeholder:text-neutral-500 focus:outline-0 focus:ring-1 focus:ring-primary border border-slate-300 dark:border-neutral-700 bg-slate-100/50 dark:bg-neutral-900/50 h-14 pl-4 pr-10 text-base font-normal leading-normal'
+        for name in ('task', 'kind', 'format', 'period'):
+            self.fields[name].widget.attrs.update({'class': select_classes})
+        for name in ('start', 'end'):
+            self.fields[name].widget.attrs.update({'class': input_classes})
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start, end = cleaned_data.get('start'), cleaned_data.get('end')
+        if start and end and start > end:
+            raise forms.ValidationError("The start date is after the end date.")
+        if cleaned_data.get('task') == 'reports' and not (start and end):
+            raise forms.ValidationError("Reports need a start and an end date.")
+        return cleaned_data
+
+    def enqueue(self, user=None):
+        from .models import Job
+
+        task = TASKS[self.cleaned_data['task']]
+        # Only the parameters the task takes, and only those that were filled in
+        params = {
+            name: self.cleaned_data[name] for name in task.params if self.cleaned_data.get(name) not in (None, '')
+        }
+        return Job.objects.enqueue(task.name, params, user=user)
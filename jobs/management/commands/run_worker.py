@@ -0,0 +1,94 @@
+import os
+import signal
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from django.utils import timezone
+
+from jobs.models import Job
+from jobs.tasks import run
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued background jobs. Jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED, "
+        "so any number of workers can run side by side. Stops after the current job on SIGTERM or Ctrl-C."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit when the queue is empty instead of waiting.")
+        parser.add_argument('--max-jobs', type=int, default=0, help="Exit after this many jobs (default: no limit).")
+        parser.add_argument('--poll', type=float, default=2.0, help="Seconds to wait between polls of an empty queue.")
+        parser.add_argument('--heartbeat', type=float, default=30.0, help="Seconds between heartbeats of a running job.")
+        parser.add_argument(
+            '--stale-after', type=float, default=600.0,
+            help="Queue again running jobs without a heartbeat for this many seconds.",
+        )
+        parser.add_argument('--name', default=f'{socket.gethostname()}:{os.getpid()}', help="Worker name.")
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self.stop)
+            signal.signal(signal.SIGINT, self.stop)
+
+        stale_after = timedelta(seconds=options['stale_after'])
+        done = 0
+        while not self.stopping:
+            close_old_connections()
+            job = Job.objects.claim(options['name'])
+            if job is None:
+                requeued = Job.objects.requeue_stale(stale_after)
+                if requeued:
+                    self.stdout.write(f"Queued {requeued} stale job(s) again.")
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['poll'])
+                continue
+
+            self.stdout.write(f"Running {job.name} #{job.pk} (attempt {job.attempts} of {job.max_attempts})")
+            with Heartbeat(job, options['heartbeat']):
+                succeeded = run(job)
+            if succeeded:
+                self.stdout.write(self.style.SUCCESS(f"Finished {job.name} #{job.pk}"))
+            else:
+                self.stdout.write(self.style.ERROR(f"{job.name} #{job.pk} failed: {job.error.strip().splitlines()[-1]}"))
+
+            done += 1
+            if options['max_jobs'] and done >= options['max_jobs']:
+                break
+        self.stdout.write(f"Worker stopped after {done} job(s).")
+
+    def stop(self, signum, frame):
+        self.stdout.write("Stopping after the current job.")
+        self.stopping = True
+
+
+class Heartbeat:
+    """Marks a running job as alive every ``interval`` seconds from a side thread, for tasks that don't report progress."""
+
+    def __init__(self, job, interval):
+        self.job = job
+        self.interval = interval
+        self.finished = threading.Event()
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.beat, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.finished.set()
+        self.thread.join()
+
+    def beat(self):
+        try:
+            while not self.finished.wait(self.interval):
+                Job.objects.filter(pk=self.job.pk).update(heartbeat_at=timezone.now())
+        finally:
+            connection.close()
@@ -0,0 +1,176 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.urls import reverse
+from django.utils import timezone
+
+# Create your models here.
+
+# Seconds before the first retry; each further retry waits twice as long
+RETRY_DELAY_SECONDS = 30
+
+
+class JobStatus(models.TextChoices):
+    QUEUED = "queued", "Queued"
+    RUNNING = "running", "Running"
+    SUCCEEDED = "succeeded", "Succeeded"
+    FAILED = "failed", "Failed"
+
+
+class JobQuerySet(models.QuerySet):
+    def enqueue(self, name, params=None, user=None, run_after=None, max_attempts=None):
+        """Queue task ``name`` (see jobs.tasks.TASKS) to run with ``params`` in a worker."""
+        from .tasks import TASKS
+
+        if name not in TASKS:
+            raise ValueError(f"Unknown task '{name}'.")
+        return self.create(
+            name=name,
+            params=params or {},
+            created_by=user,
+            run_after=run_after or timezone.now(),
+            max_attempts=max_attempts or TASKS[name].max_attempts,
+        )
+
+    def claim(self, worker):
+        """
+        Take the next due job for ``worker`` and mark it running, or return
+        None. The job is picked with SELECT ... FOR UPDATE SKIP LOCKED, so
+        concurrent workers never claim the same job and never wait on each
+        other's rows.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            job = (
+                self.select_for_update(skip_locked=True)
+                .filter(status=JobStatus.QUEUED, run_after__lte=now)
+                .order_by('run_after', 'id')
+                .first()
+            )
+            if job is None:
+                return None
+            job.status = JobStatus.RUNNING
+            job.attempts += 1
+            job.worker = worker
+            job.started_at = now
+            job.heartbeat_at = now
+            job.save(update_fields=['status', 'attempts', 'worker', 'started_at', 'heartbeat_at', 'updated_at'])
+        return job
+
+    def requeue_stale(self, timeout):
+        """
+        Queue again the running jobs whose worker hasn't reported for
+        ``timeout`` (it died mid-job), or fail them if they are out of
+        attempts. Returns the number queued again.
+        """
+        now = timezone.now()
+        stale = self.filter(status=JobStatus.RUNNING, heartbeat_at__lt=now - timeout)
+        stale.filter(attempts__gte=F('max_attempts')).update(
+            status=JobStatus.FAILED, error="The worker stopped while running this job.",
+            worker='', finished_at=now, updated_at=now,
+        )
+        return stale.update(status=JobStatus.QUEUED, worker='', updated_at=now)
+
+
+class Job(models.Model):
+    """
+    A unit of heavy work (an export, a rollup rebuild, a counter repair) run
+    by ``manage.py run_worker`` off the request path. ``params`` are the
+    keyword arguments of the task and ``result`` is what it returned.
+    """
+    name = models.CharField(max_length=100)
+    params = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    status = models.CharField(max_length=20, choices=JobStatus.choices, default=JobStatus.QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    progress_done = models.PositiveBigIntegerField(default=0)
+    progress_total = models.PositiveBigIntegerField(null=True, blank=True)
+    progress_message = models.CharField(max_length=255, blank=True)
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=255, blank=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = JobQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            # Workers only ever scan the queue for due jobs
+            models.Index(fields=['run_after', 'id'], condition=Q(status='queued'), name='job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.get_status_display()})"
+
+    def get_absolute_url(self):
+        return reverse('job-detail', kwargs={'pk': self.pk})
+
+    @property
+    def progress_percent(self):
+        if self.status == JobStatus.SUCCEEDED:
+            return 100
+        if not self.progress_total:
+            return None
+        return min(100, int(100 * self.progress_done / self.progress_total))
+
+    @property
+    def is_finished(self):
+        return self.status in (JobStatus.SUCCEEDED, JobStatus.FAILED)
+
+    def set_progress(self, done, total=None, message=''):
+        """Record progress from inside a running task; also serves as the worker's heartbeat."""
+        now = timezone.now()
+        self.progress_done, self.progress_total, self.progress_message, self.heartbeat_at = done, total, message[:255], now
+        # A plain UPDATE, so a task's own transaction never holds the job row
+        Job.objects.filter(pk=self.pk).update(
+            progress_done=done, progress_total=total, progress_message=message[:255],
+            heartbeat_at=now, updated_at=now,
+        )
+
+    def succeed(self, result=None):
+        self.status = JobStatus.SUCCEEDED
+        self.result = result
+        self.error = ''
+        self.finished_at = timezone.now()
+        self.save(update_fields=['status', 'result', 'error', 'finished_at', 'updated_at'])
+
+    def fail(self, error):
+        """Queue the job again with exponential backoff, or mark it failed once it is out of attempts."""
+        self.error = error
+        if self.attempts < self.max_attempts:
+            self.status = JobStatus.QUEUED
+            self.run_after = timezone.now() + timedelta(seconds=RETRY_DELAY_SECONDS * 2 ** (self.attempts - 1))
+        else:
+            self.status = JobStatus.FAILED
+            self.finished_at = timezone.now()
+        self.worker = ''
+        self.save(update_fields=['status', 'error', 'run_after', 'finished_at', 'worker', 'updated_at'])
+
+    def as_dict(self):
+        return {
+            'id': self.pk,
+            'name': self.name,
+            'params': self.params,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'progress_done': self.progress_done,
+            'progress_total': self.progress_total,
+            'progress_percent': self.progress_percent,
+            'progress_message': self.progress_message,
+            'result': self.result,
+            'error': self.error if self.status == JobStatus.FAILED else '',
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
@@ -0,0 +1,122 @@
+"""
+Tasks that can run as background jobs. A task is a function taking the
+running Job plus the job's ``params`` as keyword arguments; it may call
+``job.set_progress()`` as it goes, and whatever JSON-serialisable value it
+returns is stored as the job's result. Register one with ``@task(...)``.
+"""
+import os
+import tempfile
+import traceback
+from datetime import date, timedelta
+from io import StringIO
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+
+from main.export import CHUNK_SIZE, EXPORTS, FORMATS
+from main.models import IdempotencyKey
+from reports.queries import PERIODS, REPORTS, run_report
+
+TASKS = {}
+
+
+class Task:
+    def __init__(self, name, func, label, params=(), max_attempts=3):
+        self.name = name
+        self.func = func
+        self.label = label
+        self.params = params  # Names of the parameters the job form asks for
+        self.max_attempts = max_attempts
+
+    def __call__(self, job, **params):
+        return self.func(job, **params)
+
+
+def task(name, label, params=(), max_attempts=3):
+    def register(func):
+        TASKS[name] = Task(name, func, label, params, max_attempts)
+        return func
+    return register
+
+
+def run(job):
+    """Run a claimed job, storing its result or its error. Returns True if it succeeded."""
+    try:
+        result = TASKS[job.name](job, **job.params)
+    except Exception:
+        job.fail(traceback.format_exc())
+        return False
+    job.succeed(result)
+    return True
+
+
+def day(value):
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+@task('export', "Export sales or purchases", params=('kind', 'start', 'end', 'format'), max_attempts=2)
+def export(job, kind, start=None, end=None, format='csv'):
+    """Write a line-level export to storage; the file can then be downloaded from the job page."""
+    if kind not in EXPORTS or format not in FORMATS:
+        raise ValueError(f"Unknown export {kind}.{format}.")
+    start, end = day(start), day(end)
+    name = '-'.join([kind, *[value.isoformat() for value in (start, end) if value]])
+    rows = 0
+    with tempfile.TemporaryFile() as file:
+        for line in EXPORTS[kind].lines(format, start, end):
+            file.write(line.encode('utf-8'))
+            rows += 1
+            if rows % CHUNK_SIZE == 0:
+                job.set_progress(rows, message=f"{rows} lines written")
+        file.seek(0)
+        path = default_storage.save(f'exports/job-{job.pk}/{name}.{format}', File(file))
+    return {'file': path, 'filename': os.path.basename(path), 'lines': rows}
+
+
+@task('rebuild-daily-sales', "Rebuild daily sales rollups", params=('start', 'end'))
+def rebuild_daily_sales(job, start=None, end=None, days_per_batch=31):
+    """Rebuild the daily rollups one batch of days at a time, reporting each batch."""
+    from sale.management.commands.rebuild_daily_sales import sale_days
+
+    start, end = day(start), day(end)
+    if start is None or end is None:
+        first, last = sale_days()
+        start, end = start or first, end or last
+    if start is None or end is None:
+        return {'days': 0}
+
+    total = (end - start).days + 1
+    batch_start = start
+    while batch_start <= end:
+        batch_end = min(batch_start + timedelta(days=days_per_batch - 1), end)
+        call_command('rebuild_daily_sales', start=batch_start, end=batch_end, stdout=StringIO())
+        job.set_progress((batch_end - start).days + 1, total, f"Rebuilt up to {batch_end}")
+        batch_start = batch_end + timedelta(days=1)
+    return {'start': start, 'end': end, 'days': total}
+
+
+@task('repair-stock-counters', "Repair stock counters from the ledger")
+def repair_stock_counters(job):
+    output = StringIO()
+    call_command('stock_ledger', 'rebuild', stdout=output)
+    return {'output': output.getvalue().strip()}
+
+
+@task('sweep-idempotency-keys', "Delete expired idempotency keys")
+def sweep_idempotency_keys(job):
+    return {'deleted': IdempotencyKey.objects.sweep()}
+
+
+@task('reports', "Run every sales report", params=('start', 'end', 'period'))
+def reports(job, start, end, period='day'):
+    """Run each report for the range; closed ranges are also left in the report cache."""
+    start, end = day(start), day(end)
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period '{period}'.")
+    results = {}
+    for done, name in enumerate(REPORTS, start=1):
+        params = {'period': period} if name in ('revenue', 'discounts') else {}
+        results[name] = run_report(name, start, end, **params)
+        job.set_progress(done, len(REPORTS), f"Ran {name}")
+    return results
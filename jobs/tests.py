@@ -0,0 +1,105 @@
+from datetime import timedelta
+from io import StringIO
+from tempfile import TemporaryDirectory
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from purchase.models import PurchaseBill, StockPurchase
+from purchase.services import post_purchase_bill
+from stock.models import Stock, StockType
+from .models import Job, JobStatus
+from .tasks import run, task
+
+# Create your tests here.
+
+
+@task('test-flaky', "Fails on its first attempt")
+def flaky(job, fail_until=1):
+    job.set_progress(1, 2, "Halfway")
+    if job.attempts <= fail_until:
+        raise RuntimeError("Temporary failure")
+    return {'attempt': job.attempts}
+
+
+class JobQueueTests(TestCase):
+    def test_claim_takes_due_jobs_in_order(self):
+        later = Job.objects.enqueue('test-flaky', run_after=timezone.now() + timedelta(hours=1))
+        first = Job.objects.enqueue('test-flaky')
+        second = Job.objects.enqueue('test-flaky')
+
+        self.assertEqual(Job.objects.claim('a'), first)
+        claimed = Job.objects.claim('b')
+        self.assertEqual((claimed, claimed.status, claimed.attempts, claimed.worker), (second, JobStatus.RUNNING, 1, 'b'))
+        self.assertIsNone(Job.objects.claim('c'))
+        later.refresh_from_db()
+        self.assertEqual(later.status, JobStatus.QUEUED)
+
+    def test_failed_job_is_retried_with_backoff_then_succeeds(self):
+        job = Job.objects.enqueue('test-flaky')
+        self.assertFalse(run(Job.objects.claim('w')))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.progress_message), (JobStatus.QUEUED, "Halfway"))
+        self.assertIn("Temporary failure", job.error)
+        self.assertGreater(job.run_after, timezone.now())
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.assertTrue(run(Job.objects.claim('w')))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result, job.progress_percent), (JobStatus.SUCCEEDED, {'attempt': 2}, 100))
+
+    def test_job_fails_when_out_of_attempts(self):
+        job = Job.objects.enqueue('test-flaky', {'fail_until': 5}, max_attempts=1)
+        run(Job.objects.claim('w'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, JobStatus.FAILED)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_stale_running_jobs_are_requeued(self):
+        job = Job.objects.enqueue('test-flaky')
+        Job.objects.claim('dead')
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(Job.objects.requeue_stale(timedelta(minutes=10)), 1)
+        self.assertEqual(Job.objects.claim('w'), job)
+
+    def test_unknown_task_is_rejected(self):
+        with self.assertRaises(ValueError):
+            Job.objects.enqueue('no-such-task')
+
+
+class WorkerTests(TransactionTestCase):
+    # The worker closes stale connections between jobs, which a TestCase transaction would not survive
+    def setUp(self):
+        stock_type = StockType.objects.create(name='Oil')
+        stock = Stock.objects.create(name='CR7 Oil', stock_type=stock_type)
+        post_purchase_bill(PurchaseBill.objects.create(), [StockPurchase(stock=stock, quantity=10, price=5)])
+
+    def test_worker_runs_an_export_to_a_downloadable_file(self):
+        user = User.objects.create_user('manager', password='secret')
+        self.client.force_login(user)
+        with TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            response = self.client.post('/jobs/create/', {'task': 'export', 'kind': 'purchases', 'format': 'csv'})
+            job = Job.objects.get()
+            self.assertRedirects(response, job.get_absolute_url())
+            self.assertEqual(job.params, {'kind': 'purchases', 'format': 'csv'})
+
+            call_command('run_worker', '--once', stdout=StringIO())
+            status = self.client.get(f'/jobs/{job.pk}/status/').json()
+            self.assertEqual((status['status'], status['result']['lines']), ('succeeded', 2))
+
+            response = self.client.get(f'/jobs/{job.pk}/download/')
+            content = b''.join(response.streaming_content).decode()
+            self.assertTrue(content.startswith('bill_number,created_at,stock'))
+            response.close()
+
+        self.assertEqual(self.client.get('/jobs/').status_code, 200)
+        self.assertEqual(self.client.get(job.get_absolute_url()).status_code, 200)
+
+    def test_worker_repairs_stock_counters(self):
+        Stock.objects.update(purchase_quantity=0)
+        Job.objects.enqueue('repair-stock-counters')
+        call_command('run_worker', '--once', '--max-jobs', '1', stdout=StringIO())
+        self.assertEqual(Stock.objects.get().purchase_quantity, 10)
+        self.assertEqual(Job.objects.get().status, JobStatus.SUCCEEDED)
@@ -0,0 +1,10 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('', views.JobListView.as_view(), name='job-list'),
+    path('create/', views.job_create_view, name='job-create'),
+    path('<int:pk>/', views.JobDetailView.as_view(), name='job-detail'),
+    path('<int:pk>/status/', views.job_status_view, name='job-status'),
+    path('<int:pk>/download/', views.job_download_view, name='job-download'),
+]
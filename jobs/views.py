@@ -0,0 +1,59 @@
+import os
+
+from django.contrib.auth.decorators import login_required
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, JsonResponse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.views.generic import DetailView, ListView
+
+from main.pagination import KeysetPaginationMixin
+from .forms import JobForm
+from .models import Job, JobStatus
+from .tasks import TASKS
+
+# Create your views here.
+
+
+class JobListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
+    model = Job
+    template_name = 'jobs/job_list.html'
+    context_object_name = 'jobs'
+
+
+class JobDetailView(LoginRequiredMixin, DetailView):
+    model = Job
+    template_name = 'jobs/job_detail.html'
+    context_object_name = 'job'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        task = TASKS.get(self.object.name)
+        context['task_label'] = task.label if task else self.object.name
+        return context
+
+
+@login_required
+def job_create_view(request):
+    form = JobForm(request.POST or None)
+    if request.method == 'POST' and form.is_valid():
+        job = form.enqueue(user=request.user)
+        return redirect(job)
+    return render(request, 'jobs/job_form.html', {'form': form})
+
+
+@login_required
+def job_status_view(request, pk):
+    """The job's status, progress and result as JSON, for polling from the job page."""
+    job = get_object_or_404(Job, pk=pk)
+    return JsonResponse(job.as_dict())
+
+
+@login_required
+def job_download_view(request, pk):
+    """Download the file written by a finished export job."""
+    job = get_object_or_404(Job, pk=pk, status=JobStatus.SUCCEEDED)
+    path = (job.result or {}).get('file') if isinstance(job.result, dict) else None
+    if not path or not default_storage.exists(path):
+        raise Http404("This job has no file to download.")
+    return FileResponse(default_storage.open(path, 'rb'), as_attachment=True, filename=os.path.basename(path))
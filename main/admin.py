@@ -1,3 +1,7 @@
 from django.contrib import admin
+from .models import BillCounter, IdempotencyKey
 
 # Register your models here.
+
+admin.site.register(BillCounter)
+admin.site.register(IdempotencyKey)
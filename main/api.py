@@ -0,0 +1,238 @@
+"""
+JSON bulk API: shared plumbing for endpoints that write many bills or
+products in one call.
+
+A request carries a list of items, either as a JSON body (``{"items": [...]}``
+or a bare list) or as JSON lines (``Content-Type: application/x-ndjson``),
+which are read as they are processed so an upload of any size never sits
+in memory whole. Items are validated with the same checks as the CSV
+importer and written through the same services as the HTML forms, in
+chunks of ``chunk_size``: each chunk is one transaction and each item a
+savepoint in it, so one bad item is reported without undoing the others.
+The response is JSON lines too, one result per item in order, streamed as
+each chunk commits, and a final ``{"summary": {...}}`` line.
+"""
+import base64
+import binascii
+import json
+from collections import Counter
+
+from django.contrib.auth import authenticate
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, transaction
+from django.http import JsonResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+
+from stock.models import InsufficientStockError
+from .idempotency import KEY_PATTERN
+from .importer import RowError
+from .models import IdempotencyKey
+from .streaming import streaming_response
+
+CREATED, UPDATED, DUPLICATE, CONFLICT, INVALID = 'created', 'updated', 'duplicate', 'conflict', 'invalid'
+
+
+class ItemErrors(Exception):
+    """An item rejected with several messages at once, e.g. those of a form."""
+    status = INVALID
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+class ItemConflict(ItemErrors):
+    """An item that is valid but can't be written now, e.g. for lack of stock."""
+    status = CONFLICT
+
+
+class NotJSON:
+    """Stands in for a line of a JSON lines upload that doesn't parse."""
+
+
+def scalar_fields(item):
+    """An item's scalar values as strings, the way the importer's validators expect a CSV row."""
+    if item is NotJSON:
+        raise RowError("Not valid JSON.")
+    if not isinstance(item, dict):
+        raise RowError("Each item must be a JSON object.")
+    return {
+        name: '' if value is None else str(value).strip()
+        for name, value in item.items() if not isinstance(value, (dict, list))
+    }
+
+
+def ids(values):
+    """The values that are valid ids, e.g. to load a chunk's lookups; the others are reported when their item is parsed."""
+    valid = set()
+    for value in values:
+        try:
+            valid.add(int(str(value)))
+        except ValueError:
+            pass
+    return valid
+
+
+def item_list(item, name):
+    values = item.get(name)
+    if not isinstance(values, list) or not values:
+        raise RowError(f"'{name}' must be a non-empty list.")
+    return values
+
+
+class BulkWriter:
+    """
+    Writes a stream of items. Subclasses implement ``parse`` (validate an
+    item, raising RowError) and ``write`` (store a parsed item, returning
+    the object and its status), and may load lookups for a whole chunk in
+    ``load_maps``. Items may carry a ``key``, which makes them idempotent
+    in ``scope`` like a form submission: an item whose key was already
+    written is reported as a duplicate of the original.
+    """
+    chunk_size = 100
+    scope = None
+    success_url_name = None
+    require_key = False
+
+    def results(self, items):
+        chunk = []
+        for index, item in enumerate(items):
+            chunk.append((index, item))
+            if len(chunk) >= self.chunk_size:
+                yield from self.write_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield from self.write_chunk(chunk)
+
+    def write_chunk(self, chunk):
+        items = [item for index, item in chunk if isinstance(item, dict)]
+        keys = [item['key'] for item in items if isinstance(item.get('key'), str)]
+        results = []
+        with transaction.atomic():
+            self.posted = dict(
+                IdempotencyKey.objects.filter(scope=self.scope, key__in=keys)
+                .exclude(response_url='')
+                .values_list('key', 'object_id')
+            ) if keys and self.scope else {}
+            self.load_maps(items)
+            for index, item in chunk:
+                results.append({'index': index, 'key': None, 'id': None, 'errors': [], **self.write_item(item)})
+        self.describe(results)
+        return results
+
+    def write_item(self, item):
+        if item is NotJSON:
+            return {'status': INVALID, 'errors': ["Not valid JSON."]}
+        key = item.get('key') if isinstance(item, dict) else None
+        if key is None and self.require_key:
+            return {'status': INVALID, 'errors': ["A valid idempotency key is required."]}
+        if key is not None and (not isinstance(key, str) or not KEY_PATTERN.match(key)):
+            return {'key': key, 'status': INVALID, 'errors': ["A valid idempotency key is required."]}
+        if key in self.posted:
+            return {'key': key, 'status': DUPLICATE, 'id': self.posted[key]}
+
+        try:
+            parsed = self.parse(item)
+            with transaction.atomic():
+                if key is not None and not IdempotencyKey.objects.claim(self.scope, key):
+                    # Written by a form or another request while this one ran
+                    original = IdempotencyKey.objects.filter(scope=self.scope, key=key).values_list('object_id', flat=True).first()
+                    return {'key': key, 'status': DUPLICATE, 'id': original}
+                obj, status = self.write(parsed)
+                if key is not None:
+                    IdempotencyKey.objects.complete(self.scope, key, reverse(self.success_url_name), obj.pk)
+        except RowError as exc:
+            return {'key': key, 'status': INVALID, 'errors': [str(exc)]}
+        except ItemErrors as exc:
+            return {'key': key, 'status': exc.status, 'errors': exc.errors}
+        except InsufficientStockError as exc:
+            return {'key': key, 'status': CONFLICT, 'errors': [str(exc)]}
+        except DatabaseError as exc:
+            return {'key': key, 'status': INVALID, 'errors': [f"Not written: {exc}"]}
+        if key is not None:
+            self.posted[key] = obj.pk
+        return {'key': key, 'status': status, 'id': obj.pk}
+
+    def load_maps(self, items):
+        pass
+
+    def parse(self, item):
+        raise NotImplementedError
+
+    def write(self, parsed):
+        """Store a parsed item and return ``(object, CREATED or UPDATED)``."""
+        raise NotImplementedError
+
+    def describe(self, results):
+        """Add fields such as bill numbers to a chunk's results, with one query."""
+
+
+def read_items(request, name='items'):
+    """The items of a bulk request; see the module docstring. Raises ValueError for a malformed body."""
+    if request.content_type == 'application/x-ndjson':
+        return (parse_line(line) for line in request if line.strip())
+    body = json.loads(request.body)
+    items = body.get(name) if isinstance(body, dict) else body
+    if not isinstance(items, list):
+        raise ValueError(f"Expected a list of {name}.")
+    return items
+
+
+def parse_line(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return NotJSON
+
+
+def streamed_results(request, writer, items):
+    def lines():
+        counts = Counter()
+        for result in writer.results(items):
+            counts[result['status']] += 1
+            yield json.dumps(result, cls=DjangoJSONEncoder) + '\n'
+        yield json.dumps({'summary': dict(counts)}) + '\n'
+    return streaming_response(request, lines(), content_type='application/x-ndjson')
+
+
+def basic_auth_user(request):
+    """The active user named by an HTTP Basic Authorization header, or None."""
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'basic':
+        return None
+    try:
+        username, _, password = base64.b64decode(credentials).decode('utf-8').partition(':')
+    except (binascii.Error, UnicodeDecodeError):
+        return None
+    return authenticate(request, username=username, password=password)
+
+
+def bulk_api_view(writer_class, name='items'):
+    """
+    A POST endpoint writing the request's items with ``writer_class``.
+    Integrations authenticate with HTTP Basic; a logged-in browser session
+    works too, with the usual CSRF check.
+    """
+    @csrf_exempt
+    def view(request):
+        user = basic_auth_user(request)
+        if user is not None:
+            request.user = user
+        elif request.user.is_authenticated:
+            rejected = CsrfViewMiddleware(lambda request: None).process_view(request, None, (), {})
+            if rejected is not None:
+                return rejected
+        else:
+            response = JsonResponse({'error': 'Authentication required.'}, status=401)
+            response['WWW-Authenticate'] = 'Basic realm="emza"'
+            return response
+        if request.method != 'POST':
+            return JsonResponse({'error': 'Use POST.'}, status=405)
+        try:
+            items = read_items(request, name)
+        except ValueError as exc:
+            return JsonResponse({'error': f'Malformed request: {exc}'}, status=400)
+        return streamed_results(request, writer_class(), items)
+    return view
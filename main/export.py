@@ -0,0 +1,134 @@
+import csv
+import json
+from datetime import date, datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.http import JsonResponse
+from django.utils import timezone
+
+from purchase.models import StockPurchase
+from sale.models import ProductSale
+from .streaming import streaming_response
+
+CHUNK_SIZE = 2000
+FORMATS = ('csv', 'jsonl')
+
+
+class Echo:
+    """File-like object whose write() hands the line back, so csv.writer can feed a generator."""
+
+    def write(self, value):
+        return value
+
+
+class Export:
+    """
+    A flat, line-level export of bills and their lines.
+
+    Rows come from a single ``values_list`` projection over the line model
+    (the bill, customer and product columns are joined in, not loaded per
+    row) and are read with ``iterator(chunk_size=...)``, which on PostgreSQL
+    uses a server-side cursor. Memory use therefore does not grow with the
+    date range, and the first rows go out as soon as the first chunk arrives.
+    """
+
+    def __init__(self, name, queryset, columns, bill_prefix):
+        self.name = name
+        self.queryset = queryset
+        self.columns = columns  # [(header, field lookup)]
+        self.bill_prefix = bill_prefix
+
+    @property
+    def header(self):
+        return [header for header, lookup in self.columns]
+
+    def rows(self, start=None, end=None, chunk_size=CHUNK_SIZE):
+        lines = self.queryset()
+        # Bounds on created_at itself, rather than created_at__date, so the (created_at, id) index is used
+        if start:
+            lines = lines.filter(**{f'{self.bill_prefix}__created_at__gte': day_start(start)})
+        if end:
+            lines = lines.filter(**{f'{self.bill_prefix}__created_at__lt': day_start(end + timedelta(days=1))})
+        lines = lines.order_by(f'{self.bill_prefix}__created_at', f'{self.bill_prefix}_id', 'id')
+        return lines.values_list(*[lookup for header, lookup in self.columns]).iterator(chunk_size=chunk_size)
+
+    def csv_lines(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(self.header)
+        for row in rows:
+            yield writer.writerow(localise(row))
+
+    def jsonl_lines(self, rows):
+        header = self.header
+        for row in rows:
+            yield json.dumps(dict(zip(header, localise(row))), cls=DjangoJSONEncoder) + '\n'
+
+    def lines(self, output_format, start=None, end=None, chunk_size=CHUNK_SIZE):
+        rows = self.rows(start, end, chunk_size)
+        if output_format == 'jsonl':
+            return self.jsonl_lines(rows)
+        return self.csv_lines(rows)
+
+    def response(self, request, output_format='csv', start=None, end=None):
+        content_type = 'application/x-ndjson' if output_format == 'jsonl' else 'text/csv'
+        response = streaming_response(request, self.lines(output_format, start, end), content_type=content_type)
+        filename = '-'.join([self.name, *[day.isoformat() for day in (start, end) if day]])
+        response['Content-Disposition'] = f'attachment; filename="{filename}.{output_format}"'
+        return response
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def localise(row):
+    # Timestamps are exported in the local time zone, the way they are shown in the app
+    return [timezone.localtime(value) if isinstance(value, datetime) else value for value in row]
+
+
+EXPORTS = {
+    'sales': Export(
+        'sales',
+        lambda: ProductSale.objects.annotate(amount=F('quantity') * F('price')),
+        [
+            ('bill_number', 'salebill__bill_number'),
+            ('created_at', 'salebill__created_at'),
+            ('customer', 'salebill__customer__name'),
+            ('phone_number', 'salebill__customer__phone_number'),
+            ('product', 'product__name'),
+            ('quantity', 'quantity'),
+            ('price', 'price'),
+            ('amount', 'amount'),
+            ('bill_discount', 'salebill__discount'),
+            ('bill_net_amount', 'salebill__net_amount'),
+        ],
+        bill_prefix='salebill',
+    ),
+    'purchases': Export(
+        'purchases',
+        lambda: StockPurchase.objects.annotate(amount=F('quantity') * F('price')),
+        [
+            ('bill_number', 'purchasebill__bill_number'),
+            ('created_at', 'purchasebill__created_at'),
+            ('stock', 'stock__name'),
+            ('quantity', 'quantity'),
+            ('price', 'price'),
+            ('amount', 'amount'),
+        ],
+        bill_prefix='purchasebill',
+    ),
+}
+
+
+def export_view_response(request, name):
+    """Stream the ``name`` export for ?start=&end= (YYYY-MM-DD, inclusive) and ?format=csv|jsonl."""
+    output_format = request.GET.get('format', 'csv')
+    try:
+        start = date.fromisoformat(request.GET['start']) if request.GET.get('start') else None
+        end = date.fromisoformat(request.GET['end']) if request.GET.get('end') else None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid start or end parameter.'}, status=400)
+    if output_format not in FORMATS:
+        return JsonResponse({'error': f"format must be one of {', '.join(FORMATS)}."}, status=400)
+    return EXPORTS[name].response(request, output_format, start, end)
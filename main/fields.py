@@ -0,0 +1,138 @@
+from django import forms
+from django.forms.models import BaseInlineFormSet
+from django.core.exceptions import ValidationError
+from django.utils.functional import cached_property
+
+
+class LazySelect(forms.Select):
+    """
+    A select that renders only the empty option and the selected one. The
+    other choices are fetched by Select2 from a search endpoint, so a form
+    row never iterates the whole queryset.
+    """
+    instances = None  # {pk: instance}, filled in by LazyChoiceFormSetMixin
+
+    def optgroups(self, name, value, attrs=None):
+        field = self.field
+        options = []
+        if field.empty_label is not None:
+            options.append(self.create_option(name, '', field.empty_label, not any(value), 0))
+
+        selected = [v for v in value if v not in field.empty_values]
+        instances = self.instances
+        if instances is None and selected:
+            instances = field.queryset.in_bulk(_keys(field, selected))
+        for index, key in enumerate(_keys(field, selected), start=len(options)):
+            instance = instances.get(key)
+            if instance is not None:
+                options.append(self.create_option(name, key, field.label_from_instance(instance), True, index))
+        return [(None, options, 0)]
+
+
+class LazyModelChoiceField(forms.ModelChoiceField):
+    """
+    ModelChoiceField for Select2 AJAX selects: renders through LazySelect
+    and, when used in a LazyChoiceFormSetMixin formset, validates the
+    submitted id against instances loaded once for the whole formset
+    instead of running one query per row.
+    """
+    widget = LazySelect
+
+    def __init__(self, queryset, **kwargs):
+        super().__init__(queryset, **kwargs)
+        self.widget.field = self
+        self.instances = None
+
+    def __deepcopy__(self, memo):
+        result = super().__deepcopy__(memo)
+        result.widget.field = result
+        return result
+
+    def set_instances(self, instances):
+        self.instances = instances
+        self.widget.instances = instances
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        if self.instances is None:
+            return super().to_python(value)
+        try:
+            key = self.queryset.model._meta.pk.to_python(value.pk if isinstance(value, self.queryset.model) else value)
+        except (TypeError, ValidationError):
+            key = None
+        if key not in self.instances:
+            raise ValidationError(
+                self.error_messages['invalid_choice'],
+                code='invalid_choice',
+                params={'value': value},
+            )
+        return self.instances[key]
+
+
+def _keys(field, values):
+    keys = []
+    for value in values:
+        try:
+            keys.append(field.queryset.model._meta.pk.to_python(value))
+        except ValidationError:
+            pass
+    return keys
+
+
+class LazyChoiceFormSetMixin:
+    """
+    Loads the selected instances of every LazyModelChoiceField in the
+    formset with one ``in_bulk`` query per field, and shares them with all
+    rows for rendering and validation.
+    """
+
+    @cached_property
+    def forms(self):
+        forms = super().forms
+        self.load_lazy_choices(forms)
+        return forms
+
+    def load_lazy_choices(self, forms):
+        names = {
+            name for form in forms for name, field in form.fields.items()
+            if isinstance(field, LazyModelChoiceField)
+        }
+        for name in names:
+            fields, values = [], []
+            for form in forms:
+                field = form.fields[name]
+                fields.append(field)
+                value = form.data.get(form.add_prefix(name)) if form.is_bound else form.initial.get(name)
+                if value not in field.empty_values:
+                    values.append(getattr(value, 'pk', value))
+            instances = fields[0].queryset.in_bulk(_keys(fields[0], values)) if values else {}
+            for field in fields:
+                field.set_instances(instances)
+
+
+class LazyChoiceInlineFormSet(LazyChoiceFormSetMixin, BaseInlineFormSet):
+    pass
+
+
+class LazyChoiceModelForm(forms.ModelForm):
+    """
+    ModelForm whose LazyModelChoiceFields are not checked again by the
+    instance's full_clean(): the field has already matched the id against
+    its queryset, and ForeignKey.validate() would repeat that with one query
+    per row. The formset's uniqueness checks still see these fields.
+    """
+    _cleaning_instance = False
+
+    def _post_clean(self):
+        self._cleaning_instance = True
+        try:
+            super()._post_clean()
+        finally:
+            self._cleaning_instance = False
+
+    def _get_validation_exclusions(self):
+        exclude = super()._get_validation_exclusions()
+        if self._cleaning_instance:
+            exclude.update(name for name, field in self.fields.items() if isinstance(field, LazyModelChoiceField))
+        return exclude
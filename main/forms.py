@@ -0,0 +1,29 @@
+import io
+
+from django import forms
+
+from .importer import IMPORTERS
+
+
+class InventoryImportForm(forms.Form):
+    kind = forms.ChoiceField(choices=[
+        ('stocks', 'Stocks (name, type, metric, opening_quantity)'),
+        ('products', 'Products (product, price, stock, quantity)'),
+        ('purchases', 'Purchases (bill, stock, quantity, price)'),
+    ])
+    file = forms.FileField(help_text="CSV with a header row.")
+    batch_size = forms.IntegerField(min_value=1, max_value=10000, initial=1000)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        input_classes = 'form-input flex w-full min-w-0 flex-1 resize-none overflow-hidden rounded-lg text-slate-900 dark:text-white placeholder:text-slate-400 dark:placeholder:text-neutral-500 focus:outline-0 focus:ring-1 focus:ring-primary border border-slate-300 dark:border-neutral-700 bg-slate-100/50 dark:bg-neutral-900/50 h-14 p-4 text-base font-normal leading-normal'
+        select_classes = 'form-select appearance-none flex w-full min-w-0 flex-1 resize-none overflow-hidden rounded-lg text-slate-900 dark:text-white placeholder:text-slate-400 dark:placeholder:text-neutral-500 focus:outline-0 focus:ring-1 focus:ring-primary border border-slate-300 dark:border-neutral-700 bg-slate-100/50 dark:bg-neutral-900/50 h-14 pl-4 pr-10 text-base font-normal leading-normal'
+        self.fields['kind'].widget.attrs.update({'class': select_classes})
+        self.fields['file'].widget.attrs.update({'class': 'text-slate-900 dark:text-white', 'accept': '.csv,text/csv'})
+        self.fields['batch_size'].widget.attrs.update({'class': input_classes})
+
+    def run_import(self):
+        importer = IMPORTERS[self.cleaned_data['kind']](batch_size=self.cleaned_data['batch_size'])
+        # Decode the upload as it is read, so large files are never held in memory as text
+        with io.TextIOWrapper(self.cleaned_data['file'], encoding='utf-8-sig', newline='') as file:
+            return importer.run(file)
@@ -0,0 +1,63 @@
+import re
+import uuid
+
+from django.shortcuts import redirect
+
+from .models import IdempotencyKey
+
+KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]{8,100}$')
+
+
+class IdempotentCreateMixin:
+    """
+    Makes a create view safe to submit twice. The form carries a key (a
+    hidden ``idempotency_key`` field rendered with a fresh one, or an
+    ``Idempotency-Key`` header from API clients); the first submission to
+    succeed records it with the URL it redirected to, inside the same
+    transaction as the bill, and any later submission with the same key is
+    redirected there without touching the database again.
+
+    In ``form_valid``, inside the transaction::
+
+        if not self.claim_idempotency_key():
+            return self.replay_idempotent()
+        ...create the object...
+        self.complete_idempotency_key(url, obj)
+    """
+    idempotency_scope = None
+    idempotency_field = 'idempotency_key'
+
+    def get_idempotency_key(self):
+        key = self.request.headers.get('Idempotency-Key') or self.request.POST.get(self.idempotency_field, '')
+        return key if KEY_PATTERN.match(key) else None
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # A form shown again after errors keeps its key, so fixing it and resubmitting is still one bill
+        context['idempotency_key'] = self.get_idempotency_key() or uuid.uuid4().hex
+        return context
+
+    def dispatch(self, request, *args, **kwargs):
+        # Before the view's own post(), so a retry isn't validated against stock it already used
+        if request.method == 'POST':
+            response = self.replay_idempotent()
+            if response is not None:
+                return response
+        return super().dispatch(request, *args, **kwargs)
+
+    def replay_idempotent(self):
+        """The original redirect if this key already created something, else None."""
+        key = self.get_idempotency_key()
+        url = key and IdempotencyKey.objects.replay(self.idempotency_scope, key)
+        return redirect(url) if url else None
+
+    def claim_idempotency_key(self):
+        """False if another submission with this key got there first; True without a key."""
+        key = self.get_idempotency_key()
+        return key is None or IdempotencyKey.objects.claim(self.idempotency_scope, key)
+
+    def complete_idempotency_key(self, url, obj=None):
+        key = self.get_idempotency_key()
+        if key is not None:
+            IdempotencyKey.objects.complete(self.idempotency_scope, key, url, getattr(obj, 'pk', None))
+        return redirect(url)
@@ -0,0 +1,289 @@
+import csv
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.db import DatabaseError, transaction
+
+from product.availability import bom
+from product.models import Product, StockVariant
+from product.search import product_search
+from purchase.models import PurchaseBill, StockPurchase
+from stock.models import MetricChoices, MovementKind, Stock, StockMovement, StockType
+from stock.search import stock_search
+
+
+class RowError(ValueError):
+    """A problem with one CSV row or API item; it is reported and the row is skipped."""
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.errors = []  # [(line number, message)]
+
+    def add_error(self, line, message):
+        self.errors.append((line, str(message)))
+
+    def __str__(self):
+        return f"{self.rows} row(s) read, {self.created} imported, {len(self.errors)} error(s)"
+
+
+class CSVImporter:
+    """
+    Stream a CSV file into the database in batches.
+
+    Rows are read one at a time with csv.DictReader and turned into unsaved
+    model instances by ``parse_row``, resolving names through in-memory
+    name -> id maps loaded once up front. Every ``batch_size`` parsed rows
+    are written by ``write_batch`` with bulk_create inside one transaction,
+    so memory stays flat and a failing batch doesn't undo earlier ones. A
+    bad row is recorded in ``result.errors`` and skipped.
+    """
+    required_columns = ()
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.result = ImportResult()
+
+    def run(self, file):
+        reader = csv.DictReader(file)
+        columns = {column.strip().lower() for column in reader.fieldnames or ()}
+        missing = [column for column in self.required_columns if column not in columns]
+        if missing:
+            self.result.add_error(1, f"Missing column(s): {', '.join(missing)}")
+            return self.result
+
+        self.load_maps()
+        batch = []
+        for row in reader:
+            self.result.rows += 1
+            line = reader.line_num
+            row = {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+            try:
+                batch.append((line, self.parse_row(row)))
+            except RowError as exc:
+                self.result.add_error(line, exc)
+                continue
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+        if batch:
+            self._flush(batch)
+        return self.result
+
+    def _flush(self, batch):
+        try:
+            with transaction.atomic():
+                self.result.created += self.write_batch([item for line, item in batch])
+        except (DatabaseError, ValueError) as exc:
+            self.rollback_batch([item for line, item in batch])
+            for line, item in batch:
+                self.result.add_error(line, f"Batch not imported: {exc}")
+
+    def load_maps(self):
+        pass
+
+    def parse_row(self, row):
+        raise NotImplementedError
+
+    def write_batch(self, items):
+        """Write one batch and return the number of rows imported."""
+        raise NotImplementedError
+
+    def rollback_batch(self, items):
+        """Forget names that were reserved by a batch that failed to write."""
+
+    @staticmethod
+    def required(row, column):
+        value = row.get(column, '')
+        if not value:
+            raise RowError(f"'{column}' is required.")
+        return value
+
+    @staticmethod
+    def integer(row, column, default=None, minimum=None):
+        value = row.get(column, '')
+        if not value and default is not None:
+            return default
+        try:
+            number = int(value)
+        except ValueError:
+            raise RowError(f"'{column}' must be a whole number, got '{value}'.")
+        if minimum is not None and number < minimum:
+            raise RowError(f"'{column}' must be at least {minimum}.")
+        return number
+
+    @staticmethod
+    def decimal(row, column):
+        value = row.get(column, '')
+        try:
+            number = Decimal(value)
+        except InvalidOperation:
+            raise RowError(f"'{column}' must be a number, got '{value}'.")
+        if not number.is_finite() or number < 0:
+            raise RowError(f"'{column}' must be a positive number.")
+        return number.quantize(Decimal('0.01'))
+
+
+class StockImporter(CSVImporter):
+    """Columns: name, type, metric (pcs/ml, optional), opening_quantity (optional)."""
+    required_columns = ('name', 'type')
+
+    def load_maps(self):
+        self.stock_ids = dict(Stock.objects.values_list('name', 'pk'))
+        self.type_ids = {(name, metric): pk for pk, name, metric in StockType.objects.values_list('pk', 'name', 'metric')}
+        self.pending_types = {}  # Types first used by the current batch, created with it
+
+    def parse_row(self, row):
+        name = self.required(row, 'name')
+        if name in self.stock_ids:
+            raise RowError(f"Stock '{name}' already exists.")
+        metric = row.get('metric') or MetricChoices.PIECE
+        if metric not in MetricChoices.values:
+            raise RowError(f"'metric' must be one of {', '.join(MetricChoices.values)}.")
+        type_key = (self.required(row, 'type'), metric)
+        opening_quantity = self.integer(row, 'opening_quantity', default=0, minimum=0)
+
+        self.stock_ids[name] = None  # Reserved, so a repeated name in the file is reported
+        if type_key in self.type_ids:
+            return Stock(name=name, stock_type_id=self.type_ids[type_key], opening_quantity=opening_quantity)
+        stock_type = self.pending_types.setdefault(type_key, StockType(name=type_key[0], metric=metric))
+        return Stock(name=name, stock_type=stock_type, opening_quantity=opening_quantity)
+
+    def write_batch(self, stocks):
+        # New types are written with the batch, so a batch that fails leaves none behind
+        StockType.objects.bulk_create(list(self.pending_types.values()))
+        for stock in stocks:
+            if stock.stock_type_id is None:
+                stock.stock_type_id = stock.stock_type.pk
+        Stock.objects.bulk_create(stocks)
+        # bulk_create skips Stock.save(), so record the opening balances in the ledger here,
+        # and its signals, so clear the stock search
+        StockMovement.objects.record({stock.pk: stock.opening_quantity for stock in stocks}, MovementKind.OPENING)
+        transaction.on_commit(stock_search.invalidate)
+        for stock in stocks:
+            self.stock_ids[stock.name] = stock.pk
+        for type_key, stock_type in self.pending_types.items():
+            self.type_ids[type_key] = stock_type.pk
+        self.pending_types = {}
+        return len(stocks)
+
+    def rollback_batch(self, stocks):
+        self.pending_types = {}
+        for stock in stocks:
+            self.stock_ids.pop(stock.name, None)
+
+
+class ProductImporter(CSVImporter):
+    """
+    Columns: product, price, stock, quantity. Each row is one stock variant;
+    consecutive or scattered rows with the same product name add variants to
+    the same product. ``price`` is needed on the first row of a new product.
+    """
+    required_columns = ('product', 'stock', 'quantity')
+
+    def load_maps(self):
+        self.stock_ids = dict(Stock.objects.values_list('name', 'pk'))
+        self.product_ids = dict(Product.objects.values_list('name', 'pk'))
+        self.variants = set(StockVariant.objects.values_list('product__name', 'stock_id'))
+        self.pending = {}  # Products of the current batch, by name
+
+    def parse_row(self, row):
+        name = self.required(row, 'product')
+        stock_name = self.required(row, 'stock')
+        stock_id = self.stock_ids.get(stock_name)
+        if stock_id is None:
+            raise RowError(f"Unknown stock '{stock_name}'.")
+        quantity = self.integer(row, 'quantity', minimum=1)
+
+        product_id = self.product_ids.get(name)
+        product = self.pending.get(name)
+        if product_id is None and product is None:
+            product = Product(name=name, price=self.decimal(row, 'price'))
+
+        key = (name, stock_id)
+        if key in self.variants:
+            raise RowError(f"'{name}' already uses stock '{stock_name}'.")
+        self.variants.add(key)
+        if product is not None:
+            self.pending[name] = product
+        return StockVariant(product_id=product_id, product=product, stock_id=stock_id, quantity=quantity)
+
+    def write_batch(self, variants):
+        products = list(self.pending.values())
+        Product.objects.bulk_create(products)
+        for variant in variants:
+            if variant.product is not None:
+                variant.product_id = variant.product.pk
+        StockVariant.objects.bulk_create(variants)
+        # bulk_create skips the signals that keep the compiled recipes and the product search current
+        bom.changed()
+        transaction.on_commit(product_search.invalidate)
+
+        # Later batches refer to these products by id
+        for product in products:
+            self.product_ids[product.name] = product.pk
+        self.pending = {}
+        return len(variants)
+
+    def rollback_batch(self, variants):
+        self.pending = {}
+        names = {pk: name for name, pk in self.product_ids.items()}
+        self.variants.difference_update(
+            (variant.product.name if variant.product else names.get(variant.product_id), variant.stock_id)
+            for variant in variants
+        )
+
+
+class PurchaseImporter(CSVImporter):
+    """
+    Columns: bill, stock, quantity, price. ``bill`` is any reference that
+    groups the lines of one purchase bill within the file; each distinct
+    reference becomes a new PurchaseBill numbered from the purchase series.
+    """
+    required_columns = ('bill', 'stock', 'quantity', 'price')
+
+    def load_maps(self):
+        self.stock_ids = dict(Stock.objects.values_list('name', 'pk'))
+        self.bills = {}  # File reference -> PurchaseBill
+        self.new_references = []
+
+    def parse_row(self, row):
+        reference = self.required(row, 'bill')
+        stock_name = self.required(row, 'stock')
+        stock_id = self.stock_ids.get(stock_name)
+        if stock_id is None:
+            raise RowError(f"Unknown stock '{stock_name}'.")
+        quantity = self.integer(row, 'quantity', minimum=1)
+        price = self.decimal(row, 'price')
+        return reference, StockPurchase(stock_id=stock_id, quantity=quantity, price=price)
+
+    def write_batch(self, lines):
+        self.new_references = list(dict.fromkeys(reference for reference, line in lines if reference not in self.bills))
+        new_bills = PurchaseBill.objects.bulk_create([PurchaseBill() for reference in self.new_references])
+        self.bills.update(zip(self.new_references, new_bills))
+
+        # The whole batch is posted at once, whatever number of bills it spans: one
+        # stock UPDATE, one ledger insert split by bill and one insert of the lines
+        totals, by_bill = defaultdict(int), defaultdict(lambda: defaultdict(int))
+        for reference, line in lines:
+            line.purchasebill = self.bills[reference]
+            totals[line.stock_id] += line.quantity
+            by_bill[line.purchasebill][line.stock_id] += line.quantity
+        Stock.objects.purchase(totals, record=False)
+        StockMovement.objects.record_many(by_bill.items(), MovementKind.PURCHASE)
+        StockPurchase.objects.bulk_create([line for reference, line in lines])
+        return len(lines)
+
+    def rollback_batch(self, lines):
+        # Bills created by the failed batch were rolled back with it
+        for reference in self.new_references:
+            self.bills.pop(reference, None)
+
+
+IMPORTERS = {
+    'stocks': StockImporter,
+    'products': ProductImporter,
+    'purchases': PurchaseImporter,
+}
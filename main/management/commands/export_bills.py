@@ -0,0 +1,32 @@
+import sys
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.export import CHUNK_SIZE, EXPORTS, FORMATS
+
+
+class Command(BaseCommand):
+    help = "Export sale or purchase lines for a date range as CSV or JSON lines, streaming rows from the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--start', type=date.fromisoformat, help="First day to include (YYYY-MM-DD).")
+        parser.add_argument('--end', type=date.fromisoformat, help="Last day to include (YYYY-MM-DD).")
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--output', '-o', help="File to write (default: standard output).")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        lines = EXPORTS[options['kind']].lines(
+            options['format'], options['start'], options['end'], chunk_size=options['chunk_size']
+        )
+        if not options['output']:
+            sys.stdout.writelines(lines)
+            return
+        try:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as file:
+                file.writelines(lines)
+        except OSError as exc:
+            raise CommandError(exc)
+        self.stderr.write(self.style.SUCCESS(f"Wrote {options['output']}."))
@@ -0,0 +1,37 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.importer import IMPORTERS
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk import a CSV file. 'stocks' expects name,type,metric,opening_quantity; "
+        "'products' expects product,price,stock,quantity (one row per stock variant); "
+        "'purchases' expects bill,stock,quantity,price (rows sharing a bill reference form one bill)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS))
+        parser.add_argument('path', help="CSV file to import, or '-' for standard input.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--show-errors', type=int, default=50, help="How many row errors to print.")
+
+    def handle(self, *args, **options):
+        importer = IMPORTERS[options['kind']](batch_size=options['batch_size'])
+        if options['path'] == '-':
+            result = importer.run(sys.stdin)
+        else:
+            try:
+                with open(options['path'], newline='', encoding='utf-8-sig') as file:
+                    result = importer.run(file)
+            except OSError as exc:
+                raise CommandError(exc)
+
+        for line, message in result.errors[:options['show_errors']]:
+            self.stderr.write(f"Line {line}: {message}")
+        if len(result.errors) > options['show_errors']:
+            self.stderr.write(f"... and {len(result.errors) - options['show_errors']} more error(s).")
+        style = self.style.WARNING if result.errors else self.style.SUCCESS
+        self.stdout.write(style(str(result)))
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from main.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Delete the idempotency keys of bill submissions that are too old to be retried."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--max-age', type=int,
+            help="Delete keys older than this many seconds (default: the IDEMPOTENCY_KEY_MAX_AGE setting).",
+        )
+
+    def handle(self, *args, **options):
+        max_age = timedelta(seconds=options['max_age']) if options['max_age'] is not None else None
+        deleted = IdempotencyKey.objects.sweep(max_age)
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired idempotency key(s)."))
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-18 08:07
+
+from django.db import migrations, models
+from django.db.models import Max
+from django.utils import timezone
+
+
+def seed_counters(apps, schema_editor):
+    # Existing bills were numbered from their ids; continue each series after the highest one
+    BillCounter = apps.get_model('main', 'BillCounter')
+    for app_label, model_name, prefix in [('sale', 'SaleBill', 'EMZA'), ('purchase', 'PurchaseBill', 'PUR')]:
+        model = apps.get_model(app_label, model_name)
+        last_number = model.objects.aggregate(last=Max('id'))['last'] or 0
+        BillCounter.objects.create(series=prefix, last_number=last_number, updated_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('sale', '0004_created_at_id_index'),
+        ('purchase', '0002_created_at_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('series', models.CharField(max_length=50, unique=True)),
+                ('last_number', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,146 @@
-from django.db import models
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, connections, models
+from django.utils import timezone
 
 # Create your models here.
+
+
+class BillCounterQuerySet(models.QuerySet):
+    def allocate(self, series, count=1):
+        """
+        Reserve ``count`` consecutive numbers in ``series`` and return the
+        first one. A single INSERT ... ON CONFLICT DO UPDATE creates the
+        counter on first use and row-locks it until the transaction ends, so
+        concurrent bills never receive the same number.
+        """
+        table = connection.ops.quote_name(BillCounter._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (series, last_number, updated_at) VALUES (%s, %s, %s) "
+                f"ON CONFLICT (series) DO UPDATE SET last_number = {table}.last_number + EXCLUDED.last_number, "
+                f"updated_at = EXCLUDED.updated_at "
+                f"RETURNING last_number",
+                [series, count, timezone.now()],
+            )
+            last_number = cursor.fetchone()[0]
+        return last_number - count + 1
+
+
+class BillCounter(models.Model):
+    """Last number handed out in each bill-number series, e.g. 'EMZA' or 'EMZA-2025-26'."""
+    series = models.CharField(max_length=50, unique=True)
+    last_number = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = BillCounterQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.series}: {self.last_number}"
+
+
+def delete_rows(queryset):
+    """
+    DELETE the rows of ``queryset`` with one statement, without loading them,
+    cascading or sending delete signals; only for tables nothing references.
+    Returns the number of rows deleted.
+    """
+    model, db = queryset.model, queryset.db
+    quote = connections[db].ops.quote_name
+    subquery, params = queryset.order_by().values('pk').query.sql_with_params()
+    with connections[db].cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {quote(model._meta.db_table)} WHERE {quote(model._meta.pk.column)} IN ({subquery})", params
+        )
+        return cursor.rowcount
+
+
+def financial_year(day):
+    """Label of the financial year containing ``day``, e.g. '2025-26' for April 2025 to March 2026."""
+    start_month = getattr(settings, 'BILL_FINANCIAL_YEAR_START_MONTH', 4)
+    start_year = day.year if day.month >= start_month else day.year - 1
+    if start_month == 1:
+        return str(start_year)
+    return f"{start_year}-{(start_year + 1) % 100:02d}"
+
+
+def bill_series(prefix, per_financial_year=False, day=None):
+    if not per_financial_year:
+        return prefix
+    return f"{prefix}-{financial_year(day or timezone.localdate())}"
+
+
+def allocate_bill_numbers(prefix, count=1, per_financial_year=False, day=None):
+    """Return ``count`` formatted bill numbers such as 'EMZA-0042' or 'EMZA-2025-26-0042'."""
+    series = bill_series(prefix, per_financial_year, day)
+    first = BillCounter.objects.allocate(series, count)
+    return [f"{series}-{number:04d}" for number in range(first, first + count)]
+
+
+def assign_bill_numbers(bills, prefix, per_financial_year=False):
+    """Give every bill without a bill_number one from a single block allocation."""
+    unnumbered = [bill for bill in bills if not bill.bill_number]
+    if unnumbered:
+        numbers = allocate_bill_numbers(prefix, len(unnumbered), per_financial_year)
+        for bill, number in zip(unnumbered, numbers):
+            bill.bill_number = number
+    return bills
+
+
+class IdempotencyKeyQuerySet(models.QuerySet):
+    def claim(self, scope, key):
+        """
+        Record the first use of ``key`` in ``scope`` and return True, or
+        return False if it was used already. Call it inside the transaction
+        that does the work: a concurrent claim of the same key waits on the
+        unique index until that transaction ends, and only gets the key if
+        it rolled back.
+        """
+        table = connection.ops.quote_name(IdempotencyKey._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (scope, key, response_url, object_id, created_at) VALUES (%s, %s, '', NULL, %s) "
+                f"ON CONFLICT (scope, key) DO NOTHING "
+                f"RETURNING id",
+                [scope, key, timezone.now()],
+            )
+            return cursor.fetchone() is not None
+
+    def complete(self, scope, key, response_url, object_id=None):
+        return self.filter(scope=scope, key=key).update(response_url=response_url, object_id=object_id)
+
+    def replay(self, scope, key):
+        """The URL the first request with ``key`` redirected to, or None if there was none."""
+        return self.filter(scope=scope, key=key).exclude(response_url='').values_list('response_url', flat=True).first()
+
+    def sweep(self, max_age=None):
+        """Delete keys older than ``max_age`` (default: the IDEMPOTENCY_KEY_MAX_AGE setting). Returns the number deleted."""
+        if max_age is None:
+            max_age = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_MAX_AGE', 60 * 60 * 24))
+        deleted, _ = self.filter(created_at__lt=timezone.now() - max_age).delete()
+        return deleted
+
+
+class IdempotencyKey(models.Model):
+    """
+    A client-supplied key of a form submission that created something, so
+    a retried submission gets the original response instead of doing the
+    work again. Keys are only needed while clients may retry, and are swept
+    after IDEMPOTENCY_KEY_MAX_AGE.
+    """
+    scope = models.CharField(max_length=50)  # What was created, e.g. 'salebill'
+    key = models.CharField(max_length=100)
+    response_url = models.CharField(max_length=255, blank=True)
+    object_id = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = IdempotencyKeyQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}: {self.key}"
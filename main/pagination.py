@@ -0,0 +1,106 @@
+import base64
+import datetime
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder truncates datetimes to milliseconds, which would skip
+    # or repeat rows whose timestamps differ only in the microseconds.
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPaginationMixin:
+    """
+    Keyset (seek) pagination for ListViews.
+
+    Instead of OFFSET, each page continues after the last row of the previous
+    one: the sort key of that row is encoded into an opaque ``?cursor=`` value
+    and turned back into a WHERE clause, so every page costs the same no
+    matter how deep into the table it is. ``keyset_ordering`` must end with a
+    unique field so the ordering is total.
+    """
+    paginate_by = 50
+    keyset_ordering = ('-created_at', '-id')
+    cursor_param = 'cursor'
+
+    def get_keyset_ordering(self):
+        return self.keyset_ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        ordering = self.get_keyset_ordering()
+        queryset = queryset.order_by(*ordering)
+        cursor = self.decode_cursor(queryset, ordering, self.request.GET.get(self.cursor_param))
+        if cursor is not None:
+            queryset = queryset.filter(self.keyset_filter(ordering, cursor))
+
+        # One extra row tells us whether there is a next page without a COUNT
+        object_list = list(queryset[:page_size + 1])
+        has_next = len(object_list) > page_size
+        object_list = object_list[:page_size]
+
+        self.next_cursor = None
+        if has_next:
+            last = object_list[-1]
+            self.next_cursor = self.encode_cursor([getattr(last, name.lstrip('-')) for name in ordering])
+        return (None, None, object_list, has_next)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        next_cursor = getattr(self, 'next_cursor', None)
+        context['next_cursor'] = next_cursor
+        if next_cursor:
+            params = self.request.GET.copy()
+            params[self.cursor_param] = next_cursor
+            context['next_page_url'] = f'?{params.urlencode()}'
+        return context
+
+    @staticmethod
+    def keyset_filter(ordering, values):
+        """
+        Rows strictly after ``values`` in ``ordering``: for (a, b) ascending
+        this is ``a > x OR (a = x AND b > y)``.
+        """
+        condition = Q()
+        for index, name in enumerate(ordering):
+            field = name.lstrip('-')
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            step = Q(**{f'{field}__{lookup}': values[index]})
+            for previous, value in zip(ordering[:index], values[:index]):
+                step &= Q(**{previous.lstrip('-'): value})
+            condition |= step
+        return condition
+
+    @staticmethod
+    def encode_cursor(values):
+        payload = json.dumps(values, cls=CursorEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(queryset, ordering, cursor):
+        """Turn a cursor back into typed values, or None if it is missing or malformed."""
+        if not cursor:
+            return None
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if not isinstance(values, list) or len(values) != len(ordering):
+                return None
+            return [
+                KeysetPaginationMixin._output_field(queryset, name.lstrip('-')).to_python(value)
+                for name, value in zip(ordering, values)
+            ]
+        except (ValueError, TypeError, FieldDoesNotExist, ValidationError):
+            return None
+
+    @staticmethod
+    def _output_field(queryset, name):
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        return queryset.model._meta.get_field(name)
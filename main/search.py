@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.signals import post_delete, post_save
+
+MAX_TERM_LENGTH = 100
+
+
+class LRUCache:
+    """A small thread-safe LRU cache with a time-to-live, local to this process."""
+
+    def __init__(self, maxsize=256, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class NameSearch:
+    """
+    Ranked search over a model's ``name`` for the Select2 endpoints.
+
+    Matches are case-insensitive substrings (served by a trigram index on
+    UPPER(name)) plus fuzzy trigram word matches for typos, ranked as: name
+    starts with the term, a word starts with it, it appears anywhere, fuzzy
+    match; then by word similarity. Pages are fetched with LIMIT
+    page_size + 1 rather than a COUNT. Recent results are kept in a
+    per-process LRU that is cleared whenever an instance of the model is
+    saved or deleted, and expires after ``ttl`` seconds to bound staleness
+    across processes.
+    """
+
+    def __init__(self, model, page_size=30, cache_size=256, ttl=60):
+        self.model = model
+        self.page_size = page_size
+        self.cache = LRUCache(maxsize=cache_size, ttl=ttl)
+        post_save.connect(self.invalidate, sender=model, weak=False)
+        post_delete.connect(self.invalidate, sender=model, weak=False)
+
+    def invalidate(self, **kwargs):
+        self.cache.clear()
+
+    def ranked(self, queryset, term):
+        if not term:
+            return queryset.order_by('name', 'pk')
+        rank = Case(
+            When(name__istartswith=term, then=Value(0)),
+            When(name__icontains=f' {term}', then=Value(1)),
+            When(name__icontains=term, then=Value(2)),
+            default=Value(3),
+            output_field=IntegerField(),
+        )
+        return (
+            queryset
+            .filter(Q(name__icontains=term) | Q(name__trigram_word_similar=term))
+            .annotate(search_rank=rank, similarity=TrigramWordSimilarity(term, 'name'))
+            .order_by('search_rank', '-similarity', 'name', 'pk')
+        )
+
+    def _page(self, term, page, queryset, variant):
+        term = term.strip()[:MAX_TERM_LENGTH]
+        key = (variant, term.lower(), page)
+        queryset = self.model._default_manager.all() if queryset is None else queryset
+        offset = (page - 1) * self.page_size
+        rows = self.ranked(queryset, term).values_list('pk', 'name')[offset:offset + self.page_size + 1]
+        return key, rows
+
+    def _store(self, key, rows):
+        result = (rows[:self.page_size], len(rows) > self.page_size)
+        if key is not None:
+            self.cache.set(key, result)
+        return result
+
+    def search(self, term, page=1, queryset=None, variant=''):
+        """
+        Return ``([(pk, name), ...], more)`` for one page of results.
+        ``variant`` distinguishes cache entries for differently filtered
+        querysets; None reads the page fresh, for querysets filtered on data
+        whose changes send no signals to invalidate the cache.
+        """
+        key, rows = self._page(term, page, queryset, variant)
+        cached = None if variant is None else self.cache.get(key)
+        if cached is not None:
+            return cached
+        return self._store(None if variant is None else key, list(rows))
+
+    async def asearch(self, term, page=1, queryset=None, variant=''):
+        """Async search(): the page is read with the async ORM, without holding a worker thread."""
+        key, rows = self._page(term, page, queryset, variant)
+        cached = None if variant is None else self.cache.get(key)
+        if cached is not None:
+            return cached
+        return self._store(None if variant is None else key, [row async for row in rows])
+
+
+def page_number(request):
+    try:
+        return max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        return 1
@@ -0,0 +1,46 @@
+// Infinite scroll for list pages using keyset pagination.
+// When the "Load more" link scrolls into view, fetch the next page and append its table rows.
+document.addEventListener('DOMContentLoaded', function () {
+  const container = document.querySelector('[data-infinite-scroll]');
+  const tbody = document.querySelector('main table tbody');
+  if (!container || !tbody || !('IntersectionObserver' in window)) {
+    return; // The plain "Load more" link still works
+  }
+
+  let loading = false;
+
+  async function loadNextPage() {
+    const link = container.querySelector('[data-next-page]');
+    if (!link || loading) {
+      return;
+    }
+    loading = true;
+    try {
+      const response = await fetch(link.href, { headers: { 'X-Requested-With': 'XMLHttpRequest' } });
+      if (!response.ok) {
+        return;
+      }
+      const page = new DOMParser().parseFromString(await response.text(), 'text/html');
+      page.querySelectorAll('main table tbody > tr').forEach((row) => {
+        tbody.appendChild(document.importNode(row, true));
+      });
+
+      const next = page.querySelector('[data-infinite-scroll] [data-next-page]');
+      if (next) {
+        link.setAttribute('href', next.getAttribute('href'));
+      } else {
+        observer.disconnect();
+        container.remove();
+      }
+    } finally {
+      loading = false;
+    }
+  }
+
+  const observer = new IntersectionObserver((entries) => {
+    if (entries.some((entry) => entry.isIntersecting)) {
+      loadNextPage();
+    }
+  }, { rootMargin: '400px' });
+  observer.observe(container);
+});
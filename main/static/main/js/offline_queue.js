@@ -0,0 +1,92 @@
+// Asks the service worker to send the bills queued offline whenever a
+// page is open and online, and shows the queue where a page has an
+// #offline-queue element (the offline page).
+
+(function () {
+    if (!('serviceWorker' in navigator)) {
+        return;
+    }
+
+    function csrfToken() {
+        const match = document.cookie.match(/(?:^|;\s*)csrftoken=([^;]+)/);
+        return match ? decodeURIComponent(match[1]) : null;
+    }
+
+    function requestSync() {
+        if (navigator.onLine && navigator.serviceWorker.controller) {
+            navigator.serviceWorker.controller.postMessage({type: 'sync-bills', csrfToken: csrfToken()});
+        }
+    }
+
+    function queuedBills() {
+        return new Promise((resolve, reject) => {
+            const request = indexedDB.open('emza-offline', 1);
+            request.onupgradeneeded = () => request.result.createObjectStore('bills', {keyPath: 'key'});
+            request.onerror = () => reject(request.error);
+            request.onsuccess = () => {
+                const all = request.result.transaction('bills', 'readonly').objectStore('bills').getAll();
+                all.onsuccess = () => resolve(all.result);
+                all.onerror = () => reject(all.error);
+            };
+        });
+    }
+
+    async function renderQueue(message) {
+        const container = document.getElementById('offline-queue');
+        if (!container) {
+            return;
+        }
+        const bills = await queuedBills();
+        const status = container.querySelector('[data-queue-status]');
+        const list = container.querySelector('[data-queue-list]');
+        const waiting = bills.filter(bill => bill.status === 'queued').length;
+        status.textContent = message || (bills.length
+            ? `${waiting} bill(s) saved on this device and waiting to be sent.`
+            : 'No bills are waiting to be sent.');
+        list.replaceChildren(...bills.filter(bill => bill.status !== 'queued').map(bill => {
+            const item = document.createElement('li');
+            item.className = 'rounded-lg border border-red-300 dark:border-red-900 p-4 text-sm text-slate-700 dark:text-white/80';
+            const title = document.createElement('p');
+            title.className = 'font-bold text-red-500';
+            title.textContent = `Bill of ${new Date(bill.queuedAt).toLocaleString()} was not saved`;
+            const errors = document.createElement('ul');
+            bill.errors.forEach(error => {
+                const line = document.createElement('li');
+                line.textContent = error;
+                errors.appendChild(line);
+            });
+            const discard = document.createElement('button');
+            discard.type = 'button';
+            discard.className = 'mt-2 font-bold text-primary';
+            discard.textContent = 'Discard';
+            discard.addEventListener('click', () => {
+                navigator.serviceWorker.controller.postMessage({type: 'discard-bill', key: bill.key});
+            });
+            item.append(title, errors, discard);
+            return item;
+        }));
+    }
+
+    navigator.serviceWorker.addEventListener('message', event => {
+        const message = event.data || {};
+        if (message.type === 'bills-synced') {
+            const counts = message.counts;
+            const rejected = counts.conflict + counts.invalid;
+            renderQueue(`${counts.created + counts.duplicate} bill(s) sent${rejected ? `, ${rejected} need attention` : ''}.`);
+        } else if (message.type === 'sync-failed') {
+            renderQueue(message.error);
+        } else if (message.type === 'bills-changed') {
+            renderQueue();
+        }
+    });
+
+    window.addEventListener('online', requestSync);
+    document.addEventListener('DOMContentLoaded', () => {
+        const syncButton = document.querySelector('[data-queue-sync]');
+        if (syncButton) {
+            syncButton.addEventListener('click', requestSync);
+        }
+        renderQueue();
+        requestSync();
+    });
+})();
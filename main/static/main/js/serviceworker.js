@@ -0,0 +1,218 @@
+// EMZA service worker.
+//
+// Pages and product searches are fetched from the network first and kept
+// in a cache, so the sale page and recent product lookups still open
+// without a connection. A sale bill submitted while offline is stored in
+// IndexedDB instead of failing, and the queue is sent to /sales/sync/ in
+// batches when the connection comes back (Background Sync where the
+// browser has it, otherwise when a page reports that it is online).
+
+const CACHE = 'emza-v1';
+const PRECACHE = ['/offline/', '/static/images/icons/icon-152x152.png'];
+const SALE_FORM_PATH = '/sales/create/';
+const SYNC_URL = '/sales/sync/';
+const SYNC_TAG = 'sync-bills';
+const BATCH_SIZE = 50;
+const FORMSET_PREFIX = 'productsale_set';
+
+self.addEventListener('install', event => {
+    self.skipWaiting();
+    event.waitUntil(caches.open(CACHE).then(cache => cache.addAll(PRECACHE)));
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(names => Promise.all(names.filter(name => name !== CACHE).map(name => caches.delete(name))))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    const url = new URL(request.url);
+    const sameOrigin = url.origin === self.location.origin;
+
+    if (request.method === 'POST' && sameOrigin && url.pathname === SALE_FORM_PATH) {
+        event.respondWith(postSaleBill(request));
+    } else if (request.method !== 'GET') {
+        return;
+    } else if (sameOrigin && (request.mode === 'navigate' || url.pathname === '/products/search/')) {
+        event.respondWith(networkFirst(request));
+    } else if (!sameOrigin || url.pathname.startsWith('/static/')) {
+        event.respondWith(cacheFirst(request));
+    }
+});
+
+self.addEventListener('sync', event => {
+    if (event.tag === SYNC_TAG) {
+        event.waitUntil(syncBills());
+    }
+});
+
+self.addEventListener('message', event => {
+    const message = event.data || {};
+    if (message.type === 'sync-bills') {
+        event.waitUntil(syncBills(message.csrfToken).catch(error => notify({type: 'sync-failed', error: String(error)})));
+    } else if (message.type === 'discard-bill') {
+        event.waitUntil(deleteBill(message.key).then(() => notify({type: 'bills-changed'})));
+    }
+});
+
+// Fetching
+
+async function networkFirst(request) {
+    try {
+        const response = await fetch(request);
+        // Redirects are left out, so a login page is never cached as the page asked for
+        if (response.ok && !response.redirected) {
+            const cache = await caches.open(CACHE);
+            await cache.put(request, response.clone());
+        }
+        return response;
+    } catch (error) {
+        const cached = await caches.match(request);
+        if (cached) {
+            return cached;
+        }
+        if (request.mode === 'navigate') {
+            return caches.match('/offline/');
+        }
+        return Response.error();
+    }
+}
+
+async function cacheFirst(request) {
+    const cached = await caches.match(request);
+    if (cached) {
+        return cached;
+    }
+    const response = await fetch(request);
+    // Cross-origin assets (Tailwind, Select2, fonts) come back opaque
+    if (response.ok || response.type === 'opaque') {
+        const cache = await caches.open(CACHE);
+        await cache.put(request, response.clone());
+    }
+    return response;
+}
+
+async function postSaleBill(request) {
+    const copy = request.clone();
+    try {
+        return await fetch(request);
+    } catch (error) {
+        await putBill(billFromForm(await copy.formData()));
+        if (self.registration.sync) {
+            await self.registration.sync.register(SYNC_TAG).catch(() => {});
+        }
+        notify({type: 'bills-changed'});
+        return Response.redirect('/offline/?queued=1', 303);
+    }
+}
+
+function billFromForm(form) {
+    const lines = [];
+    const total = parseInt(form.get(`${FORMSET_PREFIX}-TOTAL_FORMS`) || '0', 10);
+    for (let index = 0; index < total; index++) {
+        const field = name => form.get(`${FORMSET_PREFIX}-${index}-${name}`);
+        if (field('DELETE') || !field('product')) {
+            continue;
+        }
+        lines.push({product: field('product'), quantity: field('quantity'), price: field('price') || null});
+    }
+    return {
+        key: form.get('idempotency_key') || self.crypto.randomUUID(),
+        customer: form.get('customer') || null,
+        discount: form.get('discount') || '0',
+        lines: lines,
+        csrfToken: form.get('csrfmiddlewaretoken'),
+        queuedAt: new Date().toISOString(),
+        status: 'queued',
+        errors: [],
+    };
+}
+
+// Syncing
+
+let syncing = null;
+
+function syncBills(csrfToken) {
+    // One sync at a time; a request made meanwhile waits for the running one
+    if (!syncing) {
+        syncing = sendQueuedBills(csrfToken).finally(() => { syncing = null; });
+    }
+    return syncing;
+}
+
+async function sendQueuedBills(csrfToken) {
+    const queued = (await allBills()).filter(bill => bill.status === 'queued');
+    const counts = {created: 0, duplicate: 0, conflict: 0, invalid: 0};
+    for (let start = 0; start < queued.length; start += BATCH_SIZE) {
+        const batch = queued.slice(start, start + BATCH_SIZE);
+        const response = await fetch(SYNC_URL, {
+            method: 'POST',
+            credentials: 'same-origin',
+            redirect: 'manual',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': csrfToken || batch[batch.length - 1].csrfToken,
+            },
+            body: JSON.stringify({
+                bills: batch.map(bill => ({key: bill.key, customer: bill.customer, discount: bill.discount, lines: bill.lines})),
+            }),
+        });
+        if (!response.ok) {
+            // Logged out or an expired CSRF token: keep the queue for the next try
+            throw new Error(response.type === 'opaqueredirect' ? 'Log in to send the queued bills.' : `Sync failed (${response.status}).`);
+        }
+        const {results} = await response.json();
+        for (const [index, result] of results.entries()) {
+            counts[result.status] += 1;
+            if (result.status === 'created' || result.status === 'duplicate') {
+                await deleteBill(batch[index].key);
+            } else {
+                await putBill({...batch[index], status: result.status, errors: result.errors});
+            }
+        }
+    }
+    notify({type: 'bills-synced', counts: counts});
+    return counts;
+}
+
+async function notify(message) {
+    const pages = await self.clients.matchAll({type: 'window'});
+    pages.forEach(page => page.postMessage(message));
+}
+
+// IndexedDB queue, keyed by the bill's idempotency key
+
+function openQueue() {
+    return new Promise((resolve, reject) => {
+        const request = indexedDB.open('emza-offline', 1);
+        request.onupgradeneeded = () => request.result.createObjectStore('bills', {keyPath: 'key'});
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+async function withStore(mode, action) {
+    const db = await openQueue();
+    return new Promise((resolve, reject) => {
+        const transaction = db.transaction('bills', mode);
+        const request = action(transaction.objectStore('bills'));
+        transaction.oncomplete = () => resolve(request.result);
+        transaction.onerror = () => reject(transaction.error);
+    });
+}
+
+function allBills() {
+    return withStore('readonly', store => store.getAll());
+}
+
+function putBill(bill) {
+    return withStore('readwrite', store => store.put(bill));
+}
+
+function deleteBill(key) {
+    return withStore('readwrite', store => store.delete(key));
+}
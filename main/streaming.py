@@ -0,0 +1,31 @@
+"""
+Streaming responses that stream under both WSGI and ASGI.
+
+Under ASGI, Django reads a synchronous iterator into a list before sending
+the first byte, so an export or a bulk API response would be held in
+memory whole. On an ASGI request the lines are therefore handed over as an
+async generator that pulls them from the synchronous iterator in Django's
+thread for sync code (the same one, and so the same database connection,
+for the whole response), ``batch_size`` lines at a time.
+"""
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+BATCH_SIZE = 100
+
+
+async def aiterate(lines, batch_size=BATCH_SIZE):
+    lines = iter(lines)
+    next_batch = sync_to_async(lambda: list(islice(lines, batch_size)))
+    while batch := await next_batch():
+        yield ''.join(batch)
+
+
+def streaming_response(request, lines, **kwargs):
+    """A StreamingHttpResponse of ``lines`` (strings), async when ``request`` came in over ASGI."""
+    if isinstance(request, ASGIRequest):
+        lines = aiterate(lines)
+    return StreamingHttpResponse(lines, **kwargs)
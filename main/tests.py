@@ -1,3 +1,115 @@
+import datetime
+import io
+import json
+
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.utils import timezone
+
+from product.models import Product, StockVariant
+from purchase.models import PurchaseBill
+from sale.models import ProductSale, SaleBill
+from sale.services import post_sale_bill
+from stock.models import MovementKind, Stock, StockMovement, StockType
+from stock.search import stock_search
+from .importer import ProductImporter, PurchaseImporter, StockImporter
+from .models import BillCounter, IdempotencyKey, allocate_bill_numbers, financial_year
 
 # Create your tests here.
+
+
+class BillNumberTests(TestCase):
+    def test_block_allocation_is_consecutive(self):
+        self.assertEqual(allocate_bill_numbers('TST'), ['TST-0001'])
+        self.assertEqual(allocate_bill_numbers('TST', count=3), ['TST-0002', 'TST-0003', 'TST-0004'])
+        self.assertEqual(BillCounter.objects.get(series='TST').last_number, 4)
+
+    def test_financial_year_series(self):
+        self.assertEqual(financial_year(datetime.date(2026, 3, 31)), '2025-26')
+        self.assertEqual(financial_year(datetime.date(2026, 4, 1)), '2026-27')
+        numbers = allocate_bill_numbers('TST', count=2, per_financial_year=True, day=datetime.date(2026, 4, 1))
+        self.assertEqual(numbers, ['TST-2026-27-0001', 'TST-2026-27-0002'])
+
+
+class IdempotencyKeyTests(TestCase):
+    def test_claim_once_and_sweep(self):
+        self.assertTrue(IdempotencyKey.objects.claim('salebill', 'abc12345'))
+        self.assertFalse(IdempotencyKey.objects.claim('salebill', 'abc12345'))
+        self.assertTrue(IdempotencyKey.objects.claim('purchasebill', 'abc12345'))
+        self.assertIsNone(IdempotencyKey.objects.replay('salebill', 'abc12345'))
+        IdempotencyKey.objects.complete('salebill', 'abc12345', '/sales/', 7)
+        self.assertEqual(IdempotencyKey.objects.replay('salebill', 'abc12345'), '/sales/')
+
+        IdempotencyKey.objects.filter(scope='salebill').update(created_at=timezone.now() - datetime.timedelta(days=2))
+        self.assertEqual(IdempotencyKey.objects.sweep(), 1)
+        self.assertEqual(list(IdempotencyKey.objects.values_list('scope', flat=True)), ['purchasebill'])
+
+
+class InventoryImportTests(TestCase):
+    def test_import_reports_bad_rows_and_keeps_the_rest(self):
+        stocks = StockImporter(batch_size=2).run(io.StringIO(
+            "name,type,metric,opening_quantity\n"
+            "Oud,Oil,ml,100\nRose,Oil,ml,50\nOud,Oil,ml,5\nBottle,Bottle,pcs,x\nBottle,Bottle,pcs,20\n"
+        ))
+        self.assertEqual((stocks.created, [line for line, message in stocks.errors]), (3, [4, 5]))
+        self.assertEqual(StockMovement.objects.filter(stock__name='Oud').get().quantity, 100)
+
+        products = ProductImporter(batch_size=2).run(io.StringIO(
+            "product,price,stock,quantity\n"
+            "Oud 6ml,300,Oud,6\nOud 6ml,,Bottle,1\nRose 6ml,250,Rose,6\nRose 6ml,,Musk,1\nRose 6ml,,Bottle,1\n"
+        ))
+        self.assertEqual((products.created, [line for line, message in products.errors]), (4, [5]))
+        self.assertEqual(StockVariant.objects.filter(product__name='Rose 6ml').count(), 2)
+
+        purchases = PurchaseImporter().run(io.StringIO(
+            "bill,stock,quantity,price\nA,Oud,10,5\nA,Bottle,30,2\nB,Oud,5,5\n"
+        ))
+        self.assertEqual(purchases.created, 3)
+        self.assertEqual(PurchaseBill.objects.count(), 2)
+        self.assertEqual(Stock.objects.get(name='Oud').purchase_quantity, 15)
+        # One batch spanning both bills still records each bill's movements
+        self.assertEqual(
+            sorted(StockMovement.objects.filter(kind=MovementKind.PURCHASE).values_list('source_id', 'quantity')),
+            sorted((bill.pk, quantity) for bill, quantity in [
+                (PurchaseBill.objects.get(stockpurchase__quantity=10), 10),
+                (PurchaseBill.objects.get(stockpurchase__quantity=30), 30),
+                (PurchaseBill.objects.get(stockpurchase__quantity=5), 5),
+            ]),
+        )
+
+    def test_failed_batch_leaves_no_new_types(self):
+        stocks = StockImporter().run(io.StringIO("name,type,opening_quantity\nAmber,Resin,1\nCopal,Resin,99999999999\n"))
+        self.assertEqual((stocks.created, len(stocks.errors)), (0, 2))
+        self.assertFalse(StockType.objects.filter(name='Resin').exists())
+
+    def test_imports_reach_the_stock_search(self):
+        self.assertEqual(stock_search.search('Amber'), ([], False))
+        with self.captureOnCommitCallbacks(execute=True):
+            StockImporter().run(io.StringIO("name,type\nAmber,Resin\n"))
+        self.assertEqual(stock_search.search('Amber'), ([(Stock.objects.get(name='Amber').pk, 'Amber')], False))
+
+
+class StreamingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('manager', password='secret')
+        stock_type = StockType.objects.create(name='Oil')
+        bottle = Stock.objects.create(name='9ml Bottle', stock_type=stock_type, opening_quantity=300)
+        product = Product.objects.create(name='CR7 9ml', price=199)
+        StockVariant.objects.create(product=product, stock=bottle, quantity=1)
+        post_sale_bill(SaleBill.objects.create(), [ProductSale(product=product, quantity=1) for _ in range(250)])
+
+    async def test_export_streams_asynchronously_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get('/sales/export/?format=jsonl')
+        # An async iterator is streamed by the ASGI handler instead of being read into a list first
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(len(chunks), 3)
+        lines = b''.join(chunks).decode().splitlines()
+        self.assertEqual((len(lines), json.loads(lines[0])['product']), (250, 'CR7 9ml'))
+
+    def test_export_streams_synchronously_under_wsgi(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/sales/export/?format=csv')
+        self.assertFalse(response.is_async)
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 251)
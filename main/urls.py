@@ -5,4 +5,5 @@ from django.contrib.auth.views import LoginView
 urlpatterns = [
     path('login/', LoginView.as_view(), name='login'),
     path('', views.home, name='home'),
+    path('import/', views.inventory_import, name='inventory-import'),
 ]
\ No newline at end of file
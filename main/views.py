@@ -1,8 +1,24 @@
-from django.shortcuts import redirect
+from django.shortcuts import redirect, render
 from django.contrib.auth.decorators import login_required
 
+from .forms import InventoryImportForm
+
 # Create your views here.
 
 @login_required
 def home(request):
-    return redirect('salebill-list')
\ No newline at end of file
+    return redirect('salebill-list')
+
+
+@login_required
+def inventory_import(request):
+    result = None
+    if request.method == 'POST':
+        form = InventoryImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            result = form.run_import()
+            form = InventoryImportForm(initial={'kind': form.cleaned_data['kind']})
+    else:
+        form = InventoryImportForm()
+    errors = result.errors[:200] if result else []
+    return render(request, 'main/inventory_import.html', {'form': form, 'result': result, 'errors': errors})
@@ -0,0 +1,124 @@
+from collections import defaultdict
+
+from django.db import DatabaseError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from main.api import CREATED, INVALID, UPDATED, BulkWriter, ids, item_list, scalar_fields
+from main.importer import CSVImporter, RowError
+from main.models import delete_rows
+from stock.models import Stock
+from .availability import bom
+from .models import Product, StockVariant
+from .search import product_search
+
+
+class ProductWriter(BulkWriter):
+    """
+    Upserts products with their recipes. Items:
+    ``{"id", "name", "price", "variants": [{"stock", "quantity"}]}``. A
+    product is matched by ``id`` if given, else by exact name, and created
+    if there is none; its variants are replaced by the ones listed. Name and
+    price are required for a new product.
+
+    Unlike bills, which go through the posting services one at a time, a
+    whole chunk of products is written with a handful of bulk statements.
+    """
+    chunk_size = 1000
+
+    def load_maps(self, items):
+        self.by_id = Product.objects.in_bulk(ids(item.get('id') for item in items if item.get('id') is not None))
+        self.by_name = defaultdict(list)
+        names = {item['name'].strip() for item in items if isinstance(item.get('name'), str)}
+        for product in Product.objects.filter(name__in=names):
+            self.by_name[product.name].append(product)
+        variants = [variant for item in items if isinstance(item.get('variants'), list) for variant in item['variants']]
+        self.stock_ids = set(
+            Stock.objects.filter(pk__in=ids(variant.get('stock') for variant in variants if isinstance(variant, dict)))
+            .values_list('pk', flat=True)
+        )
+        self.seen = set()
+
+    def parse(self, item):
+        fields = scalar_fields(item)
+        name, price = fields.get('name'), CSVImporter.decimal(fields, 'price') if fields.get('price') else None
+        if fields.get('id'):
+            product = self.by_id.get(CSVImporter.integer(fields, 'id'))
+            if product is None:
+                raise RowError(f"Unknown product {fields['id']}.")
+        else:
+            matches = self.by_name.get(CSVImporter.required(fields, 'name'), [])
+            if len(matches) > 1:
+                raise RowError(f"{len(matches)} products are named '{name}'; give the id of the one to update.")
+            product = matches[0] if matches else Product(name=name, price=price)
+            if product.pk is None and price is None:
+                raise RowError("'price' is required.")
+        if product.pk in self.seen or (product.pk is None and ('name', name) in self.seen):
+            raise RowError("The product appears twice in the request.")
+        self.seen.add(product.pk or ('name', name))
+        if product.pk is not None:
+            product.name = name or product.name
+            product.price = price if price is not None else product.price
+
+        variants = {}
+        for number, variant in enumerate(item_list(item, 'variants'), start=1):
+            try:
+                variant = scalar_fields(variant)
+                stock_id = CSVImporter.integer(variant, 'stock')
+                if stock_id not in self.stock_ids:
+                    raise RowError(f"Unknown stock {stock_id}.")
+                if stock_id in variants:
+                    raise RowError(f"Stock {stock_id} is listed twice.")
+                variants[stock_id] = CSVImporter.integer(variant, 'quantity', minimum=1)
+            except RowError as exc:
+                raise RowError(f"Variant {number}: {exc}")
+        return product, variants
+
+    def write_chunk(self, chunk):
+        self.load_maps([item for index, item in chunk if isinstance(item, dict)])
+        results, parsed = {}, []
+        for index, item in chunk:
+            try:
+                product, variants = self.parse(item)
+            except RowError as exc:
+                results[index] = {'status': INVALID, 'errors': [str(exc)]}
+                continue
+            parsed.append((index, product, variants, CREATED if product.pk is None else UPDATED))
+
+        try:
+            with transaction.atomic():
+                self.write_products([(product, variants) for index, product, variants, status in parsed])
+        except DatabaseError as exc:
+            for index, product, variants, status in parsed:
+                results[index] = {'status': INVALID, 'errors': [f"Chunk not written: {exc}"]}
+        else:
+            for index, product, variants, status in parsed:
+                results[index] = {'status': status, 'id': product.pk}
+        return [{'index': index, 'key': None, 'id': None, 'errors': [], **results[index]} for index, item in chunk]
+
+    def write_products(self, products):
+        """Create or update ``[(product, {stock_id: quantity})]`` and replace their variants."""
+        existing = [(product, variants) for product, variants in products if product.pk is not None]
+        Product.objects.bulk_create([product for product, variants in products if product.pk is None])
+        now = timezone.now()
+        for product, variants in existing:
+            product.updated_at = now
+        Product.objects.bulk_update([product for product, variants in existing], ['name', 'price', 'updated_at'])
+
+        StockVariant.objects.bulk_create(
+            [
+                StockVariant(product=product, stock_id=stock_id, quantity=quantity)
+                for product, variants in products for stock_id, quantity in variants.items()
+            ],
+            update_conflicts=True, unique_fields=['stock', 'product'], update_fields=['quantity', 'updated_at'],
+        )
+        if existing:
+            # Variants of updated products that are no longer listed; nothing references StockVariant
+            stale = Q()
+            for product, variants in existing:
+                stale |= Q(product=product) & ~Q(stock_id__in=list(variants))
+            delete_rows(StockVariant.objects.filter(stale))
+        # Neither bulk statement sends the signals that keep the compiled recipes and
+        # the product search current
+        bom.changed()
+        transaction.on_commit(product_search.invalidate)
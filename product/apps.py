@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class ProductConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'product'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from .availability import recipe_changed
+        from .models import StockVariant
+
+        # Keep the compiled bill of materials in step with recipe edits
+        post_save.connect(recipe_changed, sender=StockVariant, dispatch_uid='product-bom-save')
+        post_delete.connect(recipe_changed, sender=StockVariant, dispatch_uid='product-bom-delete')
@@ -0,0 +1,126 @@
+"""
+Product availability from a compiled bill of materials.
+
+Every product is a recipe of StockVariant rows, and the number that can be
+made is the smallest ``balance // quantity`` over them. Instead of walking
+the variants per product, the recipes are compiled once per process into a
+table of ``{product_id: ((stock_id, quantity), ...)}`` and evaluated
+against one read of the stock balances, so the whole catalogue (or any set
+of products) costs two small queries once the recipes are compiled: the
+recipe version and the balances.
+
+Balances change with every sale and are always read live. Recipes change
+rarely: saving or deleting a StockVariant recompiles that product's recipe
+in the process that made the change and bumps the RecipeVersion row, which
+makes other processes recompile on their next read once the change commits.
+The version lives in the database rather than the cache, which is local to
+each worker. Writes that skip signals (bulk_create, queryset updates) must
+call ``bom.changed()``.
+"""
+import threading
+from collections import defaultdict
+
+from django.db import transaction
+
+from stock.models import BALANCE, Stock
+
+
+class BillOfMaterials:
+    def __init__(self):
+        self.recipes = None
+        self.version = None
+        self._lock = threading.Lock()
+
+    def _shared_version(self):
+        from .models import RecipeVersion
+
+        return RecipeVersion.objects.current()
+
+    def compile(self, product_ids=None):
+        """Read recipes from StockVariant: ``{product_id: ((stock_id, quantity), ...)}``."""
+        from .models import StockVariant
+
+        variants = StockVariant.objects.filter(product__isnull=False, quantity__gt=0)
+        if product_ids is not None:
+            variants = variants.filter(product_id__in=product_ids)
+        recipes = defaultdict(list)
+        for product_id, stock_id, quantity in variants.values_list('product_id', 'stock_id', 'quantity').order_by():
+            recipes[product_id].append((stock_id, quantity))
+        return {product_id: tuple(recipe) for product_id, recipe in recipes.items()}
+
+    def compiled(self):
+        with self._lock:
+            version = self._shared_version()
+            if self.recipes is None or version != self.version:
+                self.recipes = self.compile()
+                self.version = version
+            return self.recipes
+
+    def invalidate(self):
+        """Make every process recompile its recipes on the next read."""
+        with self._lock:
+            self.recipes = None
+            self._bump()
+
+    def changed(self):
+        """
+        Invalidate after writes that skip the StockVariant signals. Other
+        processes see the new version when the transaction commits, and
+        none of them if it rolls back; this one has dropped its recipes and
+        recompiles on its next read either way.
+        """
+        self.invalidate()
+
+    def update_product(self, product_id):
+        """Recompile one product's recipe here, and make other processes recompile theirs."""
+        with self._lock:
+            previous, version = self._bump()
+            if self.recipes is None or previous != self.version:
+                # Another process changed recipes since this one compiled them
+                self.recipes = None
+                return
+            recipe = self.compile([product_id]).get(product_id)
+            if recipe:
+                self.recipes[product_id] = recipe
+            else:
+                self.recipes.pop(product_id, None)
+            self.version = version
+
+    def _bump(self):
+        from .models import RecipeVersion
+
+        return RecipeVersion.objects.bump()
+
+    def availability(self, product_ids=None):
+        """
+        ``{product_id: units that can be made}`` for ``product_ids``, or for
+        every product with a recipe when it is None (products without one
+        can make 0). Balances are read in one query.
+        """
+        recipes = self.compiled()
+        if product_ids is None:
+            items = recipes.items()
+            balances = Stock.objects.all()
+        else:
+            items = [(product_id, recipes.get(product_id, ())) for product_id in product_ids]
+            balances = Stock.objects.filter(
+                pk__in={stock_id for product_id, recipe in items for stock_id, quantity in recipe}
+            )
+        balance = dict(balances.annotate(balance=BALANCE).values_list('pk', 'balance').order_by())
+        # Floor division matches the SQL annotation for negative balances too
+        return {
+            product_id: min((balance.get(stock_id, 0) // quantity for stock_id, quantity in recipe), default=0)
+            for product_id, recipe in items
+        }
+
+
+bom = BillOfMaterials()
+
+
+def recipe_changed(sender, instance, **kwargs):
+    if instance.product_id is None:
+        return
+    if transaction.get_connection().in_atomic_block:
+        bom.changed()
+    else:
+        bom.update_product(instance.product_id)
@@ -1,6 +1,8 @@
 from django import forms
 from django.forms import inlineformset_factory
 from .models import Product, StockVariant
+from stock.models import Stock
+from main.fields import LazyChoiceInlineFormSet, LazyChoiceModelForm, LazyModelChoiceField
 
 class ProductForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
@@ -25,10 +27,17 @@ class ProductForm(forms.ModelForm):
 
 
 
+class StockVariantForm(LazyChoiceModelForm):
+    # Only the selected stock is rendered; Select2 searches the rest
+    stock = LazyModelChoiceField(queryset=Stock.objects.select_related('stock_type'))
+
+
 # 💡 FIX: Explicitly set fk_name to 'product'
 StockVariantInlineFormset = inlineformset_factory(
     Product, 
     StockVariant, 
+    form=StockVariantForm,
+    formset=LazyChoiceInlineFormSet,
     fields=['stock', 'quantity'], 
     extra=0,
     can_delete=True, # Ensure deletion is enabled for the UpdateView
@@ -0,0 +1,95 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from product.availability import bom
+from product.models import Product, StockVariant
+from stock.models import Stock, StockType
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Time product availability from the SQL annotation against the compiled bill of materials "
+        "on a synthetic catalogue. The data is created in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--variants', type=int, default=3, help="Stock variants per product.")
+        parser.add_argument('--stocks', type=int, default=500)
+        parser.add_argument('--page', type=int, default=50, help="Products per page for the page lookup.")
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per measurement; the best one is reported.")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.populate(options)
+                self.measure(options)
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            # The compiled recipes saw the rolled back catalogue
+            bom.invalidate()
+
+    def populate(self, options):
+        rng = random.Random(options['seed'])
+        stock_type = StockType.objects.create(name='benchmark')
+        stocks = Stock.objects.bulk_create(
+            Stock(name=f'benchmark stock {n}', stock_type=stock_type, opening_quantity=rng.randint(-10, 5000))
+            for n in range(options['stocks'])
+        )
+        products = Product.objects.bulk_create(
+            Product(name=f'benchmark product {n}', price=100) for n in range(options['products'])
+        )
+        variants = min(options['variants'], len(stocks))
+        StockVariant.objects.bulk_create(
+            StockVariant(product=product, stock=stock, quantity=rng.randint(1, 50))
+            for product in products
+            for stock in rng.sample(stocks, variants)
+        )
+        bom.changed()
+        self.product_ids = [product.pk for product in products]
+        self.stdout.write(f"{len(products)} products, {len(stocks)} stocks, {len(products) * variants} variants")
+
+    def time(self, label, func, repeat):
+        best, result = None, None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        self.stdout.write(f"{label:<40} {best * 1000:>10.1f} ms")
+        return result
+
+    def measure(self, options):
+        repeat = options['repeat']
+        ids = self.product_ids
+        page = ids[:options['page']]
+
+        def cold():
+            bom.invalidate()
+            return bom.availability(ids)
+
+        sql = self.time("SQL annotation, catalogue", lambda: dict(
+            Product.objects.with_availability().filter(pk__in=ids).values_list('pk', 'available_quantity')
+        ), repeat)
+        self.time("Bill of materials, compile + catalogue", cold, repeat)
+        engine = self.time("Bill of materials, catalogue", lambda: bom.availability(ids), repeat)
+        self.time("SQL annotation, page", lambda: dict(
+            Product.objects.with_availability().filter(pk__in=page).values_list('pk', 'available_quantity')
+        ), repeat)
+        self.time("Bill of materials, page", lambda: bom.availability(page), repeat)
+
+        mismatches = sum(1 for pk in ids if sql[pk] != engine[pk])
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f"{mismatches} product(s) differ between SQL and the bill of materials."))
+        else:
+            self.stdout.write(self.style.SUCCESS("Both agree on every product."))
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0006_name_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunSQL(
+            "CREATE SEQUENCE product_recipe_version_seq",
+            "DROP SEQUENCE product_recipe_version_seq",
+        ),
+    ]
@@ -1,63 +1,125 @@
-from django.db import models, transaction
-from stock.models import Stock
+from collections import defaultdict
+
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db import connection, models
+from django.db.models import F, FloatField, IntegerField, Min, OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Coalesce, Floor, Upper
+from stock.models import InsufficientStockError, Stock
+from .availability import bom
 
 # Create your models here.
 
 
+class ProductQuerySet(models.QuerySet):
+    def with_availability(self):
+        """
+        Annotate each product with ``available_quantity`` computed in SQL:
+        MIN(stock balance // variant quantity) over its StockVariant rows,
+        or 0 for products without variants.
+        """
+        balance = F('stock__opening_quantity') + F('stock__purchase_quantity') - F('stock__sale_quantity')
+        # FLOOR on a float division keeps Python's // semantics for negative balances
+        per_variant = Floor(Cast(balance, FloatField()) / F('quantity'))
+        availability = (
+            StockVariant.objects
+            .filter(product=OuterRef('pk'))
+            .values('product')
+            .annotate(available=Min(per_variant))
+            .values('available')
+        )
+        return self.annotate(
+            available_quantity=Coalesce(
+                Cast(Subquery(availability), IntegerField()),
+                Value(0),
+            )
+        )
+
+    def in_stock(self):
+        return self.with_availability().filter(available_quantity__gt=0)
+
+    def out_of_stock(self):
+        return self.with_availability().filter(available_quantity__lte=0)
+
+
 class Product(models.Model):
     name = models.CharField(max_length=255)
     price = models.DecimalField(max_digits=10, decimal_places=2)  
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            # Trigram indexes for search: UPPER(name) serves icontains/istartswith, name serves word similarity
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='product_name_upper_trgm'),
+            GinIndex(OpClass('name', name='gin_trgm_ops'), name='product_name_trgm'),
+        ]
+
     @property
     def available_quantity(self):
-        # Fetch all StockVariants related to this Product
-        stock_variants = StockVariant.objects.filter(product=self)
-
-        # Initialize a list to store how many products can be made by each stock variant
-        product_counts = []
-
-        # Iterate over each StockVariant to calculate the number of products that can be created
-        for stock_variant in stock_variants:
-            stock = stock_variant.stock
-            available_quantity = stock.balance_quantity
-            products_from_variant = available_quantity // stock_variant.quantity
-            product_counts.append(products_from_variant)
-
-        # The final number of products we can create is limited by the stock variant that can make the least products
-        return min(product_counts) if product_counts else 0
-
-
-    def sale(self, product_quantity):
-        with transaction.atomic():
-            # Re-check availability inside the transaction to prevent race conditions
-            if self.available_quantity < product_quantity:
-                raise ValueError(f"Not enough stock available for {self.name}. Only {self.available_quantity} left.")
-            
-            stock_variants = StockVariant.objects.filter(product=self)
-            for stock_variant in stock_variants:
-                quantity_to_deduct = stock_variant.quantity * product_quantity
-                stock_variant.stock.sale(quantity_to_deduct)
-
-    def purchase(self, product_quantity):
-        with transaction.atomic():
-            stock_variants = StockVariant.objects.filter(product=self)
-            for stock_variant in stock_variants:
-                quantity_to_add = stock_variant.quantity * product_quantity
-                stock_variant.stock.purchase(quantity_to_add)
-
-    def sale_return(self, product_quantity):
-        with transaction.atomic():
-            stock_variants = StockVariant.objects.filter(product=self)
-            for stock_variant in stock_variants:
-                quantity_to_deduct = stock_variant.quantity * product_quantity
-                stock_variant.stock.sale_return(quantity_to_deduct)
+        # Use the value annotated by Product.objects.with_availability() when present
+        if '_available_quantity' in self.__dict__:
+            return self._available_quantity
+
+        # Otherwise evaluate the compiled recipe against the live balances
+        return bom.availability([self.pk])[self.pk]
+
+    @available_quantity.setter
+    def available_quantity(self, value):
+        self._available_quantity = value
+
+
+    def stock_quantities(self, product_quantity):
+        """Map each stock this product is made from to the quantity needed for product_quantity units."""
+        return StockVariant.objects.stock_quantities({self.pk: product_quantity})
+
+    def sale(self, product_quantity, source=None):
+        stock_quantities, with_recipe = StockVariant.objects.expand({self.pk: product_quantity})
+        if product_quantity > 0 and self.pk not in with_recipe:
+            raise InsufficientStockError(f"Not enough stock available for {self.name}. It has no recipe.")
+        try:
+            Stock.objects.sale(stock_quantities, source=source)
+        except InsufficientStockError as exc:
+            raise InsufficientStockError(
+                f"Not enough stock available for {self.name}. {exc}", stock_id=exc.stock_id
+            ) from exc
+
+    def purchase(self, product_quantity, source=None):
+        Stock.objects.purchase(self.stock_quantities(product_quantity), source=source)
+
+    def sale_return(self, product_quantity, source=None):
+        Stock.objects.sale_return(self.stock_quantities(product_quantity), source=source)
 
     def __str__(self):
         return self.name
 
 
+class StockVariantQuerySet(models.QuerySet):
+    def stock_quantities(self, product_quantities):
+        """
+        Expand {product_id: product_quantity} through the recipes into the
+        net {stock_id: stock_quantity} it consumes, with a single query.
+        """
+        return self.expand(product_quantities)[0]
+
+    def expand(self, product_quantities):
+        """
+        stock_quantities(), along with the set of products that have a recipe
+        (a variant using some of a stock). Products without one can't be sold,
+        since nothing would be deducted for them.
+        """
+        stock_quantities = defaultdict(int)
+        with_recipe = set()
+        variants = self.filter(product_id__in=product_quantities).values_list('product_id', 'stock_id', 'quantity')
+        for product_id, stock_id, quantity in variants:
+            stock_quantities[stock_id] += quantity * product_quantities[product_id]
+            if quantity > 0:
+                with_recipe.add(product_id)
+        return dict(stock_quantities), with_recipe
+
+
 class StockVariant(models.Model):
     stock = models.ForeignKey(Stock, on_delete=models.CASCADE)
     quantity = models.IntegerField()
@@ -65,6 +127,8 @@ class StockVariant(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = StockVariantQuerySet.as_manager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -76,3 +140,37 @@ class StockVariant(models.Model):
 
     def __str__(self):
         return f"{self.product.name} ({self.stock.name})"
+
+
+class RecipeVersionQuerySet(models.QuerySet):
+    def current(self):
+        return self.filter(pk=1).values_list('version', flat=True).first() or 0
+
+    def bump(self):
+        """
+        Give the version a new value and return ``(previous, new)``. The row
+        stays locked until the transaction ends, and other processes see the
+        new value only once the recipe change that bumped it commits. Values
+        come from a sequence, so one taken back by a rollback is never handed
+        out again and can't be mistaken for a later change.
+        """
+        table = connection.ops.quote_name(RecipeVersion._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT version FROM {table} WHERE id = 1 FOR UPDATE")
+            previous = cursor.fetchone()
+            cursor.execute(
+                f"INSERT INTO {table} (id, version) VALUES (1, nextval('product_recipe_version_seq')) "
+                f"ON CONFLICT (id) DO UPDATE SET version = EXCLUDED.version "
+                f"RETURNING version"
+            )
+            return previous[0] if previous else 0, cursor.fetchone()[0]
+
+
+class RecipeVersion(models.Model):
+    """A single row changed with every recipe change, which tells every process when its compiled recipes are stale."""
+    version = models.PositiveBigIntegerField(default=0)
+
+    objects = RecipeVersionQuerySet.as_manager()
+
+    def __str__(self):
+        return f"Recipes v{self.version}"
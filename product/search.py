@@ -0,0 +1,5 @@
+from main.search import NameSearch
+from .models import Product
+
+# Module-level rather than in views so that the bulk writers can clear it too
+product_search = NameSearch(Product)
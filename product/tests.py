@@ -1,3 +1,195 @@
-from django.test import TestCase
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from stock.models import InsufficientStockError, Stock, StockType
+from .availability import BillOfMaterials, bom
+from .models import Product, RecipeVersion, StockVariant
+from .search import product_search
 
 # Create your tests here.
+
+
+class ProductSaleTests(TestCase):
+    def setUp(self):
+        stock_type = StockType.objects.create(name='Oil')
+        self.oil = Stock.objects.create(name='CR7 Oil', stock_type=stock_type, opening_quantity=20)
+        self.bottle = Stock.objects.create(name='9ml Bottle', stock_type=stock_type, opening_quantity=5)
+        self.product = Product.objects.create(name='CR7 9ml', price=199)
+        StockVariant.objects.create(product=self.product, stock=self.oil, quantity=9)
+        StockVariant.objects.create(product=self.product, stock=self.bottle, quantity=1)
+
+    def test_sale_is_all_or_nothing(self):
+        self.bottle.sale(5)
+        with self.assertRaises(InsufficientStockError):
+            self.product.sale(1)
+        self.oil.refresh_from_db()
+        self.assertEqual(self.oil.sale_quantity, 0)
+
+
+class ConcurrentProductSaleTests(TransactionTestCase):
+    def test_parallel_sales_sharing_stocks(self):
+        stock_type = StockType.objects.create(name='Oil')
+        oil = Stock.objects.create(name='CR7 Oil', stock_type=stock_type, opening_quantity=1000)
+        bottle = Stock.objects.create(name='9ml Bottle', stock_type=stock_type, opening_quantity=150)
+        first = Product.objects.create(name='CR7 9ml', price=199)
+        StockVariant.objects.create(product=first, stock=oil, quantity=1)
+        StockVariant.objects.create(product=first, stock=bottle, quantity=1)
+        # Variants created in the opposite order, to catch lock-order deadlocks
+        second = Product.objects.create(name='CR7 Tester', price=99)
+        StockVariant.objects.create(product=second, stock=bottle, quantity=1)
+        StockVariant.objects.create(product=second, stock=oil, quantity=1)
+
+        def sell_one(index):
+            try:
+                Product.objects.get(pk=(first, second)[index % 2].pk).sale(1)
+                return True
+            except InsufficientStockError:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=20) as executor:
+            results = list(executor.map(sell_one, range(300)))
+
+        oil.refresh_from_db()
+        bottle.refresh_from_db()
+        self.assertEqual(results.count(True), 150)
+        self.assertEqual(bottle.balance_quantity, 0)
+        self.assertEqual(oil.balance_quantity, 850)
+
+
+class BillOfMaterialsTests(TestCase):
+    def setUp(self):
+        stock_type = StockType.objects.create(name='Oil')
+        self.oil = Stock.objects.create(name='CR7 Oil', stock_type=stock_type, opening_quantity=20)
+        self.bottle = Stock.objects.create(name='9ml Bottle', stock_type=stock_type, opening_quantity=-1)
+        self.product = Product.objects.create(name='CR7 9ml', price=199)
+        self.empty = Product.objects.create(name='CR7 Refill', price=99)
+        StockVariant.objects.create(product=self.product, stock=self.oil, quantity=9)
+
+    def test_matches_sql_annotation(self):
+        StockVariant.objects.create(product=self.empty, stock=self.bottle, quantity=1)
+        sql = dict(Product.objects.with_availability().values_list('pk', 'available_quantity'))
+        self.assertEqual(bom.availability(list(sql)), sql)
+        self.assertEqual(sql, {self.product.pk: 2, self.empty.pk: -1})
+
+    def test_balances_are_read_live_in_one_query(self):
+        bom.compiled()
+        self.oil.sale(10)
+        # The recipe version, then the balances
+        with self.assertNumQueries(2):
+            self.assertEqual(bom.availability([self.product.pk, self.empty.pk]), {self.product.pk: 1, self.empty.pk: 0})
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_recipe_edits_reach_every_process(self):
+        self.assertEqual(bom.availability([self.product.pk]), {self.product.pk: 2})
+
+        # Another worker shares nothing with this one but the database
+        StockVariant.objects.filter(product=self.product).update(quantity=5)
+        RecipeVersion.objects.bump()
+        self.assertEqual(bom.availability([self.product.pk]), {self.product.pk: 4})
+
+        other = BillOfMaterials()
+        self.assertEqual(other.availability([self.product.pk]), {self.product.pk: 4})
+        variant = StockVariant.objects.create(product=self.product, stock=self.bottle, quantity=1)
+        self.assertEqual(other.availability([self.product.pk]), {self.product.pk: -1})
+        variant.delete()
+        self.assertEqual(other.availability([self.product.pk]), {self.product.pk: 4})
+
+    def test_rolled_back_recipe_edits_are_forgotten(self):
+        other = BillOfMaterials()
+        other.compiled()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            StockVariant.objects.create(product=self.product, stock=self.bottle, quantity=1)
+            self.assertEqual(bom.availability([self.product.pk]), {self.product.pk: -1})
+            raise IntegrityError
+        self.assertEqual(bom.availability([self.product.pk]), {self.product.pk: 2})
+
+        # The version read inside the rolled-back transaction is never handed out again
+        StockVariant.objects.filter(product=self.product).update(quantity=5)
+        RecipeVersion.objects.bump()
+        self.assertEqual(other.availability([self.product.pk]), {self.product.pk: 4})
+        self.assertEqual(bom.availability([self.product.pk]), {self.product.pk: 4})
+
+    def test_update_product_recompiles_one_recipe(self):
+        bom.compiled()
+        StockVariant.objects.filter(product=self.product).update(quantity=5)
+        # Two to bump the version, then the product's recipe
+        with self.assertNumQueries(3):
+            bom.update_product(self.product.pk)
+        self.assertEqual(bom.availability([self.product.pk]), {self.product.pk: 4})
+
+
+class ProductLookupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('cashier', password='secret')
+        stock_type = StockType.objects.create(name='Oil')
+        self.oil = Stock.objects.create(name='CR7 Oil', stock_type=stock_type, opening_quantity=20)
+        self.product = Product.objects.create(name='CR7 9ml', price=199)
+        self.empty = Product.objects.create(name='CR7 Refill', price=99)
+        StockVariant.objects.create(product=self.product, stock=self.oil, quantity=9)
+
+    async def test_async_search_and_availability(self):
+        await self.async_client.aforce_login(self.user)
+
+        response = await self.async_client.get('/products/search/', {'term': 'cr7', 'in_stock': '1'})
+        self.assertEqual(response.json()['results'], [{'id': self.product.pk, 'text': 'CR7 9ml', 'available': 2}])
+
+        response = await self.async_client.get('/products/availability/', {'ids': f'{self.product.pk},{self.empty.pk},0'})
+        data = response.json()
+        self.assertEqual([(row['id'], row['available']) for row in data['results']], [(self.product.pk, 2), (self.empty.pk, 0)])
+        self.assertEqual(data['missing'], [0])
+
+        response = await self.async_client.get('/products/availability/', {'ids': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+        # Selling out hides the product at once, though no signal clears the search cache
+        await sync_to_async(self.oil.sale)(18)
+        response = await self.async_client.get('/products/search/', {'term': 'cr7', 'in_stock': '1'})
+        self.assertEqual(response.json()['results'], [])
+
+    def test_lookups_require_login(self):
+        self.assertEqual(self.client.get('/products/availability/').status_code, 302)
+        self.assertEqual(self.client.get('/stocks/search/').status_code, 302)
+
+
+class ProductApiTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('admin', password='secret'))
+        stock_type = StockType.objects.create(name='Oil')
+        self.oil = Stock.objects.create(name='CR7 Oil', stock_type=stock_type, opening_quantity=90)
+        self.bottle = Stock.objects.create(name='9ml Bottle', stock_type=stock_type, opening_quantity=5)
+        self.product = Product.objects.create(name='CR7 9ml', price=199)
+        StockVariant.objects.create(product=self.product, stock=self.oil, quantity=9)
+
+    def upsert(self, products):
+        response = self.client.post('/products/api/', {'products': products}, content_type='application/json')
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()][:-1]
+
+    def test_upserts_products_and_replaces_variants(self):
+        results = self.upsert([
+            {'name': 'CR7 9ml', 'price': 249, 'variants': [{'stock': self.bottle.pk, 'quantity': 1}]},
+            {'name': 'CR7 30ml', 'price': 599, 'variants': [{'stock': self.oil.pk, 'quantity': 30}]},
+            {'name': 'Sauvage 9ml', 'variants': [{'stock': self.oil.pk, 'quantity': 9}]},
+            {'id': self.product.pk, 'variants': [{'stock': self.oil.pk, 'quantity': 9}]},
+        ])
+        self.assertEqual([result['status'] for result in results], ['updated', 'created', 'invalid', 'invalid'])
+        self.assertEqual(results[2]['errors'], ["'price' is required."])
+        self.assertEqual(results[3]['errors'], ['The product appears twice in the request.'])
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.price, 249)
+        self.assertEqual(list(self.product.stockvariant_set.values_list('stock', 'quantity')), [(self.bottle.pk, 1)])
+        # The compiled recipes follow the bulk writes
+        self.assertEqual(bom.availability([self.product.pk, results[1]['id']]), {self.product.pk: 5, results[1]['id']: 3})
+
+    def test_renames_reach_the_product_search(self):
+        self.assertEqual(product_search.search('CR7'), ([(self.product.pk, 'CR7 9ml')], False))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.upsert([{'id': self.product.pk, 'name': 'CR7 10ml', 'variants': [{'stock': self.oil.pk, 'quantity': 9}]}])
+        self.assertEqual(product_search.search('CR7'), ([(self.product.pk, 'CR7 10ml')], False))
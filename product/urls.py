@@ -6,6 +6,8 @@ urlpatterns = [
     path('', views.ProductListView.as_view(), name='product-list'),
     path('create/', views.ProductCreateView.as_view(), name='product-create'),
     path('search/', views.product_search_ajax_view, name='product_search_ajax'),
+    path('availability/', views.product_availability_view, name='product-availability'),
+    path('api/', views.product_api_view, name='product-api'),
 
 
     path('<int:pk>/update/', views.ProductUpdateView.as_view(), name='product-edit'),
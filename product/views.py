@@ -1,3 +1,6 @@
+from asgiref.sync import sync_to_async
+from .api import ProductWriter
+from .availability import bom
 from .models import Product, StockVariant
 from django.views.generic import ListView, CreateView, UpdateView
 from django.contrib.auth.mixins import LoginRequiredMixin
@@ -5,14 +8,60 @@ from django.shortcuts import redirect
 from .forms import ProductForm, StockVariantInlineFormset
 from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
+from main.api import bulk_api_view
+from main.pagination import KeysetPaginationMixin
+from main.search import page_number
+from .search import product_search
 
 
 # Create your views here.
 
+MAX_LOOKUP_IDS = 200
 
-class ProductListView(LoginRequiredMixin, ListView):
+
+class ProductListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Product
 
+    # ?sort= values mapped to ORDER BY clauses over the availability annotation
+    sort_options = {
+        'available': ('available_quantity', 'name', 'id'),
+        '-available': ('-available_quantity', 'name', 'id'),
+        'name': ('name', 'id'),
+    }
+
+    def get_queryset(self):
+        stock_filter = self.request.GET.get('stock')
+        if stock_filter not in ('in', 'out') and self.request.GET.get('sort') not in ('available', '-available'):
+            # Availability is only shown: it is filled in per page from the bill of materials
+            return Product.objects.all()
+
+        # Filtering or sorting on availability needs it in SQL
+        queryset = Product.objects.with_availability()
+        if stock_filter == 'out':
+            queryset = queryset.filter(available_quantity__lte=0)
+        elif stock_filter == 'in':
+            queryset = queryset.filter(available_quantity__gt=0)
+
+        return queryset
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator, page, object_list, has_next = super().paginate_queryset(queryset, page_size)
+        missing = [product for product in object_list if '_available_quantity' not in product.__dict__]
+        if missing:
+            availability = bom.availability([product.pk for product in missing])
+            for product in missing:
+                product.available_quantity = availability[product.pk]
+        return paginator, page, object_list, has_next
+
+    def get_keyset_ordering(self):
+        return self.sort_options.get(self.request.GET.get('sort'), self.sort_options['name'])
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['stock_filter'] = self.request.GET.get('stock', '')
+        context['sort'] = self.request.GET.get('sort', '')
+        return context
+
 
 class ProductCreateView(LoginRequiredMixin, CreateView):
     model = Product
@@ -81,40 +130,67 @@ class ProductUpdateView(LoginRequiredMixin, UpdateView):
 
 
 @login_required
-def product_search_ajax_view(request):
+async def product_search_ajax_view(request):
     """
-    Handles Select2 AJAX search requests for product items tied to a specific business.
+    Handles Select2 AJAX search requests for products. Async, so a burst of
+    keystrokes from many terminals doesn't hold one worker thread each.
     """
-    # 1. Get the search term from the AJAX request (Select2 passes it as 'term')
+    # Select2 passes the search term as 'term' and the page as 'page'
     search_term = request.GET.get('term', '')
-
-    # 2. Query the database
-    # CRITICAL: Filter by business_id first for security and context
-    products_queryset = Product.objects.all()
-
-    # Filter based on the search term (case-insensitive contains lookup)
-    if search_term:
-        products_queryset = products_queryset.filter(
-            name__icontains=search_term
+    page = page_number(request)
+
+    # Optionally hide products that cannot be sold right now. Balances move by counter
+    # UPDATEs that clear no cache, so which products are in stock is never cached.
+    if request.GET.get('in_stock'):
+        products, more = await product_search.asearch(
+            search_term, page,
+            queryset=Product.objects.with_availability().filter(available_quantity__gt=0),
+            variant=None,
         )
-    
-    # Limit the results for performance (Select2 usually fetches 10-30 items per request)
-    products = products_queryset[:30] 
+    else:
+        products, more = await product_search.asearch(search_term, page)
+
+    # Availability changes with every sale, so the balances are read fresh too
+    availability = await sync_to_async(bom.availability)([pk for pk, name in products]) if products else {}
 
-    # 3. Format the data for Select2
     # Select2 requires a list of dictionaries with 'id' and 'text' keys
-    results = []
-    for product in products:
-        results.append({
-            'id': product.pk,          # The value to be stored in the model field
-            'text': product.name       # The text displayed to the user
-        })
-
-    # 4. Return the response
+    results = [
+        {'id': pk, 'text': name, 'available': availability.get(pk, 0)}
+        for pk, name in products
+    ]
+
     return JsonResponse({
         'results': results,
-        # 'pagination' key is needed if you implement scrolling/loading more results
         'pagination': {
-            'more': products_queryset.count() > len(products) 
+            'more': more
         }
     })
+
+
+@login_required
+async def product_availability_view(request):
+    """
+    JSON availability of the products in ?ids=1,2,3 (at most MAX_LOOKUP_IDS),
+    e.g. to refresh the cart of a POS terminal before checkout. Unknown ids
+    are listed under 'missing'.
+    """
+    try:
+        ids = [int(pk) for pk in request.GET.get('ids', '').split(',') if pk.strip()]
+    except ValueError:
+        return JsonResponse({'error': 'ids must be a comma-separated list of product ids.'}, status=400)
+    if len(ids) > MAX_LOOKUP_IDS:
+        return JsonResponse({'error': f'At most {MAX_LOOKUP_IDS} ids can be looked up at once.'}, status=400)
+
+    results = [row async for row in Product.objects.filter(pk__in=ids).order_by('pk').values('id', 'name', 'price')]
+    availability = await sync_to_async(bom.availability)([row['id'] for row in results]) if results else {}
+    for row in results:
+        row['available'] = availability[row['id']]
+    found = {row['id'] for row in results}
+    return JsonResponse({
+        'results': results,
+        'missing': [pk for pk in dict.fromkeys(ids) if pk not in found],
+    })
+
+
+# Bulk JSON upsert for integrations; see main/api.py
+product_api_view = bulk_api_view(ProductWriter, 'products')
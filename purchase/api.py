@@ -0,0 +1,47 @@
+from main.api import CREATED, BulkWriter, ids, item_list, scalar_fields
+from main.importer import CSVImporter, RowError
+from stock.models import Stock
+from .models import PurchaseBill, StockPurchase
+from .services import post_purchase_bill
+
+
+class PurchaseBillWriter(BulkWriter):
+    """Items: ``{"key", "lines": [{"stock", "quantity", "price"}]}`` with stock ids."""
+    scope = 'purchasebill'  # Shared with PurchaseBillCreateView
+    success_url_name = 'purchasebill-list'
+
+    def load_maps(self, items):
+        lines = [line for item in items if isinstance(item.get('lines'), list) for line in item['lines']]
+        self.stock_ids = set(
+            Stock.objects.filter(pk__in=ids(line.get('stock') for line in lines if isinstance(line, dict)))
+            .values_list('pk', flat=True)
+        )
+
+    def parse(self, item):
+        scalar_fields(item)
+        lines = []
+        for number, line in enumerate(item_list(item, 'lines'), start=1):
+            try:
+                line = scalar_fields(line)
+                stock_id = CSVImporter.integer(line, 'stock')
+                if stock_id not in self.stock_ids:
+                    raise RowError(f"Unknown stock {stock_id}.")
+                quantity = CSVImporter.integer(line, 'quantity', minimum=1)
+                price = CSVImporter.decimal(line, 'price')
+            except RowError as exc:
+                raise RowError(f"Line {number}: {exc}")
+            lines.append(StockPurchase(stock_id=stock_id, quantity=quantity, price=price))
+        return lines
+
+    def write(self, lines):
+        purchase_bill = PurchaseBill.objects.create()
+        post_purchase_bill(purchase_bill, lines)
+        return purchase_bill, CREATED
+
+    def describe(self, results):
+        bill_numbers = dict(
+            PurchaseBill.objects.filter(pk__in=[result['id'] for result in results if result['id']])
+            .values_list('pk', 'bill_number')
+        )
+        for result in results:
+            result['bill_number'] = bill_numbers.get(result['id'])
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class PurchaseConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'purchase'
+
+    def ready(self):
+        from sale.models import daily_sales_recorded
+        from .reorder import invalidate_consumption
+
+        # Sales on earlier days of the window change the cached consumption
+        daily_sales_recorded.connect(invalidate_consumption, dispatch_uid='purchase-reorder-consumption')
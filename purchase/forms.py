@@ -2,6 +2,7 @@ from django import forms
 from django.forms.models import inlineformset_factory
 from .models import PurchaseBill, StockPurchase
 from stock.models import Stock
+from main.fields import LazyChoiceInlineFormSet, LazyChoiceModelForm, LazyModelChoiceField
 
 class PurchaseBillForm(forms.ModelForm):
     class Meta:
@@ -15,12 +16,14 @@ class PurchaseBillForm(forms.ModelForm):
         # self.fields['some_field'].widget.attrs.update({'class': 'my-custom-class'})
 
 
-class StockPurchaseForm(forms.ModelForm):
+class StockPurchaseForm(LazyChoiceModelForm):
+    # Only the selected stock is rendered; Select2 searches the rest
+    stock = LazyModelChoiceField(queryset=Stock.objects.select_related('stock_type'))
+
     class Meta:
         model = StockPurchase
         fields = ['stock', 'quantity', 'price']
         widgets = {
-            'stock': forms.Select(attrs={'class': 'form-select'}),
             'quantity': forms.NumberInput(attrs={'class': 'form-input'}),
             'price': forms.NumberInput(attrs={'class': 'form-input'}),
         }
@@ -40,6 +43,7 @@ StockPurchaseInlineFormset = inlineformset_factory(
     PurchaseBill,
     StockPurchase,
     form=StockPurchaseForm,
+    formset=LazyChoiceInlineFormSet,
     extra=1,  # Number of empty forms to display initially
     can_delete=True,
 )
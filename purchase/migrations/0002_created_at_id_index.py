@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 08:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('purchase', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='purchasebill',
+            index=models.Index(fields=['created_at', 'id'], name='purchase_pu_created_d49de4_idx'),
+        ),
+    ]
@@ -1,30 +1,70 @@
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, models
+from django.db.models import Count, DecimalField, F, Sum, Value
+from django.db.models.functions import Coalesce
 from stock.models import Stock
+from main.models import assign_bill_numbers
+from django.conf import settings
 from django.db.models.signals import post_delete
 from django.dispatch import receiver
 from django.shortcuts import reverse
 
 # Create your models here.
 
+class PurchaseBillQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # One block allocation numbers every bill in the batch
+        objs = assign_bill_numbers(list(objs), **PurchaseBill.bill_number_series())
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def with_totals(self):
+        """Annotate each bill with its total amount, line count and item quantity in one grouped query."""
+        return self.annotate(
+            total_amount=Coalesce(
+                Sum(F('stockpurchase__quantity') * F('stockpurchase__price')),
+                Value(0),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+            line_count=Count('stockpurchase'),
+            item_quantity=Coalesce(Sum('stockpurchase__quantity'), Value(0)),
+        )
+
+
 class PurchaseBill(models.Model):
     bill_number = models.CharField(max_length=20, unique=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = PurchaseBillQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+        ]
+
     def __str__(self):
         return f"Purchase Bill #{self.bill_number}"
     
     def save(self, *args, **kwargs):
-        # Save the instance first to get a unique ID
-        is_new = self.pk is None
+        # Number the bill before inserting it, so it is created in one write
+        if not self.bill_number:
+            assign_bill_numbers([self], **PurchaseBill.bill_number_series())
         super(PurchaseBill, self).save(*args, **kwargs)
 
-        if is_new:
-            # Now that we have an ID, generate the unique bill number
-            self.bill_number = f'PUR-{self.id:04d}'
-            # Save again to update the bill_number field
-            super(PurchaseBill, self).save(update_fields=['bill_number'])
+    @staticmethod
+    def bill_number_series():
+        return {
+            'prefix': getattr(settings, 'PURCHASE_BILL_PREFIX', 'PUR'),
+            'per_financial_year': getattr(settings, 'BILL_NUMBERS_PER_FINANCIAL_YEAR', False),
+        }
     
+    def delete(self, using=None, keep_parents=False):
+        from .services import delete_purchase_bill
+
+        if using not in (None, DEFAULT_DB_ALIAS):
+            raise ValueError("Purchase bills are only deleted from the default database.")
+        # Takes back the stock of every line in one statement rather than one per cascaded line
+        return delete_purchase_bill(self)
+
     def get_absolute_url(self):
         return reverse('purchasebill-edit', kwargs={'pk': self.pk})
 
@@ -43,22 +83,28 @@ class StockPurchase(models.Model):
     def amount(self):
         return self.quantity * self.price
 
-    def save(self, *args, **kwargs):
-        is_new = self.pk is None # Check if this is a new instance
-        super().save(*args, **kwargs) # Save the instance first
-
-        # If it's a new instance, update the stock quantity
-        if is_new:
-            self.stock.purchase(self.quantity) # Call the stock's purchase method
-        
-        # TODO: Add logic for updating stock quantity if an existing StockPurchase is modified.
-        # This would require comparing old_quantity with new_quantity.
-        # For now, we're only handling initial creation.
-
-
-# @receiver(post_delete, sender=StockPurchase)
-# def restock_on_stock_purchase_delete(sender, instance, **kwargs):
-#     """
-#     When a StockPurchase is deleted, 'return' the purchased quantity from stock.
-#     """
-#     instance.stock.purchase_return(instance.quantity)
\ No newline at end of file
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        from .services import edit_purchase_bill
+
+        # edit_purchase_bill() inserts or updates the whole line, with the stock, on the
+        # default database; the arguments Django's own callers pass only matter when
+        # they ask for something else
+        if using not in (None, DEFAULT_DB_ALIAS):
+            raise ValueError("Purchase lines are only written to the default database.")
+        if update_fields is not None and not update_fields:
+            return
+        # Stock moves by the difference from the saved line
+        edit_purchase_bill(self.purchasebill, [self])
+
+
+@receiver(post_delete, sender=StockPurchase)
+def unstock_on_stock_purchase_delete(sender, instance, **kwargs):
+    """
+    When a StockPurchase is deleted on its own (e.g. from the admin), take
+    the purchased quantity back from stock. Bill edits and bill deletes go
+    through purchase.services, which take stock back in bulk instead.
+    """
+    origin = kwargs.get('origin')
+    if isinstance(origin, Stock) or getattr(origin, 'model', None) is Stock:
+        return  # The stock itself is being deleted along with its ledger
+    instance.stock.purchase_return(instance.quantity, source=instance.purchasebill)
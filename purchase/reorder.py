@@ -0,0 +1,152 @@
+"""
+Low-stock and reorder levels from sales velocity.
+
+Each stock's consumption over a rolling window is read from the
+DailyStockConsumption rollup, which already expands every sale line
+through StockVariant, with one grouped query for all stocks. The days
+before today are grouped once and cached per day and window; today's
+rows, the only ones a busy till keeps changing, are read live and added
+on, so a sale costs the next view one small query for today's rows rather
+than regrouping the window. This is the incremental update: today's sales
+never touch the cache, and a sale that rolls back changes nothing. Only a
+sale recorded on an earlier day of the window (an edit to an old bill)
+drops the cache, once it commits. Balances are always read live. The
+cache is also rebuilt after ``CACHE_TIMEOUT``, which bounds the drift when
+several processes each hold their own cache.
+"""
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from sale.models import DailyStockConsumption
+from stock.models import BALANCE, Stock
+from .models import StockPurchase
+
+CACHE_TIMEOUT = 60 * 60
+
+
+def parameters(window_days=None, lead_time_days=None, safety_days=None, cover_days=None):
+    """The reorder parameters, from the REORDER_* settings unless given."""
+    values = {
+        'window_days': (window_days, 'REORDER_WINDOW_DAYS', 30),
+        'lead_time_days': (lead_time_days, 'REORDER_LEAD_TIME_DAYS', 7),
+        'safety_days': (safety_days, 'REORDER_SAFETY_DAYS', 3),
+        'cover_days': (cover_days, 'REORDER_COVER_DAYS', 30),
+    }
+    return {
+        name: getattr(settings, setting, default) if value is None else value
+        for name, (value, setting, default) in values.items()
+    }
+
+
+def consumption_key(day, window_days):
+    return f'reorder:consumption:{window_days}:{day.isoformat()}'
+
+
+def consumption(window_days, today=None):
+    """{stock_id: units used by sales in the ``window_days`` days up to and including today}."""
+    today = today or timezone.localdate()
+    key = consumption_key(today, window_days)
+    earlier = cache.get(key)
+    if earlier is None:
+        earlier = dict(
+            DailyStockConsumption.objects
+            .filter(date__gt=today - timedelta(days=window_days), date__lt=today)
+            .values('stock')
+            .annotate(total=Sum('quantity'))
+            .values_list('stock', 'total')
+            .order_by()
+        )
+        cache.set(key, earlier, CACHE_TIMEOUT)
+    totals = dict(earlier)
+    for stock_id, quantity in DailyStockConsumption.objects.filter(date=today).values_list('stock', 'quantity'):
+        totals[stock_id] = totals.get(stock_id, 0) + quantity
+    return totals
+
+
+def invalidate_consumption(sender, day, **kwargs):
+    """
+    Drop the cached totals of the configured window once a sale recorded on
+    an earlier ``day`` of the window commits; today's sales are read live.
+    """
+    today = timezone.localdate()
+    window_days = parameters()['window_days']
+    if not today - timedelta(days=window_days) < day < today:
+        return
+    key = consumption_key(today, window_days)
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def reorder_levels(window_days=None, lead_time_days=None, safety_days=None, cover_days=None, today=None):
+    """
+    One row per stock with its balance, daily velocity, days of cover,
+    reorder point and suggested purchase quantity, most urgent first.
+
+    velocity        units used per day over the window (or over the stock's
+                    life, if it is younger than the window)
+    days_of_cover   balance / velocity; None for stocks that aren't selling
+    reorder_point   units needed to last the supplier lead time plus the
+                    safety margin; at or below it the stock needs reordering
+    suggested       units to buy so the stock lasts the lead time plus
+                    ``cover_days`` after the purchase arrives
+    """
+    today = today or timezone.localdate()
+    params = parameters(window_days, lead_time_days, safety_days, cover_days)
+    window_days = params['window_days']
+    lead_time_days, safety_days, cover_days = params['lead_time_days'], params['safety_days'], params['cover_days']
+
+    used = consumption(window_days, today)
+    stocks = (
+        Stock.objects
+        .annotate(balance=BALANCE)
+        .values('id', 'name', 'created_at', 'balance', 'stock_type__metric')
+    )
+    rows = []
+    for stock in stocks:
+        consumed = used.get(stock['id'], 0)
+        days = max(1, min(window_days, (today - timezone.localdate(stock['created_at'])).days + 1))
+        velocity = max(consumed, 0) / days
+        balance = stock['balance']
+        reorder_point = math.ceil(velocity * (lead_time_days + safety_days))
+        needs_reorder = velocity > 0 and balance <= reorder_point
+        rows.append({
+            'id': stock['id'],
+            'name': stock['name'],
+            'metric': stock['stock_type__metric'],
+            'balance': balance,
+            'consumed': consumed,
+            'velocity': round(velocity, 2),
+            'days_of_cover': round(balance / velocity, 1) if velocity > 0 else None,
+            'reorder_point': reorder_point,
+            'needs_reorder': needs_reorder,
+            'suggested': max(0, math.ceil(velocity * (lead_time_days + cover_days)) - balance) if needs_reorder else 0,
+        })
+    rows.sort(key=lambda row: (row['days_of_cover'] is None, row['days_of_cover'] or 0, row['name']))
+    return rows
+
+
+def suggested_purchase(rows=None):
+    """
+    Lines for a purchase bill that restocks everything at or below its
+    reorder point: ``[{'stock': id, 'quantity': n, 'price': last price}]``.
+    The price is the one last paid for the stock, if it was ever bought.
+    """
+    rows = reorder_levels() if rows is None else rows
+    lines = [row for row in rows if row['suggested'] > 0]
+    # DISTINCT ON picks each stock's latest purchase line in one query
+    last_prices = dict(
+        StockPurchase.objects
+        .filter(stock__in=[row['id'] for row in lines])
+        .order_by('stock', '-purchasebill__created_at', '-id')
+        .distinct('stock')
+        .values_list('stock', 'price')
+    ) if lines else {}
+    return [
+        {'stock': row['id'], 'quantity': row['suggested'], 'price': last_prices.get(row['id'])}
+        for row in lines
+    ]
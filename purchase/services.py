@@ -0,0 +1,104 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from main.models import delete_rows
+from stock.models import Stock
+from .models import PurchaseBill, StockPurchase
+
+
+def edit_purchase_bill(purchase_bill, changed_lines, deleted_lines=()):
+    """
+    Apply a set of line changes to a purchase bill in a fixed number of queries.
+
+    ``changed_lines`` are new or modified StockPurchase instances and
+    ``deleted_lines`` existing ones to remove (e.g. ``formset.save(commit=False)``
+    and ``formset.deleted_objects``). The old versions of the touched lines
+    are read and locked, and the difference between old and new quantities
+    is summed into a net change per stock. Stocks bought more are added by
+    one UPDATE, stocks bought less are taken back by one conditional UPDATE
+    (all of them locked first in primary-key order), and both are recorded in the stock ledger. Lines are then written with
+    one bulk statement per kind of change. Raises InsufficientStockError,
+    leaving nothing written, if taking stock back would make it negative
+    because it has already been sold.
+    """
+    changed_lines = list(changed_lines)
+    deleted_lines = [line for line in deleted_lines if line.pk is not None]
+    for line in changed_lines:
+        line.purchasebill = purchase_bill
+
+    with transaction.atomic():
+        existing_ids = [line.pk for line in changed_lines + deleted_lines if line.pk is not None]
+        previous = {}
+        if existing_ids:
+            previous = {
+                row['pk']: row
+                for row in StockPurchase.objects.select_for_update()
+                .filter(purchasebill=purchase_bill, pk__in=existing_ids)
+                .values('pk', 'stock_id', 'quantity')
+            }
+            missing = set(existing_ids) - set(previous)
+            if missing:
+                raise StockPurchase.DoesNotExist(
+                    f"Purchase line {min(missing)} is not on bill {purchase_bill.bill_number}."
+                )
+
+        # Net stock quantities: what the bill buys after the edit minus what it bought before
+        stock_quantities = defaultdict(int)
+        for row in previous.values():
+            stock_quantities[row['stock_id']] -= row['quantity']
+        for line in changed_lines:
+            stock_quantities[line.stock_id] += line.quantity
+
+        returned = {pk: -quantity for pk, quantity in stock_quantities.items() if quantity < 0}
+        bought = {pk: quantity for pk, quantity in stock_quantities.items() if quantity > 0}
+        if returned and bought:
+            # As in edit_sale_bill(): one ordered pass over both sets, so opposite edits can't deadlock
+            Stock.objects.lock([*returned, *bought])
+        Stock.objects.purchase_return(returned, source=purchase_bill)
+        Stock.objects.purchase(bought, source=purchase_bill)
+
+        if deleted_lines:
+            # Nothing references StockPurchase, and its post_delete handler would
+            # take back row by row stock that has just been taken back in bulk.
+            delete_rows(StockPurchase.objects.filter(pk__in=[line.pk for line in deleted_lines]))
+        StockPurchase.objects.bulk_create([line for line in changed_lines if line.pk is None])
+        updated_lines = [line for line in changed_lines if line.pk in previous]
+        now = timezone.now()
+        for line in updated_lines:
+            line.updated_at = now
+        StockPurchase.objects.bulk_update(updated_lines, ['stock', 'quantity', 'price', 'updated_at'])
+    return changed_lines
+
+
+def post_purchase_bill(purchase_bill, stock_purchases):
+    """Post the lines of a new purchase bill, which is an edit that only adds lines."""
+    return edit_purchase_bill(purchase_bill, stock_purchases)
+
+
+def delete_purchase_bill(purchase_bill):
+    """
+    Delete a purchase bill and take back everything it added to stock.
+
+    The bill's lines are locked and summed per stock in one grouped query,
+    the totals are taken back by one conditional UPDATE, and the lines and
+    the bill are removed with one DELETE each, instead of cascading through
+    the lines and returning their stock one row at a time. Returns what
+    Model.delete() does, the number of rows deleted and a count per model.
+    Raises InsufficientStockError, leaving the bill in place, if part of
+    what it bought has already been sold.
+    """
+    with transaction.atomic():
+        lines = StockPurchase.objects.filter(purchasebill=purchase_bill)
+        list(lines.select_for_update().values_list('pk', flat=True))
+        stock_quantities = dict(
+            lines.values('stock_id').annotate(total=Sum('quantity')).values_list('stock_id', 'total').order_by()
+        )
+        Stock.objects.purchase_return(stock_quantities, source=purchase_bill)
+
+        lines_deleted = delete_rows(lines)
+        deleted, counts = PurchaseBill.objects.filter(pk=purchase_bill.pk).delete()
+    counts[StockPurchase._meta.label] = lines_deleted
+    return deleted + lines_deleted, counts
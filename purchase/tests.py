@@ -1,3 +1,218 @@
-from django.test import TestCase
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from product.models import Product, StockVariant
+from sale.models import ProductSale, SaleBill
+from sale.services import post_sale_bill
+from stock.models import InsufficientStockError, Stock, StockMovement, StockType
+from .models import PurchaseBill, StockPurchase
+from .reorder import reorder_levels
+from .services import edit_purchase_bill, post_purchase_bill
 
 # Create your tests here.
+
+
+class PurchaseBillEditTests(TestCase):
+    def setUp(self):
+        stock_type = StockType.objects.create(name='Oil')
+        self.oil = Stock.objects.create(name='CR7 Oil', stock_type=stock_type)
+        self.bottle = Stock.objects.create(name='9ml Bottle', stock_type=stock_type)
+        self.bill = PurchaseBill.objects.create()
+        self.oil_line, self.bottle_line = post_purchase_bill(self.bill, [
+            StockPurchase(stock=self.oil, quantity=100, price=5),
+            StockPurchase(stock=self.bottle, quantity=20, price=10),
+        ])
+
+    def purchased(self):
+        self.oil.refresh_from_db()
+        self.bottle.refresh_from_db()
+        return self.oil.purchase_quantity, self.bottle.purchase_quantity
+
+    def test_saving_an_unchanged_line_does_not_add_again(self):
+        self.oil_line.save()
+        self.assertEqual(self.purchased(), (100, 20))
+
+    def test_create_goes_through_the_edit(self):
+        StockPurchase.objects.create(purchasebill=self.bill, stock=self.bottle, quantity=5, price=10)
+        self.assertEqual(self.purchased(), (100, 25))
+        with self.assertRaises(ValueError):
+            self.oil_line.save(using='other')
+
+    def test_edit_applies_net_stock_changes(self):
+        self.oil_line.quantity = 80
+        self.bottle_line.stock = self.oil
+        with self.assertNumQueries(9):
+            edit_purchase_bill(
+                self.bill, [self.oil_line, self.bottle_line, StockPurchase(stock=self.bottle, quantity=5, price=10)]
+            )
+        self.assertEqual(self.purchased(), (100, 5))
+
+        edit_purchase_bill(self.bill, [], [self.bottle_line])
+        self.assertEqual(self.purchased(), (80, 5))
+        self.assertEqual(self.bill.stockpurchase_set.count(), 2)
+
+    def test_edit_cannot_take_back_sold_stock(self):
+        Stock.objects.sale({self.oil.pk: 90})
+        self.oil_line.quantity = 50
+        with self.assertRaises(InsufficientStockError):
+            edit_purchase_bill(self.bill, [self.oil_line])
+        self.assertEqual(self.purchased(), (100, 20))
+
+    def test_deleting_a_line_takes_its_stock_back(self):
+        self.bottle_line.delete()
+        self.assertEqual(self.purchased(), (100, 0))
+
+    def test_delete_bill_takes_all_stock_back(self):
+        with self.assertNumQueries(13):
+            deleted = self.bill.delete()
+        self.assertEqual(deleted, (3, {'purchase.PurchaseBill': 1, 'purchase.StockPurchase': 2}))
+        self.assertEqual(self.purchased(), (0, 0))
+        self.assertFalse(PurchaseBill.objects.filter(pk=self.bill.pk).exists())
+        self.assertFalse(StockPurchase.objects.exists())
+
+        out = StringIO()
+        call_command('stock_ledger', 'verify', stdout=out)
+        self.assertIn('match the ledger', out.getvalue())
+
+    def test_delete_bill_keeps_it_when_stock_was_sold(self):
+        Stock.objects.sale({self.bottle.pk: 15})
+        with self.assertRaises(InsufficientStockError):
+            self.bill.delete()
+        self.assertEqual(self.purchased(), (100, 20))
+        self.assertEqual(StockPurchase.objects.filter(purchasebill=self.bill).count(), 2)
+
+    def test_deleting_a_stock_removes_its_purchases(self):
+        self.oil.delete()
+        self.assertFalse(StockPurchase.objects.filter(stock_id=self.oil_line.stock_id).exists())
+        self.assertFalse(StockMovement.objects.filter(stock_id=self.oil_line.stock_id).exists())
+
+
+class ConcurrentPurchaseBillEditTests(TransactionTestCase):
+    def test_edits_moving_stock_opposite_ways_do_not_deadlock(self):
+        stock_type = StockType.objects.create(name='Oil')
+        stocks = [
+            Stock.objects.create(name='CR7 Oil', stock_type=stock_type, opening_quantity=100),
+            Stock.objects.create(name='9ml Bottle', stock_type=stock_type, opening_quantity=100),
+        ]
+        bills = []
+        for stock in stocks:
+            bill = PurchaseBill.objects.create()
+            post_purchase_bill(bill, [StockPurchase(stock=stock, quantity=1, price=5)])
+            bills.append(bill)
+
+        def swap(index):
+            # One bill takes back oil and buys a bottle while the other does the opposite
+            try:
+                bill = PurchaseBill.objects.get(pk=bills[index % 2].pk)
+                line = bill.stockpurchase_set.get()
+                line.stock = stocks[1] if line.stock_id == stocks[0].pk else stocks[0]
+                edit_purchase_bill(bill, [line])
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(swap, range(200)))
+        self.assertEqual(sum(Stock.objects.values_list('purchase_quantity', flat=True)), 2)
+
+
+class ReorderTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        stock_type = StockType.objects.create(name='Oil', metric='ml')
+        self.oil = Stock.objects.create(name='CR7 Oil', stock_type=stock_type, opening_quantity=400)
+        self.bottle = Stock.objects.create(name='9ml Bottle', stock_type=stock_type, opening_quantity=500)
+        self.idle = Stock.objects.create(name='Idle Oil', stock_type=stock_type, opening_quantity=10)
+        Stock.objects.filter(pk__in=[self.oil.pk, self.bottle.pk, self.idle.pk]).update(
+            created_at=timezone.now() - timedelta(days=60)
+        )
+        self.product = Product.objects.create(name='CR7 9ml', price=199)
+        StockVariant.objects.create(product=self.product, stock=self.oil, quantity=9)
+        StockVariant.objects.create(product=self.product, stock=self.bottle, quantity=1)
+        post_purchase_bill(PurchaseBill.objects.create(), [StockPurchase(stock=self.oil, quantity=50, price=4)])
+
+    def sell(self, quantity):
+        post_sale_bill(SaleBill.objects.create(), [ProductSale(product=self.product, quantity=quantity)])
+
+    def levels(self):
+        return {row['id']: row for row in reorder_levels(window_days=30, lead_time_days=7, safety_days=3, cover_days=30)}
+
+    def test_velocity_cover_and_suggestion(self):
+        self.sell(30)  # 270 ml of oil and 30 bottles, so 9 ml and 1 bottle a day over the window
+        oil, bottle, idle = (self.levels()[stock.pk] for stock in (self.oil, self.bottle, self.idle))
+        self.assertEqual((oil['balance'], oil['velocity'], oil['days_of_cover'], oil['reorder_point']), (180, 9, 20, 90))
+        self.assertFalse(oil['needs_reorder'])
+        self.assertEqual((bottle['days_of_cover'], bottle['needs_reorder']), (470, False))
+        self.assertEqual((idle['velocity'], idle['days_of_cover'], idle['needs_reorder']), (0, None, False))
+
+    def test_cached_consumption_follows_each_sale(self):
+        self.sell(30)
+        self.levels()  # Caches the window's consumption
+        with self.assertNumQueries(2):
+            self.levels()  # Only today's consumption and the balances are read again
+
+        # A sale that rolls back leaves the cached consumption alone
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(InsufficientStockError):
+            with transaction.atomic():
+                self.sell(12)
+                self.sell(1000)
+        self.assertEqual(self.levels()[self.oil.pk]['consumed'], 270)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sell(12)
+        with self.assertNumQueries(2):
+            oil = self.levels()[self.oil.pk]
+        self.assertEqual((oil['consumed'], oil['balance'], oil['needs_reorder']), (378, 72, True))
+        self.assertEqual(oil['suggested'], math.ceil(378 / 30 * 37) - 72)
+
+    def test_sales_on_earlier_days_drop_the_cache(self):
+        yesterday = timezone.now() - timedelta(days=1)
+        salebill = SaleBill.objects.create()
+        SaleBill.objects.filter(pk=salebill.pk).update(created_at=yesterday)
+        salebill.refresh_from_db()
+        self.levels()
+        with self.captureOnCommitCallbacks(execute=True):
+            post_sale_bill(salebill, [ProductSale(product=self.product, quantity=10)])
+        self.assertEqual(self.levels()[self.oil.pk]['consumed'], 90)
+
+    def test_purchase_form_is_prefilled_with_suggestions(self):
+        self.sell(42)
+        self.client.force_login(User.objects.create_user('manager', password='secret'))
+        formset = self.client.get('/purchases/create/?reorder=1').context['formset']
+        self.assertEqual(
+            [(form.initial['stock'], form.initial['price']) for form in formset.forms],
+            [(self.oil.pk, Decimal('4.00'))],
+        )
+        self.assertEqual(self.client.get('/purchases/reorder/').status_code, 200)
+
+
+class BulkApiTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('buyer', password='secret'))
+        stock_type = StockType.objects.create(name='Oil')
+        self.oil = Stock.objects.create(name='CR7 Oil', stock_type=stock_type)
+
+    def test_creates_purchase_bills(self):
+        bills = [
+            {'key': 'supplier-inv-77', 'lines': [{'stock': self.oil.pk, 'quantity': 100, 'price': '5.50'}]},
+            {'lines': [{'stock': 0, 'quantity': 1, 'price': 1}]},
+            {'lines': []},
+        ]
+        response = self.client.post('/purchases/api/', {'bills': bills}, content_type='application/json')
+        *results, summary = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([result['status'] for result in results], ['created', 'invalid', 'invalid'])
+        self.assertEqual(results[1]['errors'], ['Line 1: Unknown stock 0.'])
+        self.assertEqual(summary, {'summary': {'created': 1, 'invalid': 2}})
+        self.assertEqual(PurchaseBill.objects.get(pk=results[0]['id']).stockpurchase_set.get().price, Decimal('5.50'))
+        self.oil.refresh_from_db()
+        self.assertEqual(self.oil.purchase_quantity, 100)
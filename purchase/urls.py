@@ -5,4 +5,9 @@ urlpatterns = [
     path('', views.PurchaseBillListView.as_view(), name='purchasebill-list'),
     path('create/', views.PurchaseBillCreateView.as_view(), name='purchasebill-create'),
     path('<int:pk>/edit/', views.PurchaseBillUpdateView.as_view(), name='purchasebill-edit'),
+    path('<int:pk>/delete/', views.PurchaseBillDeleteView.as_view(), name='purchasebill-delete'),
+    path('summary/', views.purchase_summary_view, name='purchase-summary'),
+    path('reorder/', views.reorder_view, name='purchase-reorder'),
+    path('export/', views.purchasebill_export_view, name='purchasebill-export'),
+    path('api/', views.purchasebill_api_view, name='purchasebill-api'),
 ]
@@ -1,17 +1,34 @@
-from django.views.generic import ListView, CreateView, DetailView, UpdateView
+from datetime import date
+from django.views.generic import ListView, CreateView, DetailView, UpdateView, DeleteView
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.shortcuts import redirect
+from django.contrib.auth.decorators import login_required
+from django.db.models import Count, F, Sum
+from django.http import JsonResponse
+from django.shortcuts import redirect, render
+from django.urls import reverse, reverse_lazy
 from .models import PurchaseBill, StockPurchase
 from .forms import PurchaseBillForm, StockPurchaseInlineFormset
+from .api import PurchaseBillWriter
+from .reorder import parameters, reorder_levels, suggested_purchase
+from .services import delete_purchase_bill, edit_purchase_bill, post_purchase_bill
+from stock.models import InsufficientStockError
+from main.api import bulk_api_view
+from main.export import export_view_response
+from main.idempotency import IdempotentCreateMixin
+from main.pagination import KeysetPaginationMixin
+from django.db import transaction
 
 
 # Create your views here.
 
-class PurchaseBillListView(LoginRequiredMixin, ListView):
+class PurchaseBillListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = PurchaseBill
     template_name = 'purchase/purchasebill_list.html'
     context_object_name = 'purchase_bills'
 
+    def get_queryset(self):
+        return PurchaseBill.objects.with_totals()
+
 
 class PurchaseBillDetailView(LoginRequiredMixin, DetailView):
     model = PurchaseBill
@@ -26,18 +43,29 @@ class PurchaseBillDetailView(LoginRequiredMixin, DetailView):
         return context
 
 
-class PurchaseBillCreateView(LoginRequiredMixin, CreateView):
+class PurchaseBillCreateView(LoginRequiredMixin, IdempotentCreateMixin, CreateView):
     model = PurchaseBill
+    idempotency_scope = 'purchasebill'
     form_class = PurchaseBillForm
     template_name = 'purchase/purchasebill_form.html'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         if 'formset' not in kwargs:
-            context['formset'] = StockPurchaseInlineFormset(queryset=StockPurchase.objects.none())
+            context['formset'] = self.get_initial_formset()
         return context
 
+    def get_initial_formset(self):
+        if not self.request.GET.get('reorder'):
+            return StockPurchaseInlineFormset(queryset=StockPurchase.objects.none())
+        # Pre-filled with a line for every stock at or below its reorder point
+        lines = suggested_purchase()
+        formset = StockPurchaseInlineFormset(queryset=StockPurchase.objects.none(), initial=lines)
+        formset.extra = max(len(lines), 1)
+        return formset
+
     def post(self, request, *args, **kwargs):
+        self.object = None
         form = self.get_form()
         formset = StockPurchaseInlineFormset(request.POST)
 
@@ -47,13 +75,14 @@ class PurchaseBillCreateView(LoginRequiredMixin, CreateView):
             return self.form_invalid(form, formset)
 
     def form_valid(self, form, formset):
-        purchase_bill = form.save()
-
-        for stock_purchase in formset.save(commit=False):
-            stock_purchase.purchasebill = purchase_bill
-            stock_purchase.save()
-
-        return redirect('purchasebill-list')
+        with transaction.atomic():
+            if not self.claim_idempotency_key():
+                # A retry of a submission that has just created the bill
+                return self.replay_idempotent()
+            purchase_bill = form.save()
+            # Add stock and write every line of the bill in one batch
+            post_purchase_bill(purchase_bill, formset.save(commit=False))
+            return self.complete_idempotency_key(reverse('purchasebill-list'), purchase_bill)
 
     def form_invalid(self, form, formset):
         return self.render_to_response(self.get_context_data(form=form, formset=formset))
@@ -83,10 +112,114 @@ class PurchaseBillUpdateView(LoginRequiredMixin, UpdateView):
             return self.form_invalid(form, formset)
 
     def form_valid(self, form, formset):
-        self.object = form.save()
-        formset.instance = self.object
-        formset.save()
+        try:
+            with transaction.atomic():
+                self.object = form.save()
+                formset.instance = self.object
+                # Apply only the net stock change of the edited, added and removed lines
+                edit_purchase_bill(self.object, formset.save(commit=False), formset.deleted_objects)
+        except InsufficientStockError as exc:
+            form.add_error(None, str(exc))
+            return self.form_invalid(form, formset)
         return redirect('purchasebill-list')
 
     def form_invalid(self, form, formset):
-        return self.render_to_response(self.get_context_data(form=form, formset=formset))
\ No newline at end of file
+        return self.render_to_response(self.get_context_data(form=form, formset=formset))
+
+
+class PurchaseBillDeleteView(LoginRequiredMixin, DeleteView):
+    model = PurchaseBill
+    http_method_names = ['post']
+    success_url = reverse_lazy('purchasebill-list')
+
+    def form_valid(self, form):
+        try:
+            # Takes back the stock of all lines in one statement
+            delete_purchase_bill(self.object)
+        except InsufficientStockError as exc:
+            form = PurchaseBillForm(instance=self.object)
+            form.add_error(None, f"This bill can't be deleted: {exc}")
+            return render(self.request, 'purchase/purchasebill_form.html', {
+                'object': self.object,
+                'purchasebill': self.object,
+                'form': form,
+                'formset': StockPurchaseInlineFormset(instance=self.object),
+            })
+        return redirect(self.success_url)
+
+
+@login_required
+def purchase_summary_view(request):
+    """
+    JSON summary of purchase bills (totals, line counts and item quantities),
+    newest first, optionally limited to a date range with ?start=&end=
+    (YYYY-MM-DD).
+    """
+    bills = PurchaseBill.objects.with_totals().order_by('-created_at', '-id')
+
+    try:
+        start = date.fromisoformat(request.GET['start']) if request.GET.get('start') else None
+        end = date.fromisoformat(request.GET['end']) if request.GET.get('end') else None
+        limit = min(int(request.GET.get('limit', 100)), 1000)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid start, end or limit parameter.'}, status=400)
+
+    if start:
+        bills = bills.filter(created_at__date__gte=start)
+    if end:
+        bills = bills.filter(created_at__date__lte=end)
+
+    totals = bills.aggregate(
+        total_amount=Sum(F('stockpurchase__quantity') * F('stockpurchase__price')),
+        item_quantity=Sum('stockpurchase__quantity'),
+        bill_count=Count('id', distinct=True),
+    )
+    results = [
+        {
+            'id': bill['id'],
+            'bill_number': bill['bill_number'],
+            'created_at': bill['created_at'],
+            'total_amount': bill['total_amount'],
+            'line_count': bill['line_count'],
+            'item_quantity': bill['item_quantity'],
+        }
+        for bill in bills.values(
+            'id', 'bill_number', 'created_at', 'total_amount', 'line_count', 'item_quantity'
+        )[:limit]
+    ]
+
+    return JsonResponse({
+        'results': results,
+        'totals': {
+            'bill_count': totals['bill_count'],
+            'total_amount': totals['total_amount'] or 0,
+            'item_quantity': totals['item_quantity'] or 0,
+        },
+    })
+
+
+@login_required
+def reorder_view(request):
+    """
+    Stocks by days of cover left at their recent sales velocity, flagging
+    those at or below their reorder point; ?all=1 includes stocks that
+    aren't selling.
+    """
+    rows = reorder_levels()
+    show_all = bool(request.GET.get('all'))
+    return render(request, 'purchase/reorder.html', {
+        'rows': rows if show_all else [row for row in rows if row['velocity'] > 0],
+        'show_all': show_all,
+        'reorder_count': sum(row['needs_reorder'] for row in rows),
+        'parameters': parameters(),
+    })
+
+
+@login_required
+def purchasebill_export_view(request):
+    """Stream every purchase line in ?start=&end= as CSV, or JSON lines with ?format=jsonl."""
+    return export_view_response(request, 'purchases')
+
+
+# Bulk JSON create for integrations; see main/api.py
+purchasebill_api_view = bulk_api_view(PurchaseBillWriter, 'bills')
@@ -0,0 +1,191 @@
+"""
+Sales reports. Each report is grouped in SQL over the bills, lines or
+daily rollups for a date range; rows are never summed in Python.
+
+Results whose range ends before today are cached: past days only change
+when an old bill is edited or deleted. The cache key includes the count and
+latest ``updated_at`` of the range's bills, read from the database on each
+run, so such a change is seen by every process whatever cache each one has.
+"""
+from datetime import date, timedelta
+
+from django.core.cache import cache
+from django.db.models import Avg, Case, Count, DateField, DecimalField, F, Max, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Round, TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from main.export import day_start
+from sale.models import DailyProductSales, ProductSale, SaleBill
+
+CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+PERIODS = {
+    'day': TruncDate,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def money(expression):
+    return Coalesce(expression, Value(0), output_field=MONEY)
+
+
+def truncate(period, field):
+    # TruncDate already returns a date; the week and month forms are asked for one too
+    if period == 'day':
+        return TruncDate(field)
+    return PERIODS[period](field, output_field=DateField())
+
+
+def bills_between(start, end):
+    return SaleBill.objects.filter(created_at__gte=day_start(start), created_at__lt=day_start(end + timedelta(days=1)))
+
+
+def lines_between(start, end):
+    return ProductSale.objects.filter(
+        salebill__created_at__gte=day_start(start), salebill__created_at__lt=day_start(end + timedelta(days=1))
+    )
+
+
+def revenue(start, end, period='day'):
+    """
+    Gross sales, discounts, net revenue, bill count and average bill value
+    per day, week or month. Grouped over the bills' stored totals, which
+    SaleBillQuerySet.refresh_totals() keeps equal to Sum(quantity * price)
+    of their lines, so the line table isn't scanned.
+    """
+    rows = (
+        bills_between(start, end)
+        .annotate(period=truncate(period, 'created_at'))
+        .values('period')
+        .annotate(
+            bills=Count('id'),
+            gross=money(Sum('gross_amount')),
+            discount=money(Sum('discount')),
+            net=money(Sum('net_amount')),
+            average_bill=money(Round(Avg('net_amount'), 2)),
+        )
+        .order_by('period')
+    )
+    return list(rows)
+
+
+def top_products(start, end, limit=10):
+    """Best-selling products by revenue, read from the DailyProductSales rollup."""
+    rows = (
+        DailyProductSales.objects
+        .filter(date__range=(start, end))
+        .values('product_id', name=F('product__name'))
+        .annotate(units=Sum('quantity'), revenue=money(Sum('amount')), lines=Sum('line_count'))
+        .order_by('-revenue', 'product_id')[:limit]
+    )
+    return list(rows)
+
+
+def top_customers(start, end, limit=10):
+    """Customers by net spend, with their bill count and average bill value."""
+    rows = (
+        bills_between(start, end)
+        .filter(customer__isnull=False)
+        .values('customer_id', name=F('customer__name'))
+        .annotate(bills=Count('id'), net=money(Sum('net_amount')), average_bill=money(Round(Avg('net_amount'), 2)))
+        .order_by('-net', 'customer_id')[:limit]
+    )
+    return list(rows)
+
+
+def discount_leakage(start, end, period='day'):
+    """
+    Revenue given away per period: markdowns (lines sold below the
+    product's current list price) and bill discounts, as a share of what
+    the lines were worth at list price.
+    """
+    list_value = F('quantity') * F('product__price')
+    markdown = Case(
+        When(price__lt=F('product__price'), then=list_value - F('quantity') * F('price')),
+        default=Value(0),
+        output_field=MONEY,
+    )
+    rows = (
+        lines_between(start, end)
+        .annotate(period=truncate(period, 'salebill__created_at'))
+        .values('period')
+        .annotate(
+            list_value=money(Sum(list_value)),
+            gross=money(Sum(F('quantity') * F('price'))),
+            markdown=money(Sum(markdown)),
+            discounted_bills=Count('salebill', distinct=True, filter=Q(salebill__discount__gt=0)),
+        )
+        .order_by('period')
+    )
+    rows = list(rows)
+
+    # Bill discounts live on the bill, so they're grouped over the bills to avoid repeating them per line
+    discounts = {
+        row['period']: row['discount']
+        for row in bills_between(start, end)
+        .annotate(period=truncate(period, 'created_at'))
+        .values('period')
+        .annotate(discount=money(Sum('discount')))
+        .order_by()
+    }
+    for row in rows:
+        row['discount'] = discounts.get(row['period'], 0)
+        row['leakage'] = row['markdown'] + row['discount']
+        row['leakage_pct'] = round(100 * row['leakage'] / row['list_value'], 2) if row['list_value'] else 0
+    return rows
+
+
+def summary(start, end):
+    """Totals for the whole range, including the average bill value."""
+    return bills_between(start, end).aggregate(
+        bills=Count('id'),
+        gross=money(Sum('gross_amount')),
+        discount=money(Sum('discount')),
+        net=money(Sum('net_amount')),
+        average_bill=money(Round(Avg('net_amount'), 2)),
+    )
+
+
+REPORTS = {
+    'revenue': revenue,
+    'top-products': top_products,
+    'top-customers': top_customers,
+    'discounts': discount_leakage,
+    'summary': summary,
+}
+
+
+def run_report(name, start, end, **params):
+    """Run a report, serving closed ranges (ending before today) from the cache."""
+    report = REPORTS[name]
+    if end >= timezone.localdate():
+        return report(start, end, **params)
+
+    # Editing a line moves its bill's updated_at too (refresh_totals) and deleting a bill drops the count
+    watermark = bills_between(start, end).aggregate(bills=Count('id'), changed=Max('updated_at'))
+    changed = watermark['changed'].isoformat() if watermark['changed'] else ''
+    key = ':'.join(['reports', name, str(watermark['bills']), changed, start.isoformat(), end.isoformat(),
+                    *[f'{k}={v}' for k, v in sorted(params.items())]])
+    result = cache.get(key)
+    if result is None:
+        result = report(start, end, **params)
+        cache.set(key, result, CACHE_TIMEOUT)
+    return result
+
+
+def default_range(today=None):
+    end = today or timezone.localdate()
+    return end - timedelta(days=29), end
+
+
+def parse_range(params):
+    """(start, end) from ?start=&end= (YYYY-MM-DD), defaulting to the last 30 days. Raises ValueError."""
+    default_start, default_end = default_range()
+    start = date.fromisoformat(params['start']) if params.get('start') else default_start
+    end = date.fromisoformat(params['end']) if params.get('end') else default_end
+    if start > end:
+        raise ValueError("start is after end")
+    return start, end
@@ -0,0 +1,53 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils import timezone
+
+from product.models import Product, StockVariant
+from sale.models import ProductSale, SaleBill
+from sale.services import post_sale_bill
+from stock.models import Stock, StockType
+from .queries import run_report
+
+# Create your tests here.
+
+
+class ReportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        stock_type = StockType.objects.create(name='Oil')
+        oil = Stock.objects.create(name='CR7 Oil', stock_type=stock_type, opening_quantity=100)
+        self.product = Product.objects.create(name='CR7 9ml', price=200)
+        StockVariant.objects.create(product=self.product, stock=oil, quantity=9)
+        self.yesterday = timezone.localdate() - timedelta(days=1)
+
+    def sell(self, price, discount=0):
+        salebill = SaleBill.objects.create(discount=discount)
+        post_sale_bill(salebill, [ProductSale(product=self.product, quantity=2, price=price)])
+        SaleBill.objects.filter(pk=salebill.pk).update(created_at=timezone.now() - timedelta(days=1))
+        return salebill
+
+    def test_revenue_and_discount_leakage(self):
+        self.sell(200, discount=10)
+        self.sell(150)
+        (day,) = run_report('revenue', self.yesterday, self.yesterday, period='day')
+        self.assertEqual((day['bills'], day['gross'], day['net'], day['average_bill']), (2, 700, 690, 345))
+
+        (leak,) = run_report('discounts', self.yesterday, self.yesterday, period='day')
+        self.assertEqual((leak['list_value'], leak['markdown'], leak['discount'], leak['leakage']), (800, 100, 10, 110))
+
+    def test_closed_periods_are_cached_until_a_bill_changes(self):
+        salebill = self.sell(200)
+        self.assertEqual(run_report('summary', self.yesterday, self.yesterday)['net'], 400)
+        with self.assertNumQueries(1):
+            run_report('summary', self.yesterday, self.yesterday)
+
+        salebill.refresh_from_db()
+        salebill.discount = 50
+        salebill.save()
+        self.assertEqual(run_report('summary', self.yesterday, self.yesterday)['net'], 350)
+
+        # An edit made by another process, which sends no signal here, is seen as well
+        SaleBill.objects.filter(pk=salebill.pk).update(discount=100, net_amount=300, updated_at=timezone.now())
+        self.assertEqual(run_report('summary', self.yesterday, self.yesterday)['net'], 300)
@@ -0,0 +1,7 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('', views.report_dashboard_view, name='reports-dashboard'),
+    path('<slug:name>/', views.report_json_view, name='report-json'),
+]
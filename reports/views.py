@@ -0,0 +1,64 @@
+from django.contrib.auth.decorators import login_required
+from django.http import Http404, JsonResponse
+from django.shortcuts import render
+
+from .queries import PERIODS, REPORTS, parse_range, run_report
+
+# Create your views here.
+
+
+def report_params(request, name):
+    """Keyword arguments for report ``name`` from the query string. Raises ValueError."""
+    params = {}
+    if name in ('revenue', 'discounts'):
+        params['period'] = request.GET.get('period', 'day')
+        if params['period'] not in PERIODS:
+            raise ValueError("Invalid period.")
+    if name in ('top-products', 'top-customers'):
+        params['limit'] = min(max(int(request.GET.get('limit', 10)), 1), 100)
+    return params
+
+
+@login_required
+def report_json_view(request, name):
+    """
+    One report as JSON for ?start=&end= (YYYY-MM-DD, default the last 30
+    days), plus ?period=day|week|month or ?limit= where they apply.
+    """
+    if name not in REPORTS:
+        raise Http404("Unknown report.")
+    try:
+        start, end = parse_range(request.GET)
+        params = report_params(request, name)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid start, end, period or limit parameter.'}, status=400)
+    return JsonResponse({
+        'start': start,
+        'end': end,
+        **params,
+        'results': run_report(name, start, end, **params),
+    })
+
+
+@login_required
+def report_dashboard_view(request):
+    try:
+        start, end = parse_range(request.GET)
+        period = request.GET.get('period', 'day')
+        if period not in PERIODS:
+            raise ValueError
+    except ValueError:
+        start, end = parse_range({})
+        period = 'day'
+
+    return render(request, 'reports/dashboard.html', {
+        'start': start,
+        'end': end,
+        'period': period,
+        'periods': list(PERIODS),
+        'summary': run_report('summary', start, end),
+        'revenue': run_report('revenue', start, end, period=period),
+        'top_products': run_report('top-products', start, end, limit=10),
+        'top_customers': run_report('top-customers', start, end, limit=10),
+        'discounts': run_report('discounts', start, end, period=period),
+    })
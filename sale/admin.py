@@ -1,7 +1,9 @@
 from django.contrib import admin
-from .models import SaleBill, ProductSale
+from .models import DailyProductSales, DailyStockConsumption, SaleBill, ProductSale
 
 # Register your models here.
 
 admin.site.register(SaleBill)
 admin.site.register(ProductSale)
+admin.site.register(DailyProductSales)
+admin.site.register(DailyStockConsumption)
@@ -0,0 +1,65 @@
+from customer.models import Customer
+from main.api import CREATED, BulkWriter, ItemConflict, ids, item_list, scalar_fields
+from main.importer import CSVImporter, RowError
+from product.models import Product
+from .basket import check_basket
+from .models import ProductSale, SaleBill
+from .services import post_sale_bill
+
+
+class SaleBillWriter(BulkWriter):
+    """
+    Items: ``{"key", "customer", "discount", "lines": [{"product", "quantity", "price"}]}``
+    with customer and product ids; customer and discount are optional and a
+    line's price defaults to the product's. A bill is checked against the stock as a whole, like the
+    sale form, and reported as a conflict if it no longer fits.
+    """
+    scope = 'salebill'  # Shared with SaleBillCreateView
+    success_url_name = 'salebill-list'
+
+    def load_maps(self, items):
+        # Every product and customer of the chunk, with one query each
+        lines = [line for item in items if isinstance(item.get('lines'), list) for line in item['lines']]
+        self.products = Product.objects.in_bulk(ids(line.get('product') for line in lines if isinstance(line, dict)))
+        self.customer_ids = set(
+            Customer.objects.filter(pk__in=ids(item.get('customer') for item in items)).values_list('pk', flat=True)
+        )
+
+    def parse(self, item):
+        fields = scalar_fields(item)
+        customer_id = CSVImporter.integer(fields, 'customer', default=0) or None
+        if customer_id is not None and customer_id not in self.customer_ids:
+            raise RowError(f"Unknown customer {customer_id}.")
+        discount = CSVImporter.decimal(fields, 'discount') if fields.get('discount') else 0
+
+        lines = []
+        for number, line in enumerate(item_list(item, 'lines'), start=1):
+            try:
+                line = scalar_fields(line)
+                product_id = CSVImporter.integer(line, 'product')
+                if product_id not in self.products:
+                    raise RowError(f"Unknown product {product_id}.")
+                quantity = CSVImporter.integer(line, 'quantity', minimum=1)
+                product = self.products[product_id]
+                price = CSVImporter.decimal(line, 'price') if line.get('price') else product.price
+            except RowError as exc:
+                raise RowError(f"Line {number}: {exc}")
+            lines.append(ProductSale(product=product, quantity=quantity, price=price))
+        return SaleBill(customer_id=customer_id, discount=discount), lines
+
+    def write(self, parsed):
+        salebill, lines = parsed
+        errors = check_basket([(line.product, line.quantity) for line in lines])
+        if any(errors):
+            raise ItemConflict([f"Line {number}: {error}" for number, error in enumerate(errors, start=1) if error])
+        salebill.save()
+        post_sale_bill(salebill, lines)
+        return salebill, CREATED
+
+    def describe(self, results):
+        bill_numbers = dict(
+            SaleBill.objects.filter(pk__in=[result['id'] for result in results if result['id']])
+            .values_list('pk', 'bill_number')
+        )
+        for result in results:
+            result['bill_number'] = bill_numbers.get(result['id'])
@@ -0,0 +1,58 @@
+"""
+Joint stock check for all the lines of a sale bill.
+
+Checking each line on its own lets two lines that share a stock (two
+perfumes filled into the same bottle) each pass while together they
+oversell it. Here the lines are expanded through the compiled recipes
+into the total each stock must supply, every stock is checked against its
+balance with one query, and each line that draws on a stock that falls
+short gets an error naming it.
+
+This is validation for the form; the conditional stock UPDATE in
+edit_sale_bill() remains the check that holds under concurrent sales.
+"""
+from collections import defaultdict
+
+from product.availability import bom
+from stock.models import BALANCE, Stock
+
+
+def stock_totals(recipes, lines):
+    """{stock_id: quantity} that ``lines`` of (product_id, quantity) draw on."""
+    totals = defaultdict(int)
+    for product_id, quantity in lines:
+        for stock_id, per_unit in recipes.get(product_id, ()):
+            totals[stock_id] += per_unit * quantity
+    return totals
+
+
+def check_basket(lines, held=()):
+    """
+    Check ``lines``, (product, quantity) pairs making up a bill, against the
+    stock balances together. ``held`` are the (product_id, quantity) pairs
+    the bill sold before an edit, whose stock is already deducted and so is
+    available to it again. Returns one error message or None per line; a
+    product without a recipe draws on no stock, so none of it can be sold.
+    """
+    recipes = bom.compiled()
+    needed = stock_totals(recipes, [(product.pk, quantity) for product, quantity in lines])
+    already = stock_totals(recipes, held)
+    more = [stock_id for stock_id, quantity in needed.items() if quantity > already.get(stock_id, 0)]
+
+    short = {}
+    for stock_id, name, balance in Stock.objects.filter(pk__in=more).annotate(balance=BALANCE).values_list('pk', 'name', 'balance'):
+        available = balance + already.get(stock_id, 0)
+        if needed[stock_id] > available:
+            short[stock_id] = (name, available)
+
+    errors = []
+    for product, quantity in lines:
+        if quantity > 0 and not recipes.get(product.pk):
+            errors.append(f"Not enough stock for {product.name}: it has no recipe.")
+            continue
+        bottlenecks = [
+            f"{short[stock_id][0]} (the bill needs {needed[stock_id]}, {max(short[stock_id][1], 0)} available)"
+            for stock_id, per_unit in recipes.get(product.pk, ()) if stock_id in short
+        ]
+        errors.append(f"Not enough stock for {product.name}: {', '.join(bottlenecks)}." if bottlenecks and quantity > 0 else None)
+    return errors
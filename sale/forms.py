@@ -1,7 +1,9 @@
 from django import forms
 from django.forms import inlineformset_factory
+from .basket import check_basket
 from .models import SaleBill, ProductSale
 from product.models import Product
+from main.fields import LazyChoiceInlineFormSet, LazyChoiceModelForm, LazyModelChoiceField
 
 
 class SaleBillForm(forms.ModelForm):
@@ -21,9 +23,38 @@ class SaleBillForm(forms.ModelForm):
         fields = ['customer', 'discount']
 
 
+class ProductSaleForm(LazyChoiceModelForm):
+    # Only the selected product is rendered; Select2 searches the rest
+    product = LazyModelChoiceField(queryset=Product.objects.all())
+
+
+class SaleBillFormSet(LazyChoiceInlineFormSet):
+    def clean(self):
+        """Check the stock of all the lines together, so lines sharing a stock can't oversell it."""
+        super().clean()
+        if any(self.errors):
+            return
+        forms, lines, held = [], [], []
+        for form in self.forms:
+            if form.instance.pk is not None:
+                # The stock of a saved line is already deducted
+                held.append((form.initial['product'], form.initial['quantity']))
+            if self.can_delete and self._should_delete_form(form):
+                continue
+            product, quantity = form.cleaned_data.get('product'), form.cleaned_data.get('quantity')
+            if product is not None and quantity:
+                forms.append(form)
+                lines.append((product, quantity))
+        for form, error in zip(forms, check_basket(lines, held)):
+            if error:
+                form.add_error(None, error)
+
+
 SaleBillInlineFormset = inlineformset_factory(
     SaleBill, 
     ProductSale, 
+    form=ProductSaleForm,
+    formset=SaleBillFormSet,
     fields=['product', 'quantity', 'price'], 
     extra=0,
     can_delete=True, # Ensure deletion is enabled for the UpdateView
@@ -0,0 +1,149 @@
+from datetime import date, datetime, time, timedelta
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import Count, DecimalField, F, Max, Min, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from product.models import StockVariant
+from stock.models import StockMovement
+from sale.models import DailyProductSales, DailyStockConsumption, ProductSale, SaleBill
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the DailyProductSales and DailyStockConsumption rollups for a date range "
+        "(default: every day with sales) from the ProductSale lines and the stock ledger, "
+        "one day range per transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help="First day to rebuild (YYYY-MM-DD).")
+        parser.add_argument('--end', type=date.fromisoformat, help="Last day to rebuild (YYYY-MM-DD).")
+        parser.add_argument('--days-per-batch', type=int, default=31)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        start, end = options['start'], options['end']
+        if start is None or end is None:
+            first, last = sale_days()
+            start, end = start or first, end or last
+        if start is None or end is None:
+            self.stdout.write("No sales to roll up.")
+            return
+        if start > end:
+            raise CommandError("--start must not be after --end.")
+
+        products = stocks = 0
+        day = start
+        while day <= end:
+            last_day = min(day + timedelta(days=options['days_per_batch'] - 1), end)
+            with transaction.atomic():
+                created = rebuild(day, last_day, options['batch_size'])
+            products += created[0]
+            stocks += created[1]
+            day = last_day + timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {products} product row(s) and {stocks} stock row(s) from {start} to {end}."
+        ))
+
+
+# Module-level so that jobs can run them without the command. Migration 0006 has
+# its own copy, so that changes here don't change what it did.
+
+def sale_days():
+    bounds = ProductSale.objects.aggregate(first=Min('salebill__created_at'), last=Max('salebill__created_at'))
+    if bounds['first'] is None:
+        return None, None
+    return timezone.localdate(bounds['first']), timezone.localdate(bounds['last'])
+
+
+def ledger_started():
+    """When the stock ledger began, or None if it isn't installed: sales before it weren't recorded."""
+    return (
+        MigrationRecorder(connection).migration_qs
+        .filter(app='stock', name='0002_stock_ledger')
+        .values_list('applied', flat=True)
+        .first()
+    )
+
+
+def bulk_create_in_batches(model, objs, batch_size):
+    """bulk_create() lists all of ``objs`` first, so feed it a generator one batch at a time."""
+    created = 0
+    while batch := list(islice(objs, batch_size)):
+        created += len(model.objects.bulk_create(batch))
+    return created
+
+
+def rebuild(start, end, batch_size):
+    after = timezone.make_aware(datetime.combine(start, time.min))
+    before = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min))
+    DailyProductSales.objects.filter(date__range=(start, end)).delete()
+    DailyStockConsumption.objects.filter(date__range=(start, end)).delete()
+
+    # Grouped in SQL by the bill's local date, the same day record_daily_sales() uses
+    product_rows = (
+        ProductSale.objects
+        .filter(salebill__created_at__gte=after, salebill__created_at__lt=before)
+        .values('product', day=TruncDate('salebill__created_at'))
+        .annotate(
+            total_quantity=Sum('quantity'),
+            total_amount=Coalesce(
+                Sum(F('quantity') * F('price')), Value(0),
+                output_field=DecimalField(max_digits=14, decimal_places=2),
+            ),
+            lines=Count('id'),
+        )
+        .order_by()
+    )
+    products = bulk_create_in_batches(DailyProductSales, (
+        DailyProductSales(
+            date=row['day'], product_id=row['product'], quantity=row['total_quantity'],
+            amount=row['total_amount'], line_count=row['lines'],
+        )
+        for row in product_rows.iterator(chunk_size=batch_size)
+    ), batch_size)
+
+    # Stock use comes from the ledger, which holds what each sale took through the
+    # recipe in force when it was posted or edited. A bill posted before the ledger
+    # began has movements for its later edits at most, and its lines from before are
+    # not recorded anywhere, so its current lines are expanded through today's
+    # recipes instead; that is exact as long as the recipes haven't changed since.
+    bills = SaleBill.objects.filter(created_at__gte=after, created_at__lt=before)
+    started = ledger_started()
+    ledger_bills = bills if started is None else bills.filter(created_at__gte=started)
+    older_bills = bills.none() if started is None else bills.filter(created_at__lt=started)
+    ledger_rows = (
+        StockMovement.objects
+        .filter(
+            source_type__app_label='sale', source_type__model='salebill', kind__in=['sale', 'sale_return'],
+            source_id__in=ledger_bills.values('pk'),
+        )
+        .annotate(sold_at=Subquery(SaleBill.objects.filter(pk=OuterRef('source_id')).values('created_at')))
+        .values('stock', day=TruncDate('sold_at'))
+        .annotate(total_quantity=-Sum('quantity'))
+        .exclude(total_quantity=0)
+        .order_by()
+    )
+    recipe_rows = (
+        StockVariant.objects
+        .filter(product__productsale__salebill__in=older_bills)
+        .values('stock', day=TruncDate('product__productsale__salebill__created_at'))
+        .annotate(total_quantity=Sum(F('quantity') * F('product__productsale__quantity')))
+        .order_by()
+    )
+    totals = {}
+    for rows in (ledger_rows, recipe_rows):
+        for row in rows.iterator(chunk_size=batch_size):
+            key = (row['day'], row['stock'])
+            totals[key] = totals.get(key, 0) + row['total_quantity']
+    stocks = bulk_create_in_batches(DailyStockConsumption, (
+        DailyStockConsumption(date=day, stock_id=stock_id, quantity=quantity)
+        for (day, stock_id), quantity in totals.items()
+    ), batch_size)
+    return products, stocks
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from sale.models import SaleBill
+
+
+class Command(BaseCommand):
+    help = "Recompute the stored gross/net totals and line counts of sale bills from their lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('bill_ids', nargs='*', type=int, help="Only repair these bills (default: all).")
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        bills = SaleBill.objects.order_by('pk')
+        if options['bill_ids']:
+            bills = bills.filter(pk__in=options['bill_ids'])
+
+        updated = 0
+        last_pk = 0
+        batch_size = options['batch_size']
+        # Work in primary-key ranges so a large table isn't locked by one statement
+        while True:
+            batch = list(bills.filter(pk__gt=last_pk).values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                updated += SaleBill.objects.filter(pk__in=batch).refresh_totals()
+            last_pk = batch[-1]
+
+        self.stdout.write(self.style.SUCCESS(f"Refreshed totals for {updated} bill(s)."))
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.8 on 2026-10-18 08:01
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor):
+    SaleBill = apps.get_model('sale', 'SaleBill')
+    ProductSale = apps.get_model('sale', 'ProductSale')
+    lines = ProductSale.objects.filter(salebill=OuterRef('pk')).order_by().values('salebill')
+    gross = lines.annotate(total=Sum(F('quantity') * F('price'))).values('total')
+    line_count = lines.annotate(total=Count('pk')).values('total')
+    gross_amount = Coalesce(Subquery(gross), Value(0), output_field=DecimalField(max_digits=12, decimal_places=2))
+    SaleBill.objects.update(
+        gross_amount=gross_amount,
+        net_amount=gross_amount - F('discount'),
+        line_count=Coalesce(Subquery(line_count), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sale', '0002_salebill_bill_number_alter_productsale_price_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salebill',
+            name='gross_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='salebill',
+            name='line_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='salebill',
+            name='net_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 08:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('customer', '0002_customer_timestamps'),
+        ('sale', '0003_salebill_totals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='salebill',
+            index=models.Index(fields=['created_at', 'id'], name='sale_salebi_created_f55d99_idx'),
+        ),
+    ]
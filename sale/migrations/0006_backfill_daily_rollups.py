@@ -0,0 +1,111 @@
+from datetime import datetime, time, timedelta
+
+from django.db import migrations
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import Count, DecimalField, F, Max, Min, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+BATCH_SIZE = 5000
+
+
+def backfill_daily_rollups(apps, schema_editor):
+    """
+    Fill the rollups from the sales already on record. This is a frozen copy of
+    what rebuild_daily_sales did when the rollups were added, so that later
+    changes to the command don't change what this migration does.
+    """
+    ProductSale = apps.get_model('sale', 'ProductSale')
+    SaleBill = apps.get_model('sale', 'SaleBill')
+    DailyProductSales = apps.get_model('sale', 'DailyProductSales')
+    DailyStockConsumption = apps.get_model('sale', 'DailyStockConsumption')
+    StockMovement = apps.get_model('stock', 'StockMovement')
+    StockVariant = apps.get_model('product', 'StockVariant')
+
+    bounds = ProductSale.objects.aggregate(first=Min('salebill__created_at'), last=Max('salebill__created_at'))
+    if bounds['first'] is None:
+        return
+    after = timezone.make_aware(datetime.combine(timezone.localdate(bounds['first']), time.min))
+    before = timezone.make_aware(datetime.combine(timezone.localdate(bounds['last']) + timedelta(days=1), time.min))
+
+    product_rows = (
+        ProductSale.objects
+        .filter(salebill__created_at__gte=after, salebill__created_at__lt=before)
+        .values('product', day=TruncDate('salebill__created_at'))
+        .annotate(
+            total_quantity=Sum('quantity'),
+            total_amount=Coalesce(
+                Sum(F('quantity') * F('price')), Value(0),
+                output_field=DecimalField(max_digits=14, decimal_places=2),
+            ),
+            lines=Count('id'),
+        )
+        .order_by()
+    )
+    DailyProductSales.objects.bulk_create(
+        [
+            DailyProductSales(
+                date=row['day'], product_id=row['product'], quantity=row['total_quantity'],
+                amount=row['total_amount'], line_count=row['lines'],
+            )
+            for row in product_rows.iterator(chunk_size=BATCH_SIZE)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+    # Bills from after the ledger began are read from it; older ones, whose lines
+    # from before it were never recorded, are expanded through the current recipes
+    started = (
+        MigrationRecorder(schema_editor.connection).migration_qs
+        .filter(app='stock', name='0002_stock_ledger')
+        .values_list('applied', flat=True)
+        .first()
+    )
+    bills = SaleBill.objects.filter(created_at__gte=after, created_at__lt=before)
+    ledger_bills = bills if started is None else bills.filter(created_at__gte=started)
+    older_bills = bills.none() if started is None else bills.filter(created_at__lt=started)
+    ledger_rows = (
+        StockMovement.objects
+        .filter(
+            source_type__app_label='sale', source_type__model='salebill', kind__in=['sale', 'sale_return'],
+            source_id__in=ledger_bills.values('pk'),
+        )
+        .annotate(sold_at=Subquery(SaleBill.objects.filter(pk=OuterRef('source_id')).values('created_at')))
+        .values('stock', day=TruncDate('sold_at'))
+        .annotate(total_quantity=-Sum('quantity'))
+        .exclude(total_quantity=0)
+        .order_by()
+    )
+    recipe_rows = (
+        StockVariant.objects
+        .filter(product__productsale__salebill__in=older_bills)
+        .values('stock', day=TruncDate('product__productsale__salebill__created_at'))
+        .annotate(total_quantity=Sum(F('quantity') * F('product__productsale__quantity')))
+        .order_by()
+    )
+    totals = {}
+    for rows in (ledger_rows, recipe_rows):
+        for row in rows.iterator(chunk_size=BATCH_SIZE):
+            key = (row['day'], row['stock'])
+            totals[key] = totals.get(key, 0) + row['total_quantity']
+    DailyStockConsumption.objects.bulk_create(
+        [
+            DailyStockConsumption(date=day, stock_id=stock_id, quantity=quantity)
+            for (day, stock_id), quantity in totals.items()
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('product', '0006_name_search_indexes'),
+        ('sale', '0005_daily_rollups'),
+        ('stock', '0005_purchase_return_movement'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_daily_rollups, migrations.RunPython.noop),
+    ]
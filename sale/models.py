@@ -1,27 +1,76 @@
-from django.db import models
-from product.models import Product
-from django.core.exceptions import ValidationError
+from collections import defaultdict
+
+from django.db import DEFAULT_DB_ALIAS, connection, models, transaction
+from django.db.models import Count, DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Now
+from product.models import Product, StockVariant
+from stock.models import Stock
 from django.db.models.signals import post_delete
-from django.dispatch import receiver
+from django.dispatch import Signal, receiver
 from customer.models import Customer
+from main.models import assign_bill_numbers
+from django.conf import settings
+from django.utils import timezone
 
 # Create your models here.
 
+# Columns written only by SaleBillQuerySet.refresh_totals()
+TOTAL_COLUMNS = ('gross_amount', 'net_amount', 'line_count')
+
+
+class SaleBillQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # One block allocation numbers every bill in the batch
+        objs = assign_bill_numbers(list(objs), **SaleBill.bill_number_series())
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def refresh_totals(self):
+        """
+        Recompute the stored totals of every bill in the queryset from its
+        lines with a single UPDATE. ``updated_at`` moves too, since a change to
+        the lines is a change to the bill (cached invoices are keyed on it).
+        """
+        lines = ProductSale.objects.filter(salebill=OuterRef('pk')).order_by().values('salebill')
+        gross = lines.annotate(total=Sum(F('quantity') * F('price'))).values('total')
+        line_count = lines.annotate(total=Count('pk')).values('total')
+        gross_amount = Coalesce(Subquery(gross), Value(0), output_field=DecimalField(max_digits=12, decimal_places=2))
+        return self.update(
+            gross_amount=gross_amount,
+            net_amount=gross_amount - F('discount'),
+            line_count=Coalesce(Subquery(line_count), Value(0)),
+            updated_at=Now(),
+        )
+
+
 class SaleBill(models.Model):
     bill_number = models.CharField(max_length=20, unique=True, editable=False)
     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True)
     discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    # Totals denormalised from the ProductSale lines, kept current by refresh_totals()
+    gross_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    net_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    line_count = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    objects = SaleBillQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+        ]
     
     @property
     def amount(self):
-        total = sum(item.amount() for item in self.productsale_set.all())
-        return total
+        return self.gross_amount
     
     @property
     def final_amount(self):
-        return self.amount - self.discount
+        return self.net_amount
+
+    def refresh_totals(self):
+        SaleBill.objects.filter(pk=self.pk).refresh_totals()
+        self.refresh_from_db(fields=['gross_amount', 'net_amount', 'line_count', 'updated_at'])
 
     def __str__(self):
         return f"Bill for {self.customer.name if self.customer else 'Walk-in Customer'} - {self.final_amount}"
@@ -31,15 +80,35 @@ class SaleBill(models.Model):
             walk_in_customer, created = Customer.objects.get_or_create(name="Walk-in Customer")
             self.customer = walk_in_customer
 
-        # Save the instance first to get a unique ID
-        is_new = self.pk is None
-        super(SaleBill, self).save(*args, **kwargs)
+        adding = self._state.adding
+        if adding:
+            self.net_amount = self.gross_amount - self.discount
+        elif kwargs.get('update_fields') is None:
+            # The totals only move through refresh_totals(); writing back the values
+            # this instance loaded would undo line edits made since, e.g. while the
+            # edit form was open
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in TOTAL_COLUMNS
+            ]
 
-        if is_new:
-            # Now that we have an ID, generate the unique bill number
-            self.bill_number = f'EMZA-{self.id:04d}'
-            # Save again to update the bill_number field
-            super(SaleBill, self).save(update_fields=['bill_number'])
+        # Number the bill before inserting it, so it is created in one write
+        if not self.bill_number:
+            assign_bill_numbers([self], **SaleBill.bill_number_series())
+        if adding or 'discount' not in kwargs['update_fields']:
+            super(SaleBill, self).save(*args, **kwargs)
+            return
+        with transaction.atomic():
+            super(SaleBill, self).save(*args, **kwargs)
+            # The discount can change without touching any line
+            self.refresh_totals()
+
+    @staticmethod
+    def bill_number_series():
+        return {
+            'prefix': getattr(settings, 'SALE_BILL_PREFIX', 'EMZA'),
+            'per_financial_year': getattr(settings, 'BILL_NUMBERS_PER_FINANCIAL_YEAR', False),
+        }
 
 
 
@@ -55,20 +124,21 @@ class ProductSale(models.Model):
         return f"Sale of {self.product.name} - {self.quantity}"
     
     def amount(self):
-        return self.quantity * self.price
+        return self.quantity * (self.price or 0)
     
-    def clean(self):
-        super().clean()
-        if self.product and self.quantity:
-            if self.product.available_quantity < self.quantity:
-                raise ValidationError(f"Not enough stock for {self.product.name}. Only {self.product.available_quantity} available.")
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        from .services import edit_sale_bill
 
-    def save(self, *args, **kwargs):
+        # edit_sale_bill() inserts or updates the whole line, with the bill and the stock,
+        # on the default database; the arguments Django's own callers pass only matter
+        # when they ask for something else
+        if using not in (None, DEFAULT_DB_ALIAS):
+            raise ValueError("Sale lines are only written to the default database.")
+        if update_fields is not None and not update_fields:
+            return
         self.full_clean()  # Always run validation before saving
-        if self.price is None and self.product:
-            self.price = self.product.price
-        self.product.sale(self.quantity)
-        super().save(*args, **kwargs)
+        # Stock, bill totals and rollups move by the difference from the saved line
+        edit_sale_bill(self.salebill, [self])
 
 
 @receiver(post_delete, sender=ProductSale)
@@ -77,4 +147,98 @@ def restock_on_product_sale_delete(sender, instance, **kwargs):
     When a ProductSale is deleted, restock the product by the quantity
     that was in the sale.
     """
-    instance.product.sale_return(instance.quantity)
+    instance.product.sale_return(instance.quantity, source=instance.salebill)
+    SaleBill.objects.filter(pk=instance.salebill_id).refresh_totals()
+    record_daily_sales(instance.salebill, [(instance.product_id, -instance.quantity, -instance.amount())])
+
+
+def upsert_add(model, key_fields, rows):
+    """
+    Insert ``rows`` (tuples of key values followed by value columns) into a
+    rollup table, adding the values to any existing row with the same key
+    in the same statement.
+    """
+    if not rows:
+        return
+    table = connection.ops.quote_name(model._meta.db_table)
+    value_fields = list(model.ROLLUP_FIELDS)
+    columns = [model._meta.get_field(name).column for name in key_fields + value_fields]
+    placeholders = ', '.join(['(' + ', '.join(['%s'] * len(columns)) + ')'] * len(rows))
+    updates = ', '.join(
+        f"{connection.ops.quote_name(column)} = {table}.{connection.ops.quote_name(column)} + EXCLUDED.{connection.ops.quote_name(column)}"
+        for column in columns[len(key_fields):]
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} ({', '.join(map(connection.ops.quote_name, columns))}) VALUES {placeholders} "
+            f"ON CONFLICT ({', '.join(map(connection.ops.quote_name, columns[:len(key_fields)]))}) DO UPDATE SET {updates}",
+            [value for row in rows for value in row],
+        )
+
+
+def record_daily_sales(salebill, lines, stock_quantities=None):
+    """
+    Add sale lines, given as ``[(product_id, quantity, amount)]`` with
+    negative values for removed quantities, to the daily rollups of the
+    bill's date. Runs two upserts whatever the number of lines; pass
+    ``stock_quantities`` when the caller has already expanded the lines
+    through StockVariant.
+    """
+    day = timezone.localdate(salebill.created_at)
+    products = defaultdict(lambda: [0, 0, 0])
+    for product_id, quantity, amount in lines:
+        totals = products[product_id]
+        totals[0] += quantity
+        totals[1] += amount
+        totals[2] += 1 if quantity > 0 else -1 if quantity < 0 else 0
+    stocks = stock_quantities
+    if stocks is None:
+        stocks = StockVariant.objects.stock_quantities({pk: totals[0] for pk, totals in products.items()})
+
+    upsert_add(DailyProductSales, ['date', 'product'], [
+        (day, pk, *totals) for pk, totals in products.items() if any(totals)
+    ])
+    upsert_add(DailyStockConsumption, ['date', 'stock'], [
+        (day, pk, quantity) for pk, quantity in stocks.items() if quantity
+    ])
+    daily_sales_recorded.send(sender=DailyStockConsumption, day=day, stock_quantities=stocks)
+
+
+# Sent by record_daily_sales() with the day and {stock_id: quantity} it added
+daily_sales_recorded = Signal()
+
+
+class DailyProductSales(models.Model):
+    """Units, revenue and line count per product per day, before bill discounts."""
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    quantity = models.IntegerField(default=0)
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    line_count = models.IntegerField(default=0)
+
+    ROLLUP_FIELDS = ['quantity', 'amount', 'line_count']
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product'], name='unique_daily_product_sales'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.product}: {self.quantity}"
+
+
+class DailyStockConsumption(models.Model):
+    """Stock units used by sales per day, through the products' stock variants."""
+    date = models.DateField()
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='daily_consumption')
+    quantity = models.IntegerField(default=0)
+
+    ROLLUP_FIELDS = ['quantity']
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'stock'], name='unique_daily_stock_consumption'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.stock}: {self.quantity}"
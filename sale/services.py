@@ -0,0 +1,90 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from main.models import delete_rows
+from product.models import StockVariant
+from stock.models import InsufficientStockError, Stock
+from .models import ProductSale, record_daily_sales
+
+
+def edit_sale_bill(salebill, changed_lines, deleted_lines=()):
+    """
+    Apply a set of line changes to a sale bill in a fixed number of queries.
+
+    ``changed_lines`` are new or modified ProductSale instances and
+    ``deleted_lines`` existing ones to remove (e.g. ``formset.save(commit=False)``
+    and ``formset.deleted_objects``). The old versions of the touched lines
+    are read and locked, and the difference between old and new quantities
+    is expanded through StockVariant into a net change per stock. Stocks
+    used more are deducted by one conditional UPDATE, stocks used less are
+    returned by another (all of them locked first in primary-key order), and both are recorded in the stock ledger. Lines
+    are then written with one bulk statement per kind of change, the bill's
+    totals are recomputed and the daily rollups upserted. Raises
+    InsufficientStockError, leaving nothing written, if any stock would go
+    negative or the bill would sell more of a product that has no recipe.
+    """
+    changed_lines = list(changed_lines)
+    deleted_lines = [line for line in deleted_lines if line.pk is not None]
+    for line in changed_lines:
+        line.salebill = salebill
+        if line.price is None:
+            line.price = line.product.price
+
+    with transaction.atomic():
+        existing_ids = [line.pk for line in changed_lines + deleted_lines if line.pk is not None]
+        previous = {}
+        if existing_ids:
+            previous = {
+                row['pk']: row
+                for row in ProductSale.objects.select_for_update()
+                .filter(salebill=salebill, pk__in=existing_ids)
+                .values('pk', 'product_id', 'quantity', 'price')
+            }
+            missing = set(existing_ids) - set(previous)
+            if missing:
+                raise ProductSale.DoesNotExist(f"Sale line {min(missing)} is not on bill {salebill.bill_number}.")
+
+        # Net product quantities: what the bill sells after the edit minus what it sold before
+        product_quantities = defaultdict(int)
+        rollup_lines = []
+        for row in previous.values():
+            product_quantities[row['product_id']] -= row['quantity']
+            rollup_lines.append((row['product_id'], -row['quantity'], -row['quantity'] * (row['price'] or 0)))
+        for line in changed_lines:
+            product_quantities[line.product_id] += line.quantity
+            rollup_lines.append((line.product_id, line.quantity, line.amount()))
+
+        stock_quantities, with_recipe = StockVariant.objects.expand(product_quantities)
+        for line in changed_lines:
+            if product_quantities[line.product_id] > 0 and line.product_id not in with_recipe:
+                raise InsufficientStockError(f"Not enough stock available for {line.product.name}. It has no recipe.")
+        returned = {pk: -quantity for pk, quantity in stock_quantities.items() if quantity < 0}
+        sold = {pk: quantity for pk, quantity in stock_quantities.items() if quantity > 0}
+        if returned and sold:
+            # Each UPDATE locks only its own stocks, so lock both sets in one ordered pass first;
+            # otherwise two edits moving stock opposite ways could each hold what the other needs
+            Stock.objects.lock([*returned, *sold])
+        Stock.objects.sale_return(returned, source=salebill)
+        Stock.objects.sale(sold, source=salebill)
+
+        if deleted_lines:
+            # Nothing references ProductSale, and its post_delete handler would
+            # return stock row by row that has just been returned in bulk.
+            delete_rows(ProductSale.objects.filter(pk__in=[line.pk for line in deleted_lines]))
+        ProductSale.objects.bulk_create([line for line in changed_lines if line.pk is None])
+        updated_lines = [line for line in changed_lines if line.pk in previous]
+        now = timezone.now()
+        for line in updated_lines:
+            line.updated_at = now
+        ProductSale.objects.bulk_update(updated_lines, ['product', 'quantity', 'price', 'updated_at'])
+
+        salebill.refresh_totals()
+        record_daily_sales(salebill, rollup_lines, stock_quantities=stock_quantities)
+    return changed_lines
+
+
+def post_sale_bill(salebill, product_sales):
+    """Post the lines of a new sale bill, which is an edit that only adds lines."""
+    return edit_sale_bill(salebill, product_sales)
@@ -0,0 +1,99 @@
+"""
+Batched upload of sale bills captured while a POS terminal was offline.
+
+The service worker queues each bill submitted without a connection, with
+the idempotency key of its form, and sends the queue here in batches when
+the terminal is back online. A batch is posted in one transaction, each
+bill in a savepoint of its own, so one bill that can no longer be filled
+is reported back without undoing the others. Every bill is validated by
+the same forms as the sale page, including the joint stock check, and its
+key makes a batch that is sent again (because the response was lost)
+report the bills as duplicates instead of selling twice. The claiming and
+reporting are the bulk API's (main.api.BulkWriter).
+"""
+from main.api import CREATED, ItemConflict, ItemErrors
+from main.importer import RowError
+from .api import SaleBillWriter
+from .forms import SaleBillForm, SaleBillInlineFormset
+from .services import post_sale_bill
+
+MAX_SYNC_BILLS = 100
+
+
+def form_data(bill):
+    """
+    The POST data of the sale form for a queued bill:
+    ``{'key', 'customer', 'discount', 'lines': [{'product', 'quantity', 'price'}]}``.
+    """
+    lines = bill.get('lines') or []
+    data = {
+        'customer': bill.get('customer') or '',
+        'discount': bill.get('discount') or '0',
+        'productsale_set-TOTAL_FORMS': str(len(lines)),
+        'productsale_set-INITIAL_FORMS': '0',
+        'productsale_set-MIN_NUM_FORMS': '1',
+        'productsale_set-MAX_NUM_FORMS': '1000',
+    }
+    for index, line in enumerate(lines):
+        for name in ('product', 'quantity', 'price'):
+            value = line.get(name) if isinstance(line, dict) else None
+            data[f'productsale_set-{index}-{name}'] = '' if value is None else str(value)
+    return data
+
+
+def form_errors(form, formset):
+    """Flat, readable messages, and whether they are all stock shortfalls rather than bad input."""
+    messages, shortfall_only = [], True
+    for name, errors in form.errors.items():
+        shortfall_only = shortfall_only and name == '__all__'
+        messages += [error if name == '__all__' else f"{name}: {error}" for error in errors]
+    for index, errors in enumerate(formset.errors, start=1):
+        for name, field_errors in errors.items():
+            shortfall_only = shortfall_only and name == '__all__'
+            messages += [f"Line {index}: {error}" if name == '__all__' else f"Line {index} {name}: {error}" for error in field_errors]
+    if formset.non_form_errors():
+        shortfall_only = False
+        messages += list(formset.non_form_errors())
+    return messages, shortfall_only
+
+
+class SaleBillSyncWriter(SaleBillWriter):
+    """
+    Posts queued bills (see form_data()) through the sale forms, with the
+    claim, replay and conflict handling of the bulk API. Every bill needs
+    its form's key, and a whole batch is one chunk.
+    """
+    chunk_size = MAX_SYNC_BILLS
+    require_key = True
+
+    def load_maps(self, items):
+        pass  # The forms look up their own products and customers
+
+    def parse(self, item):
+        if not isinstance(item, dict):
+            raise RowError("Not a bill.")
+        data = form_data(item)
+        form, formset = SaleBillForm(data), SaleBillInlineFormset(data)
+        if not (form.is_valid() and formset.is_valid()):
+            errors, shortfall_only = form_errors(form, formset)
+            raise ItemConflict(errors) if shortfall_only else ItemErrors(errors)
+        return form, formset
+
+    def write(self, parsed):
+        form, formset = parsed
+        salebill = form.save()
+        post_sale_bill(salebill, formset.save(commit=False))
+        return salebill, CREATED
+
+
+def sync_sale_bills(bills):
+    """
+    Post queued ``bills`` (see form_data()) and return one result per bill:
+    ``{'index', 'key', 'status', 'id', 'bill_number', 'errors'}`` where status is
+
+    created     the bill was posted
+    duplicate   a bill with this key was already posted; its id is returned
+    conflict    there isn't enough stock left for it (``errors`` names the stocks)
+    invalid     it can't be posted as it is (unknown product, bad quantity...)
+    """
+    return list(SaleBillSyncWriter().results(bills))
@@ -1,3 +1,411 @@
-from django.test import TestCase
+import base64
+from datetime import date, datetime, timezone as dt_timezone
+import io
+from concurrent.futures import ThreadPoolExecutor
+import json
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+
+from product.models import Product, StockVariant
+from stock.models import InsufficientStockError, Stock, StockType
+from product.availability import bom
+from .forms import SaleBillInlineFormset
+from .models import DailyProductSales, DailyStockConsumption, ProductSale, SaleBill
+from .services import edit_sale_bill, post_sale_bill
 
 # Create your tests here.
+
+
+class DailyRollupTests(TestCase):
+    def setUp(self):
+        stock_type = StockType.objects.create(name='Oil')
+        self.oil = Stock.objects.create(name='CR7 Oil', stock_type=stock_type, opening_quantity=100)
+        self.bottle = Stock.objects.create(name='9ml Bottle', stock_type=stock_type, opening_quantity=20)
+        self.product = Product.objects.create(name='CR7 9ml', price=199)
+        StockVariant.objects.create(product=self.product, stock=self.oil, quantity=9)
+        StockVariant.objects.create(product=self.product, stock=self.bottle, quantity=1)
+
+    def rollups(self):
+        return (
+            list(DailyProductSales.objects.values_list('date', 'product_id', 'quantity', 'amount', 'line_count')),
+            sorted(DailyStockConsumption.objects.values_list('date', 'stock_id', 'quantity')),
+        )
+
+    def test_rollups_follow_create_edit_and_delete(self):
+        salebill = SaleBill.objects.create()
+        post_sale_bill(salebill, [
+            ProductSale(product=self.product, quantity=2),
+            ProductSale(product=self.product, quantity=1, price=150),
+        ])
+        line = ProductSale(salebill=salebill, product=self.product, quantity=1)
+        line.save()
+        line.delete()
+
+        (day, product_id, quantity, amount, line_count), = self.rollups()[0]
+        self.assertEqual((quantity, amount, line_count), (3, 548, 2))
+        self.assertEqual(self.rollups()[1], sorted([(day, self.oil.pk, 27), (day, self.bottle.pk, 3)]))
+
+        live = self.rollups()
+        call_command('rebuild_daily_sales', stdout=io.StringIO())
+        self.assertEqual(self.rollups(), live)
+
+    def test_rebuild_keeps_the_recipe_of_the_sale(self):
+        post_sale_bill(SaleBill.objects.create(), [ProductSale(product=self.product, quantity=2)])
+        StockVariant.objects.filter(stock=self.oil).update(quantity=6)
+        live = self.rollups()
+        call_command('rebuild_daily_sales', stdout=io.StringIO())
+        self.assertEqual(self.rollups(), live)
+
+    def test_rebuild_counts_bills_from_before_the_ledger_in_full(self):
+        salebill = SaleBill.objects.create()
+        # Posted before the ledger began, so its line left no movements
+        ProductSale.objects.bulk_create([ProductSale(salebill=salebill, product=self.product, quantity=2, price=199)])
+        SaleBill.objects.filter(pk=salebill.pk).update(created_at=datetime(2020, 1, 1, 12, tzinfo=dt_timezone.utc))
+        # and edited once it had
+        post_sale_bill(salebill, [ProductSale(product=self.product, quantity=1)])
+
+        call_command('rebuild_daily_sales', start=date(2020, 1, 1), end=date(2020, 1, 1), stdout=io.StringIO())
+        self.assertEqual(
+            sorted(DailyStockConsumption.objects.filter(date=date(2020, 1, 1)).values_list('stock_id', 'quantity')),
+            sorted([(self.oil.pk, 27), (self.bottle.pk, 3)]),
+        )
+
+
+class LazyProductChoiceTests(TestCase):
+    def setUp(self):
+        stock_type = StockType.objects.create(name='Oil')
+        oil = Stock.objects.create(name='CR7 Oil', stock_type=stock_type, opening_quantity=100)
+        self.products = [Product.objects.create(name=f'Perfume {i}', price=199) for i in range(30)]
+        StockVariant.objects.bulk_create([StockVariant(product=product, stock=oil, quantity=1) for product in self.products])
+        bom.changed()  # bulk_create sends no signals
+
+    def formset_data(self, product_ids):
+        data = {
+            'productsale_set-TOTAL_FORMS': str(len(product_ids)), 'productsale_set-INITIAL_FORMS': '0',
+            'productsale_set-MIN_NUM_FORMS': '1', 'productsale_set-MAX_NUM_FORMS': '1000',
+        }
+        for index, product_id in enumerate(product_ids):
+            data[f'productsale_set-{index}-product'] = str(product_id)
+            data[f'productsale_set-{index}-quantity'] = '1'
+        return data
+
+    def test_formset_validates_products_with_one_query(self):
+        formset = SaleBillInlineFormset(self.formset_data([product.pk for product in self.products[:20]]))
+        bom.compiled()
+        # The products, the recipe version, then the balances of the stock they draw on
+        with self.assertNumQueries(3):
+            self.assertTrue(formset.is_valid())
+
+        formset = SaleBillInlineFormset(self.formset_data([self.products[0].pk, 0]))
+        self.assertFalse(formset.is_valid())
+        self.assertIn('product', formset.errors[1])
+
+    def test_only_selected_options_are_rendered(self):
+        salebill = SaleBill.objects.create()
+        post_sale_bill(salebill, [ProductSale(product=self.products[3], quantity=1)])
+        html = SaleBillInlineFormset(instance=salebill).forms[0]['product'].as_widget()
+        self.assertEqual(html.count('<option'), 2)
+        self.assertIn('Perfume 3', html)
+
+
+class SaleBillEditTests(TestCase):
+    def setUp(self):
+        stock_type = StockType.objects.create(name='Oil')
+        self.oil = Stock.objects.create(name='CR7 Oil', stock_type=stock_type, opening_quantity=100)
+        self.bottle = Stock.objects.create(name='9ml Bottle', stock_type=stock_type, opening_quantity=10)
+        self.perfume = Product.objects.create(name='CR7 9ml', price=199)
+        self.refill = Product.objects.create(name='CR7 Refill', price=99)
+        StockVariant.objects.create(product=self.perfume, stock=self.oil, quantity=9)
+        StockVariant.objects.create(product=self.perfume, stock=self.bottle, quantity=1)
+        StockVariant.objects.create(product=self.refill, stock=self.oil, quantity=9)
+
+        self.salebill = SaleBill.objects.create()
+        self.perfume_line, self.refill_line = post_sale_bill(self.salebill, [
+            ProductSale(product=self.perfume, quantity=2),
+            ProductSale(product=self.refill, quantity=3),
+        ])
+
+    def sold(self):
+        self.oil.refresh_from_db()
+        self.bottle.refresh_from_db()
+        return self.oil.sale_quantity, self.bottle.sale_quantity
+
+    def test_saving_an_unchanged_line_does_not_deduct_again(self):
+        self.assertEqual(self.sold(), (45, 2))
+        self.perfume_line.save()
+        self.assertEqual(self.sold(), (45, 2))
+
+    def test_saving_a_stale_bill_keeps_its_totals(self):
+        stale = SaleBill.objects.get(pk=self.salebill.pk)
+        post_sale_bill(self.salebill, [ProductSale(product=self.refill, quantity=1)])
+        stale.discount = 50
+        stale.save()
+        self.salebill.refresh_from_db()
+        self.assertEqual(
+            (self.salebill.gross_amount, self.salebill.net_amount, self.salebill.line_count), (794, 744, 3)
+        )
+        self.assertEqual((stale.gross_amount, stale.net_amount), (794, 744))
+
+    def test_create_goes_through_the_edit(self):
+        line = ProductSale.objects.create(salebill=self.salebill, product=self.refill, quantity=1)
+        self.assertEqual(line.price, 99)
+        self.assertEqual(self.sold(), (54, 2))
+        self.salebill.refresh_from_db()
+        self.assertEqual((self.salebill.gross_amount, self.salebill.line_count), (794, 3))
+
+        with self.assertRaises(ValueError):
+            line.save(using='other')
+
+    def test_edit_applies_net_stock_changes(self):
+        self.perfume_line.quantity = 4
+        self.refill_line.product = self.perfume
+        edit_sale_bill(self.salebill, [self.perfume_line, self.refill_line])
+        self.assertEqual(self.sold(), (63, 7))
+
+        with self.assertNumQueries(15):
+            edit_sale_bill(
+                self.salebill, [ProductSale(product=self.refill, quantity=1)], [self.perfume_line, self.refill_line]
+            )
+        self.assertEqual(self.sold(), (9, 0))
+        self.salebill.refresh_from_db()
+        self.assertEqual((self.salebill.line_count, self.salebill.gross_amount), (1, 99))
+
+    def test_edit_rejects_shortfall_without_writing(self):
+        self.perfume_line.quantity = 20
+        with self.assertRaises(InsufficientStockError):
+            edit_sale_bill(self.salebill, [self.perfume_line])
+        self.assertEqual(self.sold(), (45, 2))
+        self.assertEqual(ProductSale.objects.get(pk=self.perfume_line.pk).quantity, 2)
+
+
+class ConcurrentSaleBillEditTests(TransactionTestCase):
+    def test_edits_moving_stock_opposite_ways_do_not_deadlock(self):
+        stock_type = StockType.objects.create(name='Oil')
+        oil = Stock.objects.create(name='CR7 Oil', stock_type=stock_type, opening_quantity=100)
+        bottle = Stock.objects.create(name='9ml Bottle', stock_type=stock_type, opening_quantity=100)
+        refill = Product.objects.create(name='CR7 Refill', price=99)
+        empty = Product.objects.create(name='9ml Bottle', price=20)
+        StockVariant.objects.create(product=refill, stock=oil, quantity=1)
+        StockVariant.objects.create(product=empty, stock=bottle, quantity=1)
+        bills = []
+        for product in (refill, empty):
+            salebill = SaleBill.objects.create()
+            post_sale_bill(salebill, [ProductSale(product=product, quantity=1)])
+            bills.append(salebill)
+
+        def swap(index):
+            # One bill returns oil and takes a bottle while the other does the opposite
+            try:
+                salebill = SaleBill.objects.get(pk=bills[index % 2].pk)
+                line = salebill.productsale_set.get()
+                line.product = empty if line.product_id == refill.pk else refill
+                edit_sale_bill(salebill, [line])
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(swap, range(200)))
+        oil.refresh_from_db()
+        bottle.refresh_from_db()
+        self.assertEqual(oil.sale_quantity + bottle.sale_quantity, 2)
+
+
+class BasketCheckTests(TestCase):
+    def setUp(self):
+        stock_type = StockType.objects.create(name='Oil')
+        self.bottle = Stock.objects.create(name='9ml Bottle', stock_type=stock_type, opening_quantity=5)
+        self.cr7 = Product.objects.create(name='CR7 9ml', price=199)
+        self.oud = Product.objects.create(name='Oud 9ml', price=249)
+        for product in (self.cr7, self.oud):
+            oil = Stock.objects.create(name=f'{product.name} Oil', stock_type=stock_type, opening_quantity=100)
+            StockVariant.objects.create(product=product, stock=oil, quantity=9)
+            StockVariant.objects.create(product=product, stock=self.bottle, quantity=1)
+
+    def formset(self, lines, instance=None):
+        forms = instance.productsale_set.order_by('pk') if instance else []
+        data = {
+            'productsale_set-TOTAL_FORMS': str(len(forms) + len(lines)), 'productsale_set-INITIAL_FORMS': str(len(forms)),
+            'productsale_set-MIN_NUM_FORMS': '1', 'productsale_set-MAX_NUM_FORMS': '1000',
+        }
+        rows = [(line.pk, line.product_id, line.quantity) for line in forms] + [(None, *line) for line in lines]
+        for index, (pk, product_id, quantity) in enumerate(rows):
+            data[f'productsale_set-{index}-id'] = str(pk or '')
+            data[f'productsale_set-{index}-product'] = str(product_id)
+            data[f'productsale_set-{index}-quantity'] = str(quantity)
+        return SaleBillInlineFormset(data, instance=instance or SaleBill())
+
+    def test_lines_sharing_a_stock_are_checked_together(self):
+        formset = self.formset([(self.cr7.pk, 3), (self.oud.pk, 3)])
+        self.assertFalse(formset.is_valid())
+        self.assertEqual(formset.errors[0]['__all__'], ['Not enough stock for CR7 9ml: 9ml Bottle (the bill needs 6, 5 available).'])
+        self.assertEqual(formset.errors[1]['__all__'], ['Not enough stock for Oud 9ml: 9ml Bottle (the bill needs 6, 5 available).'])
+
+        self.assertTrue(self.formset([(self.cr7.pk, 3), (self.oud.pk, 2)]).is_valid())
+
+    def test_stock_held_by_saved_lines_counts_as_available(self):
+        salebill = SaleBill.objects.create()
+        post_sale_bill(salebill, [ProductSale(product=self.cr7, quantity=4)])
+        # The bill keeps its 4 bottles and adds the last one
+        self.assertTrue(self.formset([(self.oud.pk, 1)], instance=salebill).is_valid())
+        self.assertFalse(self.formset([(self.oud.pk, 2)], instance=salebill).is_valid())
+
+    def test_products_without_a_recipe_cannot_be_sold(self):
+        unmade = Product.objects.create(name='CR7 Gift Box', price=499)
+        formset = self.formset([(self.cr7.pk, 1), (unmade.pk, 50)])
+        self.assertFalse(formset.is_valid())
+        self.assertEqual(formset.errors[1]['__all__'], ['Not enough stock for CR7 Gift Box: it has no recipe.'])
+
+        salebill = SaleBill.objects.create()
+        with self.assertRaises(InsufficientStockError):
+            post_sale_bill(salebill, [ProductSale(product=self.cr7, quantity=1), ProductSale(product=unmade, quantity=50)])
+        self.assertFalse(salebill.productsale_set.exists())
+        with self.assertRaises(InsufficientStockError):
+            unmade.sale(1)
+
+
+class InvoiceCacheTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('cashier', password='secret'))
+        stock_type = StockType.objects.create(name='Oil')
+        bottle = Stock.objects.create(name='9ml Bottle', stock_type=stock_type, opening_quantity=5)
+        self.product = Product.objects.create(name='CR7 9ml', price=199)
+        StockVariant.objects.create(product=self.product, stock=bottle, quantity=1)
+        self.salebill = SaleBill.objects.create()
+        post_sale_bill(self.salebill, [ProductSale(product=self.product, quantity=1)])
+
+    def test_product_rename_changes_the_etag(self):
+        url = f'/sales/{self.salebill.pk}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Product.objects.filter(pk=self.product.pk).update(name='CR7 Ultra 9ml')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'CR7 Ultra 9ml')
+
+
+class IdempotentSubmissionTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('cashier', password='secret'))
+        stock_type = StockType.objects.create(name='Oil')
+        self.bottle = Stock.objects.create(name='9ml Bottle', stock_type=stock_type, opening_quantity=5)
+        self.product = Product.objects.create(name='CR7 9ml', price=199)
+        StockVariant.objects.create(product=self.product, stock=self.bottle, quantity=1)
+
+    def test_retried_submission_creates_one_bill(self):
+        key = self.client.get('/sales/create/').context['idempotency_key']
+        data = {
+            'idempotency_key': key, 'discount': '0',
+            'productsale_set-TOTAL_FORMS': '1', 'productsale_set-INITIAL_FORMS': '0',
+            'productsale_set-MIN_NUM_FORMS': '1', 'productsale_set-MAX_NUM_FORMS': '1000',
+            'productsale_set-0-product': str(self.product.pk), 'productsale_set-0-quantity': '3',
+        }
+        first = self.client.post('/sales/create/', data)
+        # Only the stored redirect is read, even though the stock no longer covers the bill
+        with self.assertNumQueries(3):
+            retry = self.client.post('/sales/create/', data)
+        self.assertRedirects(retry, first.url, fetch_redirect_response=False)
+        self.assertEqual(SaleBill.objects.count(), 1)
+        self.bottle.refresh_from_db()
+        self.assertEqual(self.bottle.sale_quantity, 3)
+
+        data['idempotency_key'] = 'another-key'
+        self.client.post('/sales/create/', {**data, 'productsale_set-0-quantity': '2'})
+        self.assertEqual(SaleBill.objects.count(), 2)
+
+
+class OfflineSyncTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('cashier', password='secret'))
+        stock_type = StockType.objects.create(name='Oil')
+        self.bottle = Stock.objects.create(name='9ml Bottle', stock_type=stock_type, opening_quantity=5)
+        self.product = Product.objects.create(name='CR7 9ml', price=199)
+        StockVariant.objects.create(product=self.product, stock=self.bottle, quantity=1)
+
+    def sync(self, bills):
+        return self.client.post('/sales/sync/', {'bills': bills}, content_type='application/json')
+
+    def test_batch_reports_each_bill(self):
+        bills = [
+            {'key': 'offline-bill-1', 'lines': [{'product': self.product.pk, 'quantity': 3}]},
+            {'key': 'offline-bill-2', 'lines': [{'product': self.product.pk, 'quantity': 3}]},
+            {'key': 'offline-bill-3', 'lines': [{'product': 0, 'quantity': 1}]},
+            {'key': 'offline-bill-4', 'discount': '10', 'lines': [{'product': self.product.pk, 'quantity': 2, 'price': '150'}]},
+        ]
+        results = self.sync(bills).json()['results']
+        self.assertEqual([result['status'] for result in results], ['created', 'conflict', 'invalid', 'created'])
+        self.assertEqual(results[1]['errors'], ['Line 1: Not enough stock for CR7 9ml: 9ml Bottle (the bill needs 3, 2 available).'])
+        self.assertTrue(results[0]['bill_number'])
+        self.assertEqual(SaleBill.objects.get(pk=results[3]['id']).net_amount, 290)
+        self.bottle.refresh_from_db()
+        self.assertEqual(self.bottle.sale_quantity, 5)
+
+        # The same batch sent again after a lost response sells nothing twice
+        again = self.sync(bills).json()['results']
+        self.assertEqual([result['status'] for result in again], ['duplicate', 'conflict', 'invalid', 'duplicate'])
+        self.assertEqual(again[0]['id'], results[0]['id'])
+        self.assertEqual(SaleBill.objects.count(), 2)
+
+    def test_products_without_a_recipe_are_a_conflict(self):
+        unmade = Product.objects.create(name='CR7 Gift Box', price=499)
+        results = self.sync([{'key': 'offline-bill-5', 'lines': [{'product': unmade.pk, 'quantity': 50}]}]).json()['results']
+        self.assertEqual(results[0]['status'], 'conflict')
+        self.assertFalse(SaleBill.objects.exists())
+
+    def test_rejects_malformed_batches(self):
+        self.assertEqual(self.client.post('/sales/sync/', 'x', content_type='application/json').status_code, 400)
+        self.assertEqual(self.sync([{}] * 101).status_code, 400)
+        self.assertEqual(self.client.get('/sales/sync/').status_code, 405)
+
+
+class BulkApiTests(TestCase):
+    def setUp(self):
+        User.objects.create_user('shop', password='secret')
+        stock_type = StockType.objects.create(name='Oil')
+        self.bottle = Stock.objects.create(name='9ml Bottle', stock_type=stock_type, opening_quantity=5)
+        self.product = Product.objects.create(name='CR7 9ml', price=199)
+        StockVariant.objects.create(product=self.product, stock=self.bottle, quantity=1)
+        self.auth = {'HTTP_AUTHORIZATION': 'Basic ' + base64.b64encode(b'shop:secret').decode()}
+
+    def post(self, body, content_type='application/json'):
+        response = self.client.post('/sales/api/', body, content_type=content_type, **self.auth)
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        return lines[:-1], lines[-1]['summary']
+
+    def test_creates_bills_and_reports_each(self):
+        bills = [
+            {'key': 'order-1001', 'lines': [{'product': self.product.pk, 'quantity': 3}]},
+            {'key': 'order-1002', 'lines': [{'product': self.product.pk, 'quantity': 3}]},
+            {'lines': [{'product': self.product.pk, 'quantity': 0}]},
+            {'discount': 10, 'lines': [{'product': self.product.pk, 'quantity': 2, 'price': 150}]},
+        ]
+        results, summary = self.post({'bills': bills})
+        self.assertEqual([result['status'] for result in results], ['created', 'conflict', 'invalid', 'created'])
+        self.assertEqual(results[1]['errors'], ['Line 1: Not enough stock for CR7 9ml: 9ml Bottle (the bill needs 3, 2 available).'])
+        self.assertEqual(results[2]['errors'], ["Line 1: 'quantity' must be at least 1."])
+        self.assertEqual(summary, {'created': 2, 'conflict': 1, 'invalid': 1})
+        self.assertEqual(SaleBill.objects.get(pk=results[0]['id']).net_amount, 597)
+        self.assertEqual(SaleBill.objects.get(pk=results[3]['id']).net_amount, 290)
+        self.assertTrue(results[0]['bill_number'])
+
+        # A retried order with the same key is not sold twice
+        results, summary = self.post({'bills': bills[:1]})
+        self.assertEqual(results[0]['status'], 'duplicate')
+        self.bottle.refresh_from_db()
+        self.assertEqual(self.bottle.sale_quantity, 5)
+
+    def test_reads_json_lines(self):
+        body = '\n'.join([json.dumps({'lines': [{'product': self.product.pk, 'quantity': 1}]}), '{not json', ''])
+        results, summary = self.post(body, content_type='application/x-ndjson')
+        self.assertEqual([result['status'] for result in results], ['created', 'invalid'])
+        self.assertEqual(results[1]['errors'], ['Not valid JSON.'])
+
+    def test_requires_authentication(self):
+        response = self.client.post('/sales/api/', [], content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('Basic', response['WWW-Authenticate'])
+        self.assertEqual(self.client.get('/sales/api/', **self.auth).status_code, 405)
+        self.assertEqual(self.client.post('/sales/api/', 'x', content_type='application/json', **self.auth).status_code, 400)
@@ -7,4 +7,7 @@ urlpatterns = [
     path('<int:pk>/', views.SaleBillDetailView.as_view(), name='salebill-detail'),
     path('create/', views.SaleBillCreateView.as_view(), name='salebill-create'),
     path('<int:pk>/edit/', views.SaleBillUpdateView.as_view(), name='salebill-edit'),
+    path('export/', views.salebill_export_view, name='salebill-export'),
+    path('sync/', views.salebill_sync_view, name='salebill-sync'),
+    path('api/', views.salebill_api_view, name='salebill-api'),
 ]
@@ -1,28 +1,100 @@
+import hashlib
+import json
+
 from .models import SaleBill, ProductSale
 from django.views.generic import ListView, CreateView, DetailView, UpdateView
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.decorators import login_required
 from .forms import SaleBillForm, SaleBillInlineFormset
+from .services import edit_sale_bill, post_sale_bill
+from .api import SaleBillWriter
+from .sync import MAX_SYNC_BILLS, sync_sale_bills
+from django.core.cache import cache
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import redirect
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_POST
+from django.contrib.postgres.aggregates import StringAgg
+from django.db import transaction
+from django.db.models import Max, OuterRef, Subquery
+from django.urls import reverse
+from main.api import bulk_api_view
+from main.export import export_view_response
+from main.idempotency import IdempotentCreateMixin
+from main.pagination import KeysetPaginationMixin
+from stock.models import InsufficientStockError
 
 # Create your views here.
 
-class SaleBillListView(LoginRequiredMixin, ListView):
+class SaleBillListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = SaleBill
 
+    def get_queryset(self):
+        return SaleBill.objects.select_related('customer')
+
 
 class SaleBillDetailView(LoginRequiredMixin, DetailView):
+    """
+    The printable invoice. It only changes when the bill, its lines, their
+    products or its customer change, so the rendered HTML is cached under a
+    version built from their ``updated_at`` values and the product names,
+    and sent with an ETag and Last-Modified; a repeat open costs one small
+    query and returns 304.
+    """
     model = SaleBill
-    
+    cache_timeout = 60 * 60 * 24 * 7
+
+    def get_queryset(self):
+        return SaleBill.objects.select_related('customer')
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        salebill = self.object
-        product_sales = ProductSale.objects.filter(salebill=salebill)
-        context['product_sales'] = product_sales
+        context['product_sales'] = self.object.productsale_set.select_related('product').order_by('pk')
         return context
 
-
-class SaleBillCreateView(LoginRequiredMixin, CreateView):
+    def get(self, request, *args, **kwargs):
+        lines = ProductSale.objects.filter(salebill=OuterRef('pk')).order_by().values('salebill')
+        version = (
+            SaleBill.objects.filter(pk=kwargs['pk'])
+            .annotate(
+                lines_updated_at=Subquery(lines.annotate(latest=Max('updated_at')).values('latest')),
+                products_updated_at=Subquery(lines.annotate(latest=Max('product__updated_at')).values('latest')),
+                # Names too, since a rename made with QuerySet.update() leaves updated_at alone
+                product_names=Subquery(lines.annotate(names=StringAgg('product__name', '|', ordering='pk')).values('names')),
+            )
+            .values_list('updated_at', 'customer__updated_at', 'lines_updated_at', 'products_updated_at', 'product_names')
+            .first()
+        )
+        if version is None:
+            raise Http404("No sale bill found matching the query")
+
+        *timestamps, product_names = version
+        last_modified = max(timestamp for timestamp in timestamps if timestamp is not None)
+        etag = '"salebill-{}-{}"'.format(kwargs['pk'], hashlib.md5(repr(version).encode()).hexdigest())
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=int(last_modified.timestamp())
+        )
+        if not_modified is not None:
+            return not_modified
+
+        cache_key = f'invoice:{etag}'
+        content = cache.get(cache_key)
+        if content is None:
+            response = super().get(request, *args, **kwargs)
+            content = response.render().content
+            cache.set(cache_key, content, self.cache_timeout)
+        response = HttpResponse(content)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+        # Browsers keep the page but check back each time, getting a 304 while it is unchanged
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+class SaleBillCreateView(LoginRequiredMixin, IdempotentCreateMixin, CreateView):
     model = SaleBill
+    idempotency_scope = 'salebill'
     form_class = SaleBillForm
     template_name = 'sale/salebill_form.html' # Explicitly set template name
 
@@ -33,6 +105,7 @@ class SaleBillCreateView(LoginRequiredMixin, CreateView):
         return context
 
     def post(self, request, *args, **kwargs):
+        self.object = None
         form = self.get_form(self.get_form_class())
         formset = SaleBillInlineFormset(request.POST)
 
@@ -42,15 +115,19 @@ class SaleBillCreateView(LoginRequiredMixin, CreateView):
             return self.form_invalid(form, formset)
 
     def form_valid(self, form, formset):
-        salebill = form.save()
-
-        # Now save each ProductSale instance from the formset
-        for product_sale in formset.save(commit=False):
-            product_sale.salebill = salebill  # Link ProductSale to the SaleBill
-            product_sale.save()
-
-        # Redirect to the sale bill detail view or another page after successful submission
-        return redirect('salebill-list')
+        try:
+            with transaction.atomic():
+                if not self.claim_idempotency_key():
+                    # A retry of a submission that has just created the bill
+                    return self.replay_idempotent()
+                salebill = form.save()
+                # Deduct stock and write every line of the bill in one batch
+                post_sale_bill(salebill, formset.save(commit=False))
+                # Redirect to the sale bill list after successful submission, and send retries there too
+                return self.complete_idempotency_key(reverse('salebill-list'), salebill)
+        except InsufficientStockError as exc:
+            form.add_error(None, str(exc))
+            return self.form_invalid(form, formset)
 
 
     def form_invalid(self, form, formset):
@@ -82,10 +159,45 @@ class SaleBillUpdateView(LoginRequiredMixin, UpdateView):
             return self.form_invalid(form, formset)
 
     def form_valid(self, form, formset):
-        self.object = form.save()
-        formset.instance = self.object
-        formset.save()
+        try:
+            with transaction.atomic():
+                self.object = form.save()
+                formset.instance = self.object
+                # Apply only the net stock change of the edited, added and removed lines
+                edit_sale_bill(self.object, formset.save(commit=False), formset.deleted_objects)
+        except InsufficientStockError as exc:
+            form.add_error(None, str(exc))
+            return self.form_invalid(form, formset)
         return redirect('salebill-list')
 
     def form_invalid(self, form, formset):
         return self.render_to_response(self.get_context_data(form=form, formset=formset))
+
+
+@login_required
+@require_POST
+def salebill_sync_view(request):
+    """
+    Post a batch of bills queued offline by the service worker:
+    ``{"bills": [{"key", "customer", "discount", "lines": [{"product", "quantity", "price"}]}]}``.
+    Responds with one result per bill, in order (see sale.sync.sync_sale_bills).
+    """
+    try:
+        bills = json.loads(request.body)['bills']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected a JSON object with a list of bills.'}, status=400)
+    if not isinstance(bills, list):
+        return JsonResponse({'error': 'Expected a JSON object with a list of bills.'}, status=400)
+    if len(bills) > MAX_SYNC_BILLS:
+        return JsonResponse({'error': f'At most {MAX_SYNC_BILLS} bills can be sent at once.'}, status=400)
+    return JsonResponse({'results': sync_sale_bills(bills)})
+
+
+@login_required
+def salebill_export_view(request):
+    """Stream every sale line in ?start=&end= as CSV, or JSON lines with ?format=jsonl."""
+    return export_view_response(request, 'sales')
+
+
+# Bulk JSON create for integrations; see main/api.py
+salebill_api_view = bulk_api_view(SaleBillWriter, 'bills')
@@ -1,7 +1,23 @@
 from django.contrib import admin
-from .models import Stock, StockType
+from .models import Stock, StockMovement, StockSnapshot, StockType
 
 # Register your models here.
 
 admin.site.register(Stock)
-admin.site.register(StockType)
\ No newline at end of file
+admin.site.register(StockType)
+admin.site.register(StockSnapshot)
+
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    """The ledger is append-only: movements are only written by the stock counter updates."""
+    list_display = ('stock', 'kind', 'quantity', 'source_type', 'source_id', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,76 @@
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from stock.models import MovementKind, Stock, StockMovement, StockSnapshot
+
+COUNTERS = ['opening_quantity', 'purchase_quantity', 'sale_quantity']
+
+
+class Command(BaseCommand):
+    help = (
+        "Maintain the stock movement ledger. "
+        "'verify' compares the Stock counters with the ledger, 'rebuild' rewrites the counters "
+        "from the ledger, 'snapshot' records balances as of --at (default: start of today) and "
+        "'seed' records the current counters as movements for stocks that have none yet."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['verify', 'rebuild', 'snapshot', 'seed'])
+        parser.add_argument('--at', help="Snapshot time, as an ISO date or datetime.")
+
+    def handle(self, *args, **options):
+        getattr(self, options['action'])(options)
+
+    def _mismatches(self, stocks):
+        totals = StockMovement.objects.counter_totals()
+        for stock in stocks:
+            expected = totals.get(stock.pk, dict.fromkeys(COUNTERS, 0))
+            if any(getattr(stock, field) != expected[field] for field in COUNTERS):
+                yield stock, expected
+
+    def verify(self, options):
+        mismatches = list(self._mismatches(Stock.objects.only('name', *COUNTERS)))
+        for stock, expected in mismatches:
+            actual = ', '.join(f"{field}={getattr(stock, field)}" for field in COUNTERS)
+            ledger = ', '.join(f"{field}={expected[field]}" for field in COUNTERS)
+            self.stdout.write(f"{stock.name}: counters {actual}; ledger {ledger}")
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} stock(s) disagree with the ledger.")
+        self.stdout.write(self.style.SUCCESS("All stock counters match the ledger."))
+
+    def rebuild(self, options):
+        with transaction.atomic():
+            stocks = Stock.objects.select_for_update().only(*COUNTERS).order_by('pk')
+            changed = []
+            for stock, expected in self._mismatches(stocks):
+                for field in COUNTERS:
+                    setattr(stock, field, expected[field])
+                changed.append(stock)
+            Stock.objects.bulk_update(changed, COUNTERS, batch_size=1000)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt counters for {len(changed)} stock(s)."))
+
+    def snapshot(self, options):
+        if options['at']:
+            when = datetime.fromisoformat(options['at'])
+            if timezone.is_naive(when):
+                when = timezone.make_aware(when)
+        else:
+            when = timezone.make_aware(datetime.combine(timezone.localdate(), time.min))
+        snapshots = StockSnapshot.objects.take(when)
+        self.stdout.write(self.style.SUCCESS(f"Recorded {len(snapshots)} snapshot(s) at {when}."))
+
+    def seed(self, options):
+        with transaction.atomic():
+            stocks = list(Stock.objects.filter(movements__isnull=True).only(*COUNTERS))
+            count = 0
+            for kind, field, sign in [
+                (MovementKind.OPENING, 'opening_quantity', 1),
+                (MovementKind.PURCHASE, 'purchase_quantity', 1),
+                (MovementKind.SALE, 'sale_quantity', -1),
+            ]:
+                quantities = {stock.pk: sign * getattr(stock, field) for stock in stocks}
+                count += len(StockMovement.objects.record(quantities, kind))
+        self.stdout.write(self.style.SUCCESS(f"Recorded {count} movement(s)."))
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.8 on 2026-10-18 08:00
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('stock', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('opening', 'Opening'), ('purchase', 'Purchase'), ('sale', 'Sale'), ('sale_return', 'Sale Return')], max_length=20)),
+                ('quantity', models.IntegerField()),
+                ('source_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('source_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='contenttypes.contenttype')),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='stock.stock')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['stock', 'created_at'], name='stock_stock_stock_i_a7472e_idx'), models.Index(fields=['source_type', 'source_id'], name='stock_stock_source__7a4912_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.IntegerField()),
+                ('taken_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='stock.stock')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('stock', 'taken_at'), name='unique_snapshot_per_stock_time')],
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+from django.db import migrations
+from django.db.models import Sum
+from django.utils import timezone
+
+# Each kind of movement and the counter it adds to, with the sign it adds with
+KINDS = {
+    'opening': ('opening_quantity', 1),
+    'purchase': ('purchase_quantity', 1),
+    'purchase_return': ('purchase_quantity', 1),
+    'sale': ('sale_quantity', -1),
+    'sale_return': ('sale_quantity', -1),
+}
+
+
+def seed_ledger(apps, schema_editor):
+    """
+    Record the part of each stock's counters that the ledger doesn't hold yet,
+    i.e. everything from before the ledger began, so that balances_at(),
+    snapshots and ``stock_ledger verify`` agree with the counters. Openings are
+    dated when the stock was created; purchases and sales from before the
+    ledger have no dates of their own and are dated now.
+    """
+    Stock = apps.get_model('stock', 'Stock')
+    StockMovement = apps.get_model('stock', 'StockMovement')
+
+    recorded = {}
+    rows = StockMovement.objects.values('stock_id', 'kind').annotate(total=Sum('quantity')).order_by()
+    for row in rows:
+        field, sign = KINDS[row['kind']]
+        key = (row['stock_id'], field)
+        recorded[key] = recorded.get(key, 0) + sign * row['total']
+
+    now = timezone.now()
+    movements = []
+    stocks = Stock.objects.values_list('pk', 'created_at', 'opening_quantity', 'purchase_quantity', 'sale_quantity')
+    for pk, created_at, *counters in stocks.iterator(chunk_size=2000):
+        for (kind, created), value in zip([('opening', created_at), ('purchase', now), ('sale', now)], counters):
+            field, sign = KINDS[kind]
+            missing = value - recorded.get((pk, field), 0)
+            if missing:
+                movements.append(StockMovement(stock_id=pk, kind=kind, quantity=sign * missing, created_at=created))
+    StockMovement.objects.bulk_create(movements, batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stock', '0005_purchase_return_movement'),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_ledger, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,33 @@
-from django.db import models
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.db import connection, models, transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, Upper
 from django.urls import reverse
+from django.utils import timezone
 
 # Create your models here.
 
 
+# Balance expression usable in filters and annotations on Stock querysets
+BALANCE = F('opening_quantity') + F('purchase_quantity') - F('sale_quantity')
+
+
+# Columns written only by the StockQuerySet counter mutations
+COUNTER_COLUMNS = ('purchase_quantity', 'sale_quantity')
+
+
+class InsufficientStockError(ValueError):
+    def __init__(self, message, stock_id=None):
+        super().__init__(message)
+        self.stock_id = stock_id
+
+
 class MetricChoices(models.TextChoices):
     PIECE = "pcs", "Pieces"
     Milliliter = "ml", "Milliliters"
@@ -20,6 +44,127 @@ class StockType(models.Model):
 
 
 
+class StockQuerySet(models.QuerySet):
+    """
+    Counter mutations for many stocks at once, keyed as {stock_id: quantity}.
+
+    All stocks are changed by a single UPDATE on one counter column. When
+    several stocks are involved their rows are locked first in primary-key
+    order, so concurrent bills always lock in the same order and cannot
+    deadlock.
+    """
+
+    def _increment(self, field, quantities, kind, source=None, check_balance=False, record=True):
+        quantities = {pk: quantity for pk, quantity in quantities.items() if quantity}
+        if not quantities:
+            return
+
+        stock_ids = sorted(quantities)
+        delta = self._delta(stock_ids, quantities)
+        # Sales count against the balance, so their counter moves opposite to it
+        sign = -1 if field == 'sale_quantity' else 1
+        with transaction.atomic():
+            self.lock(stock_ids)
+
+            rows = self.filter(pk__in=stock_ids)
+            if check_balance:
+                # The balance check is part of the UPDATE, so it holds under concurrency
+                required = self._delta(stock_ids, {pk: -sign * quantities[pk] for pk in stock_ids})
+                rows = rows.alias(balance=BALANCE).filter(balance__gte=required)
+            if rows.update(**{field: F(field) + delta}) != len(stock_ids):
+                self._raise_for_shortfall(stock_ids, {pk: -sign * quantities[pk] for pk in stock_ids})
+
+            if record:
+                StockMovement.objects.record(
+                    {pk: sign * quantities[pk] for pk in stock_ids}, kind, source=source
+                )
+
+    def lock(self, stock_ids):
+        """
+        Lock the rows of ``stock_ids`` in primary-key order until the transaction
+        ends. A caller making several counter changes locks all of their stocks
+        here first, so the changes can't interleave with another caller's in an
+        order that deadlocks. A single row is left to the UPDATE that changes it.
+        """
+        stock_ids = sorted(set(stock_ids))
+        if len(stock_ids) > 1:
+            list(self.select_for_update().filter(pk__in=stock_ids).order_by('pk').values_list('pk', flat=True))
+
+    def _delta(self, stock_ids, quantities):
+        # A simple CASE over the primary key. Built as raw SQL because resolving
+        # one When(pk=...) lookup per stock dominated the cost of large bills.
+        column = f'{connection.ops.quote_name(self.model._meta.db_table)}.{connection.ops.quote_name("id")}'
+        params = [value for pk in stock_ids for value in (pk, quantities[pk])]
+        return RawSQL(
+            f"CASE {column} {' '.join(['WHEN %s THEN %s'] * len(stock_ids))} ELSE 0 END",
+            params,
+            output_field=models.IntegerField(),
+        )
+
+    def _raise_for_shortfall(self, stock_ids, required):
+        stock = (
+            self.filter(pk__in=stock_ids)
+            .alias(balance=BALANCE)
+            .filter(balance__lt=self._delta(stock_ids, required))
+            .order_by('pk')
+            .first()
+        )
+        if stock is None:
+            missing = set(stock_ids) - set(self.filter(pk__in=stock_ids).values_list('pk', flat=True))
+            if missing:
+                raise Stock.DoesNotExist(f"Stock {min(missing)} does not exist.")
+            # The balance recovered between the UPDATE and this lookup
+            raise InsufficientStockError("Not enough stock.")
+        raise InsufficientStockError(
+            f"Not enough stock for {stock.name}. Only {stock.balance_quantity} left.",
+            stock_id=stock.pk,
+        )
+
+    def sale(self, quantities, source=None):
+        self._increment('sale_quantity', quantities, MovementKind.SALE, source=source, check_balance=True)
+
+    def purchase(self, quantities, source=None, record=True):
+        # record=False leaves the ledger to the caller, e.g. to split a batch by bill with record_many()
+        self._increment('purchase_quantity', quantities, MovementKind.PURCHASE, source=source, record=record)
+
+    def sale_return(self, quantities, source=None):
+        self._increment(
+            'sale_quantity', {pk: -quantity for pk, quantity in quantities.items()},
+            MovementKind.SALE_RETURN, source=source,
+        )
+
+    def purchase_return(self, quantities, source=None):
+        # Stock that has already been sold can't be taken back off a purchase
+        self._increment(
+            'purchase_quantity', {pk: -quantity for pk, quantity in quantities.items()},
+            MovementKind.PURCHASE_RETURN, source=source, check_balance=True,
+        )
+
+    def balances_at(self, when):
+        """
+        Annotate ``balance_at`` with each stock's balance as of ``when``: the
+        latest StockSnapshot taken at or before ``when`` plus the movements
+        recorded since that snapshot.
+        """
+        snapshots = StockSnapshot.objects.filter(stock=OuterRef('pk'), taken_at__lte=when).order_by('-taken_at')
+        since_snapshot = (
+            StockMovement.objects
+            .filter(stock=OuterRef('pk'), created_at__lte=when, created_at__gt=OuterRef('snapshot_at'))
+            .values('stock')
+            .annotate(total=Sum('quantity'))
+            .values('total')
+        )
+        return self.annotate(
+            snapshot_at=Coalesce(
+                Subquery(snapshots.values('taken_at')[:1]),
+                Value(datetime.min.replace(tzinfo=dt_timezone.utc)),
+            ),
+        ).annotate(
+            balance_at=Coalesce(Subquery(snapshots.values('balance')[:1]), Value(0))
+            + Coalesce(Subquery(since_snapshot), Value(0)),
+        )
+
+
 class Stock(models.Model):
     name = models.CharField(max_length=255, unique=True)
     stock_type = models.ForeignKey(StockType, on_delete=models.CASCADE)
@@ -29,6 +174,16 @@ class Stock(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = StockQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            # Trigram indexes for search: UPPER(name) serves icontains/istartswith, name serves word similarity
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='stock_name_upper_trgm'),
+            GinIndex(OpClass('name', name='gin_trgm_ops'), name='stock_name_trgm'),
+        ]
+
     @property
     def balance_quantity(self):
         return self.opening_quantity + self.purchase_quantity - self.sale_quantity
@@ -42,24 +197,166 @@ class Stock(models.Model):
     def metric(self):
         return self.stock_type.metric
     
-    def sale(self, quantity):
-        if quantity > self.balance_quantity:
-            pass #raise ValueError("Not enough stock to sell.")
-        
-        self.sale_quantity += quantity
-        self.save()
+    def save(self, *args, **kwargs):
+        # The counters only move through the UPDATEs of Stock.objects; writing back
+        # the values this instance loaded would undo bills posted since, e.g. while
+        # the edit form was open
+        if kwargs.get('update_fields') is None and not self._state.adding:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in COUNTER_COLUMNS
+            ]
+
+        # Changes to the opening quantity are recorded in the ledger like any other movement
+        update_fields = kwargs.get('update_fields')
+        previous_opening = 0
+        if update_fields is not None and 'opening_quantity' not in update_fields:
+            previous_opening = self.opening_quantity
+        elif self.pk is not None:
+            previous_opening = (
+                Stock.objects.filter(pk=self.pk).values_list('opening_quantity', flat=True).first() or 0
+            )
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if self.opening_quantity != previous_opening:
+                StockMovement.objects.record(
+                    {self.pk: self.opening_quantity - previous_opening}, MovementKind.OPENING
+                )
+
+    def balance_at(self, when):
+        return Stock.objects.balances_at(when).get(pk=self.pk).balance_at
+
+    def _refresh_counters(self):
+        self.refresh_from_db(fields=['opening_quantity', 'purchase_quantity', 'sale_quantity'])
+
+    def sale(self, quantity, source=None):
+        # Raises InsufficientStockError if the balance would go negative
+        Stock.objects.sale({self.pk: quantity}, source=source)
+        self._refresh_counters()
         return self.sale_quantity
     
-    def purchase(self, quantity):
-        self.purchase_quantity += quantity
-        self.save()
+    def purchase(self, quantity, source=None):
+        Stock.objects.purchase({self.pk: quantity}, source=source)
+        self._refresh_counters()
         return self.purchase_quantity
     
-    def sale_return(self, quantity):
-        self.sale_quantity -= quantity
-        self.save()
+    def sale_return(self, quantity, source=None):
+        Stock.objects.sale_return({self.pk: quantity}, source=source)
+        self._refresh_counters()
         return self.sale_quantity
 
+    def purchase_return(self, quantity, source=None):
+        # Raises InsufficientStockError if the balance would go negative
+        Stock.objects.purchase_return({self.pk: quantity}, source=source)
+        self._refresh_counters()
+        return self.purchase_quantity
+
     def get_absolute_url(self):
         return reverse('stock-list')
-    
\ No newline at end of file
+
+
+class MovementKind(models.TextChoices):
+    OPENING = "opening", "Opening"
+    PURCHASE = "purchase", "Purchase"
+    SALE = "sale", "Sale"
+    SALE_RETURN = "sale_return", "Sale Return"
+    PURCHASE_RETURN = "purchase_return", "Purchase Return"
+
+
+# Stock counter that each kind of movement is folded into
+COUNTER_FIELDS = {
+    MovementKind.OPENING: 'opening_quantity',
+    MovementKind.PURCHASE: 'purchase_quantity',
+    MovementKind.SALE: 'sale_quantity',
+    MovementKind.SALE_RETURN: 'sale_quantity',
+    MovementKind.PURCHASE_RETURN: 'purchase_quantity',
+}
+
+
+class StockMovementQuerySet(models.QuerySet):
+    def record(self, quantities, kind, source=None, created_at=None):
+        """Append one movement per {stock_id: signed quantity} with a single bulk insert."""
+        return self.record_many([(source, quantities)], kind, created_at=created_at)
+
+    def record_many(self, entries, kind, created_at=None):
+        """Like record() for ``[(source, {stock_id: signed quantity})]`` of several sources, still in one insert."""
+        created_at = created_at or timezone.now()
+        return self.bulk_create([
+            StockMovement(
+                stock_id=stock_id,
+                kind=kind,
+                quantity=quantity,
+                source_type=ContentType.objects.get_for_model(source) if source is not None else None,
+                source_id=source.pk if source is not None else None,
+                created_at=created_at,
+            )
+            for source, quantities in entries
+            for stock_id, quantity in quantities.items() if quantity
+        ])
+
+    def counter_totals(self):
+        """Return {stock_id: {counter field: total}} rebuilt from the movements in one query."""
+        totals = defaultdict(lambda: dict.fromkeys(set(COUNTER_FIELDS.values()), 0))
+        rows = self.values('stock_id', 'kind').annotate(total=Sum('quantity')).order_by()
+        for row in rows:
+            field = COUNTER_FIELDS[row['kind']]
+            # Sale movements reduce the balance but increase sale_quantity
+            sign = -1 if field == 'sale_quantity' else 1
+            totals[row['stock_id']][field] += sign * row['total']
+        return totals
+
+
+class StockMovement(models.Model):
+    """
+    Append-only ledger of every change to a stock's balance. ``quantity`` is
+    signed: positive movements increase the balance, negative ones reduce it.
+    """
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='movements')
+    kind = models.CharField(max_length=20, choices=MovementKind.choices)
+    quantity = models.IntegerField()
+    source_type = models.ForeignKey(ContentType, on_delete=models.SET_NULL, null=True, blank=True)
+    source_id = models.PositiveBigIntegerField(null=True, blank=True)
+    source = GenericForeignKey('source_type', 'source_id')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    objects = StockMovementQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['stock', 'created_at']),
+            models.Index(fields=['source_type', 'source_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} of {self.quantity} ({self.stock_id})"
+
+
+class StockSnapshotQuerySet(models.QuerySet):
+    def take(self, when):
+        """
+        Snapshot every stock's balance as of ``when`` from the ledger, so the
+        snapshot always agrees with the movements it summarises.
+        """
+        balances = Stock.objects.balances_at(when).values_list('pk', 'balance_at')
+        return self.bulk_create(
+            [StockSnapshot(stock_id=pk, balance=balance, taken_at=when) for pk, balance in balances],
+            ignore_conflicts=True,
+        )
+
+
+class StockSnapshot(models.Model):
+    """Balance of a stock at a point in time, so historical balances only replay later movements."""
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name='snapshots')
+    balance = models.IntegerField()
+    taken_at = models.DateTimeField(default=timezone.now)
+
+    objects = StockSnapshotQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['stock', 'taken_at'], name='unique_snapshot_per_stock_time'),
+        ]
+
+    def __str__(self):
+        return f"{self.stock_id}: {self.balance} at {self.taken_at}"
@@ -0,0 +1,5 @@
+from main.search import NameSearch
+from .models import Stock
+
+# Module-level rather than in views so that the importer can clear it too
+stock_search = NameSearch(Stock)
@@ -1,3 +1,91 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from io import StringIO
+
+from django.apps import apps
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+
+from .models import InsufficientStockError, MovementKind, Stock, StockMovement, StockType
 
 # Create your tests here.
+
+
+class StockCounterTests(TestCase):
+    def setUp(self):
+        stock_type = StockType.objects.create(name='Bottle')
+        self.stock = Stock.objects.create(name='9ml Bottle', stock_type=stock_type, opening_quantity=10)
+
+    def test_sale_rejects_negative_balance(self):
+        with self.assertRaises(InsufficientStockError):
+            self.stock.sale(11)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.balance_quantity, 10)
+
+    def test_sale_updates_only_counter_column(self):
+        Stock.objects.filter(pk=self.stock.pk).update(name='Renamed')
+        self.stock.sale(4)
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.name, 'Renamed')
+        self.assertEqual(self.stock.balance_quantity, 6)
+
+    def test_saving_a_stale_instance_keeps_counters(self):
+        # The edit form loads the stock, a bill is posted, then the form saves
+        stale = Stock.objects.get(pk=self.stock.pk)
+        self.stock.sale(4)
+        stale.name = 'Renamed'
+        stale.opening_quantity = 12
+        stale.save()
+        self.stock.refresh_from_db()
+        self.assertEqual((self.stock.name, self.stock.sale_quantity, self.stock.balance_quantity), ('Renamed', 4, 8))
+
+    def test_purchase_and_sale_return(self):
+        self.stock.purchase(5)
+        self.stock.sale(12)
+        self.stock.sale_return(2)
+        self.stock.refresh_from_db()
+        self.assertEqual(
+            (self.stock.purchase_quantity, self.stock.sale_quantity, self.stock.balance_quantity),
+            (5, 10, 5),
+        )
+
+
+class LedgerSeedTests(TestCase):
+    def test_migration_records_what_the_ledger_is_missing(self):
+        stock_type = StockType.objects.create(name='Bottle')
+        stock = Stock.objects.create(name='9ml Bottle', stock_type=stock_type, opening_quantity=10)
+        stock.purchase(5)
+        # As if the stock and its purchase predate the ledger, and only a later sale was recorded
+        StockMovement.objects.all().delete()
+        stock.sale(3)
+
+        import_module('stock.migrations.0006_seed_ledger').seed_ledger(apps, None)
+        opening = StockMovement.objects.get(kind=MovementKind.OPENING)
+        self.assertEqual((opening.quantity, opening.created_at), (10, stock.created_at))
+        self.assertEqual(StockMovement.objects.get(kind=MovementKind.PURCHASE).quantity, 5)
+        self.assertEqual(StockMovement.objects.filter(kind=MovementKind.SALE).count(), 1)
+        call_command('stock_ledger', 'verify', stdout=StringIO())
+
+
+class ConcurrentStockSaleTests(TransactionTestCase):
+    def test_parallel_sales_never_oversell(self):
+        stock_type = StockType.objects.create(name='Bottle')
+        stock = Stock.objects.create(name='9ml Bottle', stock_type=stock_type, opening_quantity=100)
+
+        def sell_one(_):
+            try:
+                Stock.objects.get(pk=stock.pk).sale(1)
+                return True
+            except InsufficientStockError:
+                return False
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=20) as executor:
+            results = list(executor.map(sell_one, range(300)))
+
+        stock.refresh_from_db()
+        self.assertEqual(results.count(True), 100)
+        self.assertEqual(stock.sale_quantity, 100)
+        self.assertEqual(stock.balance_quantity, 0)
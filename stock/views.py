@@ -3,13 +3,19 @@ from django.views.generic import ListView, CreateView, UpdateView
 from django.http import JsonResponse
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
+from main.pagination import KeysetPaginationMixin
+from main.search import page_number
+from .search import stock_search
 
 # Create your views here.
 
 
-class StockListView(LoginRequiredMixin, ListView):
+class StockListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Stock
 
+    def get_queryset(self):
+        return Stock.objects.select_related('stock_type')
+
 
 class StockCreateView(LoginRequiredMixin, CreateView):
     model = Stock
@@ -49,40 +55,19 @@ class StockUpdateView(LoginRequiredMixin, UpdateView):
         return form
 
 @login_required
-def stock_search_ajax_view(request):
+async def stock_search_ajax_view(request):
     """
-    Handles Select2 AJAX search requests for Stock items tied to a specific business.
+    Handles Select2 AJAX search requests for Stock items.
     """
-    # 1. Get the search term from the AJAX request (Select2 passes it as 'term')
-    search_term = request.GET.get('term', '')
-
-    # 2. Query the database
-    # CRITICAL: Filter by business_id first for security and context
-    stocks_queryset = Stock.objects.all()
-
-    # Filter based on the search term (case-insensitive contains lookup)
-    if search_term:
-        stocks_queryset = stocks_queryset.filter(
-            name__icontains=search_term
-        )
-    
-    # Limit the results for performance (Select2 usually fetches 10-30 items per request)
-    stocks = stocks_queryset[:30] 
+    # Select2 passes the search term as 'term' and the page as 'page'
+    stocks, more = await stock_search.asearch(request.GET.get('term', ''), page_number(request))
 
-    # 3. Format the data for Select2
     # Select2 requires a list of dictionaries with 'id' and 'text' keys
-    results = []
-    for stock in stocks:
-        results.append({
-            'id': stock.pk,          # The value to be stored in the model field
-            'text': stock.name       # The text displayed to the user
-        })
+    results = [{'id': pk, 'text': name} for pk, name in stocks]
 
-    # 4. Return the response
     return JsonResponse({
         'results': results,
-        # 'pagination' key is needed if you implement scrolling/loading more results
         'pagination': {
-            'more': stocks_queryset.count() > len(stocks) 
+            'more': more
         }
     })